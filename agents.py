@@ -1,76 +1,170 @@
 import spade
 from spade.behaviour import CyclicBehaviour, OneShotBehaviour
-from spade.message import Message
 import asyncio
-import time
-
-
-class OccupantAgent(spade.agent.Agent):
-    def __init__(self, jid, password, agent_name, environment, mobility):
-        super().__init__(jid, password)
+import logging
+from collections import deque
+from transport import TransportAgent
+import messages
+import logs
+
+occupant_log = logs.get("occupant")
+responder_log = logs.get("responder")
+management_log = logs.get("management")
+
+
+# Agent that moves through the building: every move is written to the building's trace, if it has one
+class MobileAgent(TransportAgent):
+    @property
+    def location(self):
+        return self._location
+
+    @location.setter
+    def location(self, room):
+        previous = getattr(self, "_location", None)
+        self._location = room
+        self.environment.agent_moved(self, previous, room)
+        if self.environment.trace is not None:
+            self.environment.trace.move(self, room)
+
+
+class OccupantAgent(MobileAgent):
+    # policy: routing algorithm towards the exit, "standard" (shortest path avoiding hazards), "optimal" (scored neighbours)
+    # or "planned" (the route the building's planner gave the agent, standard when it has none)
+    def __init__(self, jid, password, agent_name, environment, mobility, transport=None, policy="standard"):
+        super().__init__(jid, password, transport)
         self.agent_name = agent_name
         self.mobility = mobility
+        self.policy = policy
         self.environment = environment
         self.location = environment.get_random_room()
         self.avoid_rooms = set()  # Keep track of rooms to avoid due to fire or earthquake
         self.is_evacuated = False
 
     async def setup(self):
-        update=f"Occupant Agent {self.agent_name} is ready. Location: {self.location.name}, Mobility: {self.mobility}"
-        self.environment.add_update(update)
-        print(update)
+        self.environment.add_update(occupant_log, "Occupant Agent %s is ready. Location: %s, Mobility: %s", self.agent_name, self.location.name, self.mobility)
         if self.mobility=="able-bodied": self.pace=4
         else: self.pace=5
         self.add_behaviour(self.ReceiveInstructionsBehaviour())
 
     class ReceiveInstructionsBehaviour(CyclicBehaviour):
+        async def on_start(self):
+            # Handler for each kind of message
+            self.handlers = {
+                messages.AVOID: self.avoid_rooms,
+                messages.ASSEMBLY_BLOCKED: self.assembly_point_blocked,
+                messages.EVACUATE: self.evacuate,
+                messages.ELEVATOR_GRANTED: self.elevator_granted,
+            }
+            self.deferred = deque()  # Messages that came during an elevator ride, handled once it is over
+
         async def run(self):
-            msg = await self.receive(timeout=0.1)
+            msg = self.deferred.popleft() if self.deferred else await self.receive(timeout=0.1)
             if msg:
-                if msg.body.startswith("Due to"):
-                    room_name = msg.body.split()[-1]  # Extract room name to avoid
-                    self.agent.avoid_rooms.add(room_name)
-
-                elif msg.body.startswith("Assembly Point"):
-                    update=f"{self.agent.agent_name} will redirect his route due to assembly point blocked"
-                    self.agent.environment.add_update(update)
-                    print(update)
-                    await self.redirect_route_to_exit()
-
-                elif msg.body == "EVACUATE":
-                    await self.navigate_to_exit()
-                    
-                elif msg.body == "ELEVATOR ACCESS GRANTED":
-                    return
-                    
-        async def elevator_request(self):
+                handler = self.handlers.get(messages.message_kind(msg))
+                if handler:
+                    await handler(msg)
+
+        async def avoid_rooms(self, msg):
+            for room in messages.message_rooms(msg, self.agent.environment):
+                self.agent.avoid_rooms.add(room.name)
+
+        async def assembly_point_blocked(self, msg):
+            if self.agent.is_evacuated:
+                return
+            self.agent.environment.add_update(occupant_log, "%s will redirect his route due to assembly point blocked", self.agent.agent_name)
+            await self.redirect_route_to_exit()
+
+        async def evacuate(self, msg):
+            await self.navigate_to_exit()
+
+        async def elevator_granted(self, msg):
+            self.agent.environment.add_update(occupant_log, "%s got on the elevator", self.agent.agent_name)
+
+        async def elevator_request(self, arrival):
             agents = self.agent.environment.management_agents.keys()
-            update=f"{self.agent.agent_name} requested Elevator"
-            self.agent.environment.add_update(update)
-            print(update)
+            self.agent.environment.add_update(occupant_log, "%s requested Elevator", self.agent.agent_name)
             for agent in agents:
-                msg = Message(to=str(agent))
-                msg.body = f"Send Elevator to Room"
+                msg = messages.make_message(agent, messages.ELEVATOR_REQUEST, [self.agent.location, arrival], "Send Elevator to Room")
                 await self.send(msg)
+
+        # Call the elevator from the shaft room the agent is in, and wait for the car to drop it off on the arrival
+        # room's floor. Notices to avoid rooms are still taken into account while waiting, the other messages (to
+        # evacuate, a blocked assembly point) are kept in order and handled after the ride, as they would be after a walk.
+        async def ride_elevator(self, arrival):
+            await self.elevator_request(arrival)
+            while True:
+                msg = await self.receive(timeout=1)
+                if not msg:
+                    continue
+                kind = messages.message_kind(msg)
+                if kind == messages.ELEVATOR_ARRIVED:
+                    break
+                if kind in (messages.AVOID, messages.ELEVATOR_GRANTED):
+                    await self.handlers[kind](msg)
+                else:
+                    self.deferred.append(msg)
+            self.agent.location = arrival
         
-        '''
-        
-        # Optimal Algorithm
-        
+        # Next room towards the exit with the agent's routing policy
         def get_next_room_towards_exit(self, target_room):
+            if self.agent.policy == "optimal":
+                return self.optimal_next_room(target_room)
+            if self.agent.policy == "planned":
+                return self.planned_next_room(target_room)
+            return self.standard_next_room(target_room)
+
+        # Rest of the agent's planned route from where it is, None if it has none that is still valid or it is off it
+        def planned_route(self):
+            planner = self.agent.environment.planner
+            if self.agent.policy != "planned" or planner is None or not planner.current():
+                return None
+            route = planner.routes.get(str(self.agent.jid))
+            if route is None or self.agent.location.id not in route:
+                return None
+            return route[route.index(self.agent.location.id):]
+
+        # Planned Algorithm: the next room of the planned route when it goes through target_room
+        def planned_next_room(self, target_room):
+            route = self.planned_route()
+            if route is not None and len(route) > 1 and target_room.id in route:
+                next_room = self.agent.environment.get_room_by_id(route[1])
+                if next_room.floor == self.agent.location.floor:
+                    return next_room
+            return self.standard_next_room(target_room)
+
+        # Keep the agent's place in the first room of its planned route until the departure the planner gave it
+        # (read again every pace, a replan can move it)
+        async def wait_for_departure(self):
+            planner = self.agent.environment.planner
+            clock = self.agent.environment.clock
+            key = str(self.agent.jid)
+            while self.planned_route() is not None and planner.routes[key][0] == self.agent.location.id:
+                leave = planner.leave_time(key)
+                if leave is None or leave - self.agent.pace <= clock.now() + 1e-9:
+                    return
+                await clock.sleep(min(leave - self.agent.pace - clock.now(), self.agent.pace))
+
+        # Staircase room where the planned route changes floors, None without a route
+        def planned_shaft(self):
+            route = self.planned_route()
+            if route is None:
+                return None
+            for room_id, next_id in zip(route, route[1:]):
+                room = self.agent.environment.get_room_by_id(room_id)
+                if room.floor != self.agent.environment.get_room_by_id(next_id).floor:
+                    return room
+            return None
+
+        # Optimal Algorithm
+        def optimal_next_room(self, target_room):
             neighbors = self.agent.location.get_neighbors()
 
             # Filter out rooms to avoid (due to fire or earthquake)
             neighbors = [room for room in neighbors if room.name not in self.agent.avoid_rooms]
             if not neighbors:
-                update = f"No available rooms to move towards! {self.agent.agent_name} is stuck."
-                self.agent.environment.add_update(update)
-                print(update)
+                self.agent.environment.add_update(occupant_log, "No available rooms to move towards! %s is stuck.", self.agent.agent_name, level=logging.WARNING)
                 return None
 
-            # Initialize emergency responder locations
-            responder_locations = [responder.location for responder in self.agent.environment.emergency_agents.values()]
-
             # Helper function to calculate if the room has adjacent hazard rooms
             def has_adjacent_hazards(room):
                 return any(
@@ -83,11 +177,8 @@ class OccupantAgent(spade.agent.Agent):
                 # Distance to target room (lower is better)
                 distance_to_exit = room.distance_to(target_room)
 
-                # Distance to the nearest responder (higher is better for safety)
-                distance_to_responder = min(
-                    (room.distance_to(responder_location) for responder_location in responder_locations),
-                    default=float('inf')  # No responders nearby
-                )
+                # Distance to the nearest responder (higher is better for safety), inf without responders
+                distance_to_responder = self.agent.environment.nearest_responder(room)[0]
 
                 # Hazard proximity penalty (adjacent hazard rooms are less safe)
                 hazard_penalty = 3 if has_adjacent_hazards(room) else 0
@@ -103,48 +194,68 @@ class OccupantAgent(spade.agent.Agent):
             best_neighbor = neighbors[0] if neighbors else None
 
             if best_neighbor:
-                print(f"{self.agent.agent_name} selected {best_neighbor.name} based on updated scoring system.")
+                occupant_log.debug("%s selected %s based on updated scoring system.", self.agent.agent_name, best_neighbor.name)
             else:
-                print(f"{self.agent.agent_name} could not find a valid neighbor.")
+                occupant_log.debug("%s could not find a valid neighbor.", self.agent.agent_name)
 
             return best_neighbor
-            
-            '''
 
-        def get_next_room_towards_exit(self, target_room): #Standard Algorithm
-            neighbors = self.agent.location.get_neighbors()
-            # Filter out rooms to avoid (due to fire or earthquake)
-            neighbors = [room for room in neighbors if room.name not in self.agent.avoid_rooms]
-            if not neighbors:
-                update=f"No available rooms to move towards! {self.agent.agent_name} is stuck."
-                self.agent.environment.add_update(update)
-                print(update)
+        def standard_next_room(self, target_room): #Standard Algorithm
+            # Next room on the shortest path that avoids blocked rooms, looked up in the target's distance field
+            next_room = self.agent.environment.routing.next_room(self.agent.location, target_room)
+            if next_room is None:
+                self.agent.environment.add_update(occupant_log, "No available rooms to move towards! %s is stuck.", self.agent.agent_name, level=logging.WARNING)
+            return next_room
+
+        # Assembly point with the shortest route from the current location
+        def choose_exit(self, methods):
+            routing = self.agent.environment.routing
+            exits = self.agent.environment.assembly_points
+            if not exits:
                 return None
-            # Sort neighbors by distance to the target room and pick the closest
-            neighbors = sorted(neighbors, key=lambda room: room.distance_to(target_room))
-            return neighbors[0] if neighbors else None
+            route = self.planned_route()
+            if route is not None:
+                planned = self.agent.environment.get_room_by_id(route[-1])
+                if planned in exits:
+                    return planned
+            return min(exits, key=lambda room: routing.distance(self.agent.location, room, methods=methods))
+
+        async def walk_to(self, destination):
+            while self.agent.location != destination:
+                next_room = self.get_next_room_towards_exit(destination)
+                await self.agent.environment.clock.sleep(self.agent.pace)
+                if next_room is None:
+                    continue  # Wait for the way to be cleared
+                # Move to the next room and update location
+                occupant_log.debug("%s moved from %s to %s", self.agent.agent_name, self.agent.location.name, next_room.name)
+                self.agent.location = next_room
 
         async def navigate_to_exit(self):
-            exit_a = self.agent.environment.assembly_points[0]
-            exit_b = self.agent.environment.assembly_points[1]
+            routing = self.agent.environment.routing
+            methods = self.agent.environment.floor_change_methods(self.agent.mobility)
+            nearest_exit = self.choose_exit(methods)
+            if nearest_exit is None:
+                self.agent.environment.add_update(occupant_log, "No assembly point left! %s is stuck.", self.agent.agent_name, level=logging.WARNING)
+                return
 
-            # Choose the nearest exit based on a distance calculation
-            exit_a_dist = self.agent.location.distance_to(exit_a)
-            exit_b_dist = self.agent.location.distance_to(exit_b)
-            nearest_exit = exit_a if exit_a_dist <= exit_b_dist else exit_b
-
-            print(f"{self.agent.agent_name} is navigating from {self.agent.location.name} to nearest exit at {nearest_exit.name}")
+            occupant_log.debug("%s is navigating from %s to nearest exit at %s", self.agent.agent_name, self.agent.location.name, nearest_exit.name)
+            await self.wait_for_departure()
 
             # Check if the current location and exit are on the same floor
             if self.agent.location.floor != nearest_exit.floor:
-                elevator = self.agent.environment.get_floor(self.agent.location.floor).elevator
-                if self.agent.mobility == "disabled":
+                dist_elev, elevator = routing.nearest_shaft(self.agent.location, nearest_exit, methods=("elevator",))
+                planned = self.planned_shaft()
+                if planned is not None:
+                    destination = planned
+                    method = "staircase"
+                elif "staircase" not in methods:
                     destination = elevator
                     method = "elevator"
+                elif "elevator" not in methods:
+                    dist_stairs, destination = routing.nearest_shaft(self.agent.location, nearest_exit, methods=("staircase",))
+                    method = "staircase"
                 else:
-                    staircase = self.agent.environment.get_floor(self.agent.location.floor).staircase
-                    dist_elev = self.agent.location.distance_to(elevator)
-                    dist_stairs = self.agent.location.distance_to(staircase)
+                    dist_stairs, staircase = routing.nearest_shaft(self.agent.location, nearest_exit, methods=("staircase",))
                     if dist_elev <= dist_stairs:
                         destination = elevator
                         method = "elevator"
@@ -152,36 +263,35 @@ class OccupantAgent(spade.agent.Agent):
                         destination = staircase
                         method = "staircase"
 
-                update=f"{self.agent.agent_name} is moving to {destination.name} to change floors using the {method}."
-                self.agent.environment.add_update(update)
-                print(update)
+                self.agent.environment.add_update(occupant_log, "%s is moving to %s to change floors using the %s.", self.agent.agent_name, destination.name, method)
                 # Navigate to the elevator or staircase first
-                while self.agent.location != destination:
-                    next_room = self.get_next_room_towards_exit(destination)
-                    await asyncio.sleep(self.agent.pace)
-                    print(f"{self.agent.agent_name} moved from {self.agent.location.name} to {next_room.name}")
-                    self.agent.location = next_room
+                await self.walk_to(destination)
                 # After reaching elevator or staircase, move to the target floor
                 dest_room = self.agent.environment.get_room(nearest_exit.floor - 1, destination.coordinates[1],
                                                       self.agent.location.coordinates[2])
-                self.agent.location = dest_room
-                await self.elevator_request()
-                await asyncio.sleep(4)
-                update=f"{self.agent.agent_name} is now on floor {self.agent.location.floor} after using the {method}. Continuing to the exit."
-                self.agent.environment.add_update(update)
-                print(update)
+                if method == "elevator":
+                    await self.ride_elevator(dest_room)
+                else:
+                    self.agent.location = dest_room
+                    await self.agent.environment.clock.sleep(4)
+                self.agent.environment.add_update(occupant_log, "%s is now on floor %s after using the %s. Continuing to the exit.", self.agent.agent_name, self.agent.location.floor, method)
             while self.agent.location != nearest_exit:
+                # The assembly point may have been blocked on the way
+                if nearest_exit not in self.agent.environment.assembly_points and self.agent.environment.assembly_points:
+                    nearest_exit = self.choose_exit(methods)
+                    continue
                 next_room = self.get_next_room_towards_exit(nearest_exit)
-                await asyncio.sleep(self.agent.pace)
+                await self.agent.environment.clock.sleep(self.agent.pace)
+                if next_room is None:
+                    continue  # Wait for the way to be cleared
                 # Move to the next room and update location
-                print(f"{self.agent.agent_name} moved from {self.agent.location.name} to {next_room.name}")
+                occupant_log.debug("%s moved from %s to %s", self.agent.agent_name, self.agent.location.name, next_room.name)
                 self.agent.location = next_room
             if self.agent.location == nearest_exit:
-                update=f"{self.agent.agent_name} has arrived at the exit at {nearest_exit.name}!"
-                self.agent.environment.add_update(update)
-                print(update)
+                self.agent.environment.add_update(occupant_log, "%s has arrived at the exit at %s!", self.agent.agent_name, nearest_exit.name)
                 self.agent.location="Evacuated"
-                self.agent.finish_time=time.time()
+                self.agent.finish_time=self.agent.environment.clock.now()
+                self.agent.environment.occupant_evacuated(self.agent.finish_time)
                 self.agent.is_evacuated=True
 
         async def redirect_route_to_exit(self):
@@ -195,278 +305,351 @@ ________________________________________________________________________________
 
 '''
 
-class EmergencyResponderAgent(spade.agent.Agent):
-    def __init__(self, jid, password, responder_name, environment, job):
-        super().__init__(jid, password)
+class EmergencyResponderAgent(MobileAgent):
+    def __init__(self, jid, password, responder_name, environment, job, transport=None):
+        super().__init__(jid, password, transport)
         self.responder_name=responder_name
         self.environment = environment
         self.location=environment.get_random_room()
         self.job = job
 
     async def setup(self):
-        print(f"Emergency Responder Agent {self.responder_name} is ready.")
+        responder_log.info("Emergency Responder Agent %s is ready.", self.responder_name)
         self.add_behaviour(self.EmergencyBehaviour())
 
     class EmergencyBehaviour(CyclicBehaviour):
+        async def on_start(self):
+            # Kind of message -> (job that answers it, handler)
+            self.handlers = {
+                messages.FIRE: ("firefighter", self.extinguish_fire),
+                messages.EARTHQUAKE: ("Rescue Worker", self.remove_wreckage),
+                messages.ATTACK: ("Security Officer", self.control_attack),
+                messages.PARAMEDICS: ("Paramedic", self.provide_medical_help),
+            }
+
         async def run(self):
             msg = await self.receive(timeout=0.1)
             # Check for fire in rooms
             if msg:
-                if msg.body.startswith("Fire") and self.agent.job == "firefighter":
-                    room = msg.body.split()[-1]  # Extract room name to avoid
-                    room = self.agent.environment.get_room(int(room[0])-1,int(room[1]),int(room[2]))
-                    room.begin=time.time()
-                    await self.agent.navigate_to_room(room)
-                    update=f"{self.agent.responder_name} has arrived at {room.name}. Fire extinguished."
-                    self.agent.environment.add_update(update)
-                    print(update)
-                    self.agent.environment.responses+=1
-                    self.agent.environment.num_fires[0]+=1
-                    room.is_on_fire = False
-                    room.end=time.time()
-                    self.agent.environment.times.append(room.end-room.begin) 
-                    room.noted_fire = False
-
-                elif msg.body.startswith("Earthquake") and self.agent.job=="Rescue Worker":
-                    room = msg.body.split()[-1]  # Extract room name to avoid
-                    room = self.agent.environment.get_room(int(room[0])-1,int(room[1]),int(room[2]))
-                    room.begin=time.time()
-                    await self.agent.navigate_to_room(room)
-                    update=f"{self.agent.responder_name} has arrived at {room.name}. Wreckage removed."
-                    self.agent.environment.add_update(update)
-                    print(update)
-                    self.agent.environment.responses+=1
-                    self.agent.environment.num_earthquakes[0]+=1
-                    room.end=time.time()
-                    self.agent.environment.times.append(room.end-room.begin) 
-                    room.is_damaged = False
-                    room.noted_earthquake = False
-                    
-                elif msg.body.startswith("Attack") and self.agent.job=="Security Officer":
-                    room = msg.body.split()[-1]  # Extract room name to avoid
-                    room = self.agent.environment.get_room(int(room[0])-1,int(room[1]),int(room[2]))
-                    room.begin=time.time()
-                    await self.agent.navigate_to_room(room)
-                    update=f"{self.agent.responder_name} has arrived at {room.name}. Attack controlled."
-                    self.agent.environment.add_update(update)
-                    print(update)
-                    self.agent.environment.num_attacks[0]+=1
-                    self.agent.environment.responses+=1
-                    room.end=time.time()
-                    self.agent.environment.times.append(room.end-room.begin) 
-                    room.is_taken = False
-                    room.noted_attack = False
-
-                elif msg.body.startswith("Paramedics") and self.agent.job=="Paramedic":
-                    room = msg.body.split()[-1]  # Extract room name to avoid
-                    room = self.agent.environment.get_room(int(room[0])-1,int(room[1]),int(room[2]))
-                    room.begin=time.time()
-                    await self.agent.navigate_to_room(room)
-                    room.end=time.time()
-                    self.agent.environment.times.append(room.end-room.begin) 
-                    update=f"{self.agent.responder_name} has arrived at {room.name}. Providing medical help!"
-                    self.agent.environment.add_update(update)
-                    print(update)
-                    self.agent.environment.responses+=1
-                    await asyncio.sleep(2)
-                    update=f"{self.agent.responder_name} is leaving! Every occupant is now ok!"
-                    self.agent.environment.add_update(update)
-                    print(update)
+                job, handler = self.handlers.get(messages.message_kind(msg), (None, None))
+                if handler and self.agent.job == job:
+                    incident = messages.message_incident(msg)
+                    for room in messages.message_rooms(msg, self.agent.environment):
+                        await handler(room, incident)
+
+        # Tell the dispatcher the incident is solved, and the management that this responder is free again
+        async def close_incident(self, incident):
+            if incident is None:
+                return
+            self.agent.environment.dispatcher.close(incident)
+            for agent in self.agent.environment.management_agents.keys():
+                await self.send(messages.make_message(agent, messages.INCIDENT_DONE, incident=incident))
+
+        async def extinguish_fire(self, room, incident=None):
+            room.begin=self.agent.environment.clock.now()
+            if not await self.agent.navigate_to_room(room, incident):
+                return  # Sent to a more urgent incident on the way
+            self.agent.environment.add_update(responder_log, "%s has arrived at %s. Fire extinguished.", self.agent.responder_name, room.name)
+            self.agent.environment.responses+=1
+            self.agent.environment.num_fires[0]+=1
+            room.is_on_fire = False
+            room.end=self.agent.environment.clock.now()
+            self.agent.environment.add_response_time(room, room.end-room.begin)
+            room.noted_fire = False
+            self.agent.environment.room_cleared(room)
+            await self.close_incident(incident)
+
+        async def remove_wreckage(self, room, incident=None):
+            room.begin=self.agent.environment.clock.now()
+            if not await self.agent.navigate_to_room(room, incident):
+                return  # Sent to a more urgent incident on the way
+            self.agent.environment.add_update(responder_log, "%s has arrived at %s. Wreckage removed.", self.agent.responder_name, room.name)
+            self.agent.environment.responses+=1
+            self.agent.environment.num_earthquakes[0]+=1
+            room.end=self.agent.environment.clock.now()
+            self.agent.environment.add_response_time(room, room.end-room.begin)
+            room.is_damaged = False
+            room.noted_earthquake = False
+            self.agent.environment.room_cleared(room)
+            await self.close_incident(incident)
+
+        async def control_attack(self, room, incident=None):
+            room.begin=self.agent.environment.clock.now()
+            if not await self.agent.navigate_to_room(room, incident):
+                return  # Sent to a more urgent incident on the way
+            self.agent.environment.add_update(responder_log, "%s has arrived at %s. Attack controlled.", self.agent.responder_name, room.name)
+            self.agent.environment.num_attacks[0]+=1
+            self.agent.environment.responses+=1
+            room.end=self.agent.environment.clock.now()
+            self.agent.environment.add_response_time(room, room.end-room.begin)
+            room.is_taken = False
+            room.noted_attack = False
+            self.agent.environment.room_cleared(room)
+            await self.close_incident(incident)
+
+        async def provide_medical_help(self, room, incident=None):
+            room.begin=self.agent.environment.clock.now()
+            if not await self.agent.navigate_to_room(room, incident):
+                return  # Sent to a more urgent incident on the way
+            room.end=self.agent.environment.clock.now()
+            self.agent.environment.add_response_time(room, room.end-room.begin)
+            self.agent.environment.add_update(responder_log, "%s has arrived at %s. Providing medical help!", self.agent.responder_name, room.name)
+            self.agent.environment.responses+=1
+            await self.agent.environment.clock.sleep(2)
+            self.agent.environment.add_update(responder_log, "%s is leaving! Every occupant is now ok!", self.agent.responder_name)
+            await self.close_incident(incident)
             
 
     def get_next_room_towards_destination(self, target_room):
-
-        neighbors = self.location.get_neighbors()
-        # Filter out rooms to avoid (due to fire or earthquake)
-        neighbors = [room for room in neighbors]
-        if not neighbors:
-            print(f"No available rooms to move towards! {self.responder_name} is stuck.")
-            return None
-        # Sort neighbors by distance to the target room and pick the closest
-        neighbors = sorted(neighbors, key=lambda room: room.distance_to(target_room))
-        return neighbors[0] if neighbors else None
-
-    async def navigate_to_room(self, room):
+        # Responders head into hazards, so their route ignores the rooms occupants avoid
+        next_room = self.environment.routing.next_room(self.location, target_room, avoid=False)
+        if next_room is None:
+            responder_log.warning("No available rooms to move towards! %s is stuck.", self.responder_name)
+        return next_room
+
+    # Walk to the room. With an incident from the dispatcher, give up as soon as it is given to someone else:
+    # returns whether the responder got there with the incident still its own
+    async def navigate_to_room(self, room, incident=None):
+        dispatcher = self.environment.dispatcher
+        def on_duty():
+            return incident is None or dispatcher.still_assigned(self, incident)
 
         # Check if the current location and exit are on the same floor
         if self.location.floor != room.floor:
-            elevator = self.environment.get_floor(self.location.floor).elevator
-            staircase = self.environment.get_floor(self.location.floor).staircase
-            dist_elev = self.location.distance_to(elevator)
-            dist_stairs = self.location.distance_to(staircase)
+            dist_elev, elevator = self.environment.routing.nearest_shaft(self.location, room, avoid=False, methods=("elevator",))
+            dist_stairs, staircase = self.environment.routing.nearest_shaft(self.location, room, avoid=False, methods=("staircase",))
             if dist_elev <= dist_stairs:
                 destination = elevator
                 method = "elevator"
             else:
                 destination = staircase
                 method = "staircase"
-            update=f"{self.responder_name} is moving to {destination.name} to change floors using the {method}."
-            self.environment.add_update(update)
-            print(update)
+            self.environment.add_update(responder_log, "%s is moving to %s to change floors using the %s.", self.responder_name, destination.name, method)
             # Navigate to the elevator or staircase first
             while self.location != destination:
                 next_room = self.get_next_room_towards_destination(destination)
-                await asyncio.sleep(1.5)
-                print(f"{self.responder_name} moved from {self.location.name} to {next_room.name}")
+                await self.environment.clock.sleep(1.5)
+                if not on_duty():
+                    return False
+                if next_room is None:
+                    continue
+                responder_log.debug("%s moved from %s to %s", self.responder_name, self.location.name, next_room.name)
                 self.location = next_room
             # After reaching elevator or staircase, move to the target floor
             dest_room = self.environment.get_room(room.floor - 1, destination.coordinates[1],
                                                   self.location.coordinates[2])
             self.location = dest_room
-            await asyncio.sleep(4)
-            update=f"{self.responder_name} is now on floor {self.location.floor} after using the {method}."
-            self.environment.add_update(update)
-            print(update)
+            await self.environment.clock.sleep(4)
+            self.environment.add_update(responder_log, "%s is now on floor %s after using the %s.", self.responder_name, self.location.floor, method)
         while self.location != room:
             next_room = self.get_next_room_towards_destination(room)
-            await asyncio.sleep(1.5)
+            await self.environment.clock.sleep(1.5)
+            if not on_duty():
+                return False
+            if next_room is None:
+                continue
             # Move to the next room and update location
-            print(f"{self.responder_name} moved from {self.location.name} to {next_room.name}")
+            responder_log.debug("%s moved from %s to %s", self.responder_name, self.location.name, next_room.name)
             self.location = next_room
-        if self.location == room:
-            return
+        return incident is None or dispatcher.arrive(self, incident)
             
 '''
 _________________________________________________________________________________________________________________
 '''
 
-class BuildingManagementAgent(spade.agent.Agent):
-    def __init__(self, jid, password, environment, management_name):
-        super().__init__(jid, password)
+class BuildingManagementAgent(TransportAgent):
+    def __init__(self, jid, password, environment, management_name, transport=None, consistency_check=False, scan_interval=5):
+        super().__init__(jid, password, transport)
         self.environment = environment  # Reference to building environment with exits, elevators, rooms, etc.
         self.alarm_triggered = False
-        self.elevator_locked = False  # Elevator is locked by default during emergencies
+        self.elevator_locked = False  # Elevators locked for general use once a fire is detected, disabled occupants can still call them
         self.room_status = {}
         self.management_name=management_name
         self.evac_msg=False  # Track each room's status (e.g., fire, damage, occupancy)
+        self.consistency_check = consistency_check  # Also scan every room now and then, in case a change was not published
+        self.scan_interval = scan_interval
 
     async def setup(self):
-        print(f"Building Management Agent {str(self.management_name)} is ready.")
+        management_log.info("Building Management Agent %s is ready.", str(self.management_name))
         self.add_behaviour(self.SendEvacuationInstructionsBehaviour())
         self.add_behaviour(self.ManageBuildingBehaviour())
-        self.add_behaviour(self.ElevatorRequestHandler())
+        # Only elevator requests go to this behaviour
+        self.add_behaviour(self.ElevatorRequestHandler(), messages.kind_template(messages.ELEVATOR_REQUEST))
+        for car in self.environment.elevators.all_cars():
+            self.add_behaviour(self.ElevatorBehaviour(car))
+        self.add_behaviour(self.DispatchBehaviour(), messages.kind_template(messages.INCIDENT_DONE))
+        if self.consistency_check:
+            self.add_behaviour(self.ConsistencyCheckBehaviour())
         
     class SendEvacuationInstructionsBehaviour(OneShotBehaviour):
         async def run(self):
-            occupants = self.agent.environment.agents.keys()
-            tasks = []
-            for i in occupants:
-                # Send an evacuation message to each OccupantAgent
-                msg = Message(to=str(i))  # Replace with real occupant agent JIDs
-                msg.body = "EVACUATE"  # The action or instruction for the occupant agent
-                tasks.append(self.send(msg))
-                print(f"Sent evacuation message to {msg.to}")
-            await asyncio.gather(*tasks)
-
+            # Plan everyone's route first, they read it from the planner as they go
+            planner = self.agent.environment.planner
+            if planner is not None:
+                planned = planner.plan(self.agent.environment.plannable_occupants(), self.agent.environment.clock.now())
+                management_log.info("Planned the evacuation routes of %s occupants", planned)
+            # Send an evacuation message to each OccupantAgent, all at once
+            sent = await messages.broadcast(self, self.agent.environment.occupant_jids(), messages.EVACUATE, body="EVACUATE")
+            management_log.info("Sent evacuation message to %s occupant agents", sent)
+
+    # Elevator requests are queued at the car of their shaft, the cars pick them up in their own time
     class ElevatorRequestHandler(CyclicBehaviour):
         async def run(self):
             msg = await self.receive(timeout=0.5)           
-            if msg and msg.body.startswith("Send Elevator"):
-                await self.unlock_elevator_for_disabled()
-                confirmation_msg = Message(to=str(msg.sender))
-                confirmation_msg.body = "ELEVATOR ACCESS GRANTED"
-                await self.send(confirmation_msg)
-                update=f"Elevator access granted."
-                self.agent.environment.add_update(update)
-                print(update)
-                await asyncio.sleep(1)
-                await self.lock_elevator()
-        async def lock_elevator(self):
-            self.elevator_locked = True
-            print("Elevator locked for general use due to hazard, but it can be unlocked for disabled occupants if needed.")
-
-        async def unlock_elevator_for_disabled(self):
-            self.elevator_locked = False
+            if msg:
+                rooms = messages.message_rooms(msg, self.agent.environment)
+                if len(rooms) != 2:
+                    return
+                origin, destination = rooms
+                self.agent.environment.elevators.call(str(msg.sender.bare()), origin, destination)
+                self.agent.environment.add_update(management_log, "Elevator called to %s for floor %s.", origin.name, destination.floor)
+
+    # Runs one elevator car, and tells its passengers when they got on and when they got off
+    class ElevatorBehaviour(CyclicBehaviour):
+        def __init__(self, car):
+            super().__init__()
+            self.car = car
+
+        async def run(self):
+            on, off = await self.car.step()
+            for call in on:
+                if call.on_arrival is None:
+                    await self.send(messages.make_message(call.passenger, messages.ELEVATOR_GRANTED, [call.origin], "ELEVATOR ACCESS GRANTED"))
+            for call in off:
+                if call.on_arrival is not None:
+                    call.on_arrival(call)
+                else:
+                    await self.send(messages.make_message(call.passenger, messages.ELEVATOR_ARRIVED, [call.destination], f"Arrived at floor {call.destination.floor}"))
+
+    def lock_elevator(self):
+        self.elevator_locked = True
+        self.environment.add_update(management_log, "Elevator locked for general use due to hazard, but it can be unlocked for disabled occupants if needed.")
+
+    def unlock_elevator(self):
+        self.elevator_locked = False
+
+    # A responder is free again: give it (or another one) the next incident waiting
+    class DispatchBehaviour(CyclicBehaviour):
+        async def run(self):
+            msg = await self.receive(timeout=0.5)
+            if msg:
+                await send_assignments(self)
 
     class ManageBuildingBehaviour(CyclicBehaviour):
+        async def on_start(self):
+            self.pending_avoid = []  # (room, why) to tell the occupants about, sent together once the burst is handled
+
         async def run(self):
-            # Monitor the environment for any fire or earthquake events
-            await asyncio.sleep(0.05)  # Check every 0.5 seconds (can be adjusted)
-            # Check for fire in rooms
-            for floor in self.agent.environment.floors:
-                for row in floor.rooms:
-                    for room in row:
-                        if room.is_on_fire and room.noted_fire==False:
-                            for someone in self.agent.environment.agents.values():
-                                if someone.location==room:
-                                    await self.send_paramedics(room, "Fire")
-                            self.agent.environment.num_fires[1]+=1
-                            update=f"{self.agent.management_name} detected fire in {room.name}!"
-                            self.agent.environment.add_update(update)
-                            print(update)
-                            room.noted_fire=True
-                            # Send evacuation instruction to avoid fire
-                            await self.send_emergency_instruction(room, "Fire")
-                            await self.send_evacuate_instruction(room,"Fire")
-                        if room.is_damaged and room.noted_earthquake==False:
-                            for someone in self.agent.environment.agents.values():
-                                if someone.location==room:
-                                    await self.send_paramedics(room, "Earthquake")
-                            if room.light==False:
-                                update=f"{self.agent.management_name} detected lights off due to Earthquake"
-                                self.agent.environment.add_update(update)
-                                print(update)
-                                await asyncio.sleep(1)
-                                room.light=True
-                                update=f"Lights turned on"
-                                self.agent.environment.add_update(update)
-                                print(update)
-                            self.agent.environment.num_earthquakes[1]+=1
-                            room.noted_earthquake=True
-                            if room in self.agent.environment.assembly_points:
-                                self.agent.environment.assembly_points.remove(room)
-                                update=f"Assembly Point {room.name} blocked due to earthquake damage"
-                                self.agent.environment.add_update(update)
-                                print(update)
-                                await self.send_assembly_point_blocked(room)
-                            else:
-                                update=f"{self.agent.management_name} detected earthquake damage in {room.name}!"
-                                self.agent.environment.add_update(update)
-                                print(update)
-                                # Send evacuation instruction to avoid damaged rooms
-                                await self.send_evacuate_instruction(room,"Earthquake")
-                                await self.send_emergency_instruction(room, "Earthquake")
-                        if room.is_taken and room.noted_attack==False:
-                            for someone in self.agent.environment.agents.values():
-                                if someone.location==room:
-                                    await self.send_paramedics(room, "Attack")
-                            update=f"{self.agent.management_name} detected attack in {room.name}!"
-                            self.agent.environment.add_update(update)
-                            print(update)
-                            self.agent.environment.num_attacks[1]+=1
-                            room.noted_attack=True
-                            await self.send_emergency_instruction(room, "Attack")
-                            await self.send_evacuate_instruction(room,"Attack")
+            # Wait for the rooms to report a hazard, instead of scanning the whole building
+            # (the timeout only lets the behaviour notice it was killed)
+            try:
+                kind, room = await asyncio.wait_for(self.agent.environment.hazard_events.get(), timeout=1)
+            except asyncio.TimeoutError:
+                return
+            await self.handle_room(room)
+            # Handle every other hazard already reported, then notify the occupants once for all of them
+            while not self.agent.environment.hazard_events.empty():
+                kind, room = self.agent.environment.hazard_events.get_nowait()
+                await self.handle_room(room)
+            await self.flush_avoid_notices()
+            self.update_plan()
+            await send_assignments(self)
+
+        # Raise the alarms for the hazards of a room that were not noted yet
+        async def handle_room(self, room):
+            if room.is_on_fire and room.noted_fire==False:
+                if self.agent.environment.occupants_in(room):
+                    await self.send_paramedics(room, "Fire")
+                self.agent.environment.num_fires[1]+=1
+                self.agent.environment.add_update(management_log, "%s detected fire in %s!", self.agent.management_name, room.name)
+                room.noted_fire=True
+                if not self.agent.elevator_locked:
+                    self.agent.lock_elevator()
+                # Send evacuation instruction to avoid fire
+                await self.send_emergency_instruction(room, "Fire")
+                await self.send_evacuate_instruction(room,"Fire")
+            if room.is_damaged and room.noted_earthquake==False:
+                if self.agent.environment.occupants_in(room):
+                    await self.send_paramedics(room, "Earthquake")
+                if room.light==False:
+                    self.agent.environment.add_update(management_log, "%s detected lights off due to Earthquake", self.agent.management_name)
+                    await self.agent.environment.clock.sleep(1)
+                    room.light=True
+                    self.agent.environment.add_update(management_log, "Lights turned on")
+                self.agent.environment.num_earthquakes[1]+=1
+                room.noted_earthquake=True
+                if room in self.agent.environment.assembly_points:
+                    self.agent.environment.assembly_points.remove(room)
+                    self.agent.environment.routing.remove_target(room)
+                    self.agent.environment.add_update(management_log, "Assembly Point %s blocked due to earthquake damage", room.name)
+                    await self.send_assembly_point_blocked(room)
+                else:
+                    self.agent.environment.add_update(management_log, "%s detected earthquake damage in %s!", self.agent.management_name, room.name)
+                    # Send evacuation instruction to avoid damaged rooms
+                    await self.send_evacuate_instruction(room,"Earthquake")
+                    await self.send_emergency_instruction(room, "Earthquake")
+            if room.is_taken and room.noted_attack==False:
+                if self.agent.environment.occupants_in(room):
+                    await self.send_paramedics(room, "Attack")
+                self.agent.environment.add_update(management_log, "%s detected attack in %s!", self.agent.management_name, room.name)
+                self.agent.environment.num_attacks[1]+=1
+                room.noted_attack=True
+                await self.send_emergency_instruction(room, "Attack")
+                await self.send_evacuate_instruction(room,"Attack")
                                                             
 
         async def send_evacuate_instruction(self, room, why):
-            # Send evacuation instruction to all occupants to avoid this room
-            update=f"Agents will avoid {room.name} due to {why}"
-            self.agent.environment.add_update(update)
-            print(update)
-            occupants = self.agent.environment.agents.keys()
-            for occupant in occupants:
-                msg = Message(to=str(occupant))
-                msg.body = f"Due to {why}, avoid room {room.name}"
-                await self.send(msg)
+            # Tell all occupants to avoid this room, the notice goes out with the others of the same burst
+            self.agent.environment.add_update(management_log, "Agents will avoid %s due to %s", room.name, why)
+            self.agent.environment.routing.block(room)
+            self.pending_avoid.append((room, why))
+
+        # One message per occupant with every room to avoid
+        async def flush_avoid_notices(self):
+            if not self.pending_avoid:
+                return
+            rooms = [room for room, why in self.pending_avoid]
+            body = "; ".join(f"Due to {why}, avoid room {room.name}" for room, why in self.pending_avoid)
+            self.pending_avoid = []
+            await messages.broadcast(self, self.agent.environment.occupant_jids(), messages.AVOID, rooms, body)
                 
+        # Plan again the routes that the rooms blocked or the assembly points removed since made unusable.
+        # The occupants read their routes from the planner, so they follow the new ones from their next move.
+        def update_plan(self):
+            environment = self.agent.environment
+            planner = environment.planner
+            if planner is None or planner.start is None or planner.current():
+                return
+            replanned = planner.replan(environment.plannable_occupants(), environment.clock.now())
+            if replanned:
+                environment.add_update(management_log, "Evacuation routes of %s occupants replanned", replanned)
+
+        # Incidents are queued in the dispatcher, and sent to the responders once the burst is handled
         async def send_paramedics(self, room, why):
-            agents = self.agent.environment.emergency_agents.keys()
-            for agent in agents:
-                msg = Message(to=str(agent))
-                msg.body = f"Paramedics to {room.name}!"
-                await self.send(msg)
+            self.agent.environment.dispatcher.open(messages.PARAMEDICS, room)
                 
         async def send_emergency_instruction(self, room, why):
-            agents = self.agent.environment.emergency_agents.keys()
-            for agent in agents:
-                msg = Message(to=str(agent))
-                msg.body = f"{why} in {room.name}"
-                await self.send(msg)
+            self.agent.environment.dispatcher.open(messages.HAZARD_KINDS[why], room)
 
         async def send_assembly_point_blocked(self, room):
-            occupants = self.agent.environment.agents.keys()
-            for occupant in occupants:
-                msg = Message(to=str(occupant))
-                msg.body = f"Assembly room {room.name} blocked due to earthquake damage."
-                await self.send(msg)
+            await messages.broadcast(self, self.agent.environment.occupant_jids(), messages.ASSEMBLY_BLOCKED, [room], f"Assembly room {room.name} blocked due to earthquake damage.")
+
+    # Optional full scan of the building, the old way of finding hazards: catches any flag that was set without publishing an event
+    class ConsistencyCheckBehaviour(ManageBuildingBehaviour):
+        async def run(self):
+            await self.agent.environment.clock.sleep(self.agent.scan_interval)
+            for room in self.agent.environment.unnoted_rooms():
+                await self.handle_room(room)
+            await self.flush_avoid_notices()
+            self.update_plan()
+            await send_assignments(self)
+
+
+# Send the responders the incidents the dispatcher gives them, from a behaviour of the management agent
+async def send_assignments(behaviour):
+    environment = behaviour.agent.environment
+    for responder, incident in environment.dispatcher.assign():
+        room = incident.room
+        body = f"Paramedics to {room.name}!" if incident.kind == messages.PARAMEDICS else f"{incident.kind.capitalize()} in {room.name}"
+        environment.add_update(management_log, "%s dispatched to %s (%s)", responder.responder_name, room.name, incident.kind)
+        await behaviour.send(messages.make_message(responder.jid, incident.kind, [room], body, incident.id))
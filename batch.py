@@ -0,0 +1,119 @@
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from environment import PERFORMANCE_FIELDS
+from simulation import run_headless
+import instrumentation
+import logs
+
+
+# Runs in a worker process: one replicate with its own seed and its own Building, no dashboard nor XMPP.
+# With metrics, the run is instrumented and the summary of its counters and timers is returned too (else None)
+# The logs of a quiet run are off, unless they go to log_dir/run_<seed>.log
+# A run still going after max_ticks ticks is stopped, its values are None
+def run_replicate(test, seed, quiet=True, trace_dir=None, metrics=False, log_dir=None, log_level="info", max_ticks=2000):
+    start = time.perf_counter()
+    trace = os.path.join(trace_dir, f"run_{seed}.trace") if trace_dir else None
+    log = os.path.join(log_dir, f"run_{seed}.log") if log_dir else None
+    logs.configure(log_level if log or not quiet else "off", log, console=not quiet)
+    if metrics:
+        instrumentation.enable()
+        instrumentation.registry.reset()
+    try:
+        values = run_headless(seed, trace=trace, max_ticks=max_ticks)
+    finally:
+        summary = instrumentation.registry.summary() if metrics else None
+        instrumentation.disable()
+        logs.stop()
+    return test, seed, values, time.perf_counter() - start, summary
+
+
+# Mean, standard deviation, min and max of every performance field over all the runs
+def summarize(results):
+    summary = {}
+    n = len(results)
+    for k, field in enumerate(PERFORMANCE_FIELDS):
+        column = [values[k] for values in results]
+        mean = sum(column) / n if n > 0 else 0
+        var = sum((x - mean) ** 2 for x in column) / (n - 1) if n > 1 else 0
+        summary[field] = {
+            "Total": sum(column),
+            "Mean": mean,
+            "Std": math.sqrt(var),
+            "Min": min(column) if column else 0,
+            "Max": max(column) if column else 0,
+        }
+    return summary
+
+
+# Monte Carlo batch: n replicates over a process pool, every row is written to the output file as soon as its run finishes.
+# With a trace_dir, every run is also recorded in trace_dir/run_<seed>.trace.
+# With a metrics path, every run is instrumented and its summary written there as one JSON line per run.
+# With a log_dir, the logs of every run from log_level up are written to log_dir/run_<seed>.log as JSON lines
+# A run stopped after max_ticks ticks gets a row with "no" under Finished and no values, and is left out of the summary
+# (its rows give the number of finished runs under Finished)
+def run_batch(n=50, output="original_results.csv", workers=None, base_seed=None, quiet=True, trace_dir=None, metrics=None, log_dir=None, log_level="info",
+              max_ticks=2000):
+    for directory in (trace_dir, log_dir):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    if base_seed is None:
+        base_seed = random.SystemRandom().randrange(2**31)
+    workers = workers or os.cpu_count()
+    results = []
+    metrics_file = open(metrics, "w") if metrics else None
+    with open(output, "w", newline="") as file, ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = csv.writer(file)
+        writer.writerow(["Test", "Seed", "Finished"] + PERFORMANCE_FIELDS + ["Wall Time"])
+        file.flush()
+        futures = [pool.submit(run_replicate, i + 1, base_seed + i, quiet, trace_dir, metrics_file is not None, log_dir, log_level, max_ticks)
+                   for i in range(n)]
+        unfinished = 0
+        for future in as_completed(futures):
+            test, seed, values, wall, run_metrics = future.result()
+            finished = values is not None
+            writer.writerow([test, seed, "yes" if finished else "no"] + (values if finished else [""] * len(PERFORMANCE_FIELDS)) + [f"{wall:.3f}"])
+            file.flush()
+            if metrics_file is not None:
+                metrics_file.write(json.dumps({"test": test, "seed": seed, "wall": wall, "metrics": run_metrics}) + "\n")
+                metrics_file.flush()
+            if finished:
+                results.append(values)
+                print(f"Test {test} (seed {seed}) finished in {wall:.2f}s ({len(results) + unfinished}/{n})")
+            else:
+                unfinished += 1
+                print(f"Test {test} (seed {seed}) stopped after {max_ticks} ticks in {wall:.2f}s ({len(results) + unfinished}/{n})")
+
+        summary = summarize(results)
+        writer.writerow([])
+        for stat in ["Total", "Mean", "Std", "Min", "Max"]:
+            writer.writerow([stat, "", len(results)] + [summary[field][stat] for field in PERFORMANCE_FIELDS])
+
+    if metrics_file is not None:
+        metrics_file.close()
+        print(f"Run metrics saved to '{metrics}'.")
+    if unfinished:
+        print(f"{unfinished} of {n} runs did not finish within {max_ticks} ticks, left out of the summary.")
+    print(f"Results saved to '{output}'.")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless Monte Carlo batch of evacuation runs")
+    parser.add_argument("-n", "--runs", type=int, default=50)
+    parser.add_argument("-o", "--output", default="original_results.csv")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-s", "--seed", type=int, default=None, help="seed of the first run, run i uses seed+i")
+    parser.add_argument("-t", "--trace-dir", default=None, help="record every run in a binary trace file in this directory")
+    parser.add_argument("-m", "--metrics", default=None, help="instrument every run and write its counters and timers to this JSON lines file")
+    parser.add_argument("-l", "--log-dir", default=None, help="write the logs of every run to a JSON lines file in this directory (off otherwise)")
+    parser.add_argument("--max-ticks", type=int, default=2000, help="stop a run that has not finished after that many ticks")
+    parser.add_argument("--log-level", default="info", choices=list(logs.LEVELS), help="lowest level written to the log files")
+    args = parser.parse_args()
+    run_batch(args.runs, args.output, args.workers, args.seed, trace_dir=args.trace_dir, metrics=args.metrics, log_dir=args.log_dir, log_level=args.log_level,
+              max_ticks=args.max_ticks)
@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import spade
+from spade.behaviour import CyclicBehaviour, OneShotBehaviour
+from spade.message import Message
+from transport import TransportAgent, InMemoryTransport, XMPPTransport
+from environment import Building
+from clock import VirtualClock
+from agents import OccupantAgent, BuildingManagementAgent
+from simulation import create_building, run_simulation
+import messages
+import logs
+
+
+'''
+_____________________________________________________________________________________________________________________
+Message transport: throughput and delivery latency of the in-memory bus against XMPP
+'''
+
+class _Receiver(TransportAgent):
+    def __init__(self, jid, password, expected, transport=None):
+        super().__init__(jid, password, transport)
+        self.expected = expected
+        self.latencies = []
+        self.received = asyncio.Event()
+        self.done = asyncio.Event()
+
+    async def setup(self):
+        self.add_behaviour(self.CollectBehaviour())
+
+    class CollectBehaviour(CyclicBehaviour):
+        async def run(self):
+            msg = await self.receive(timeout=1)
+            if msg:
+                self.agent.latencies.append(time.perf_counter() - float(msg.metadata["sent_at"]))
+                self.agent.received.set()
+                if len(self.agent.latencies) == self.agent.expected:
+                    self.agent.done.set()
+
+
+# Sends count messages, either as fast as possible (throughput) or one at a time waiting for each delivery (latency)
+class _Sender(TransportAgent):
+    def __init__(self, jid, password, receiver, count, one_at_a_time, transport=None):
+        super().__init__(jid, password, transport)
+        self.receiver = receiver
+        self.count = count
+        self.one_at_a_time = one_at_a_time
+
+    async def setup(self):
+        self.add_behaviour(self.SendBehaviour())
+
+    class SendBehaviour(OneShotBehaviour):
+        async def run(self):
+            for i in range(self.agent.count):
+                msg = Message(to=str(self.agent.receiver.jid))
+                msg.body = f"Fire in Room {i}"
+                msg.set_metadata("sent_at", str(time.perf_counter()))
+                self.agent.receiver.received.clear()
+                await self.send(msg)
+                if self.agent.one_at_a_time:
+                    await self.agent.receiver.received.wait()
+
+
+async def bench_transport(transport, count=10000, one_at_a_time=False, timeout=60):
+    receiver = _Receiver("bench_receiver@localhost", "password", count, transport)
+    sender = _Sender("bench_sender@localhost", "password", receiver, count, one_at_a_time, transport)
+    if not transport.in_process:
+        # Both agents live in this process, take the receiver out of SPADE's container so messages really go through the server
+        spade.container.Container().unregister(receiver.jid)
+    await receiver.start(auto_register=True)
+    start = time.perf_counter()
+    await sender.start(auto_register=True)
+    try:
+        await asyncio.wait_for(receiver.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    await sender.stop()
+    await receiver.stop()
+
+    latencies = sorted(receiver.latencies)
+    received = len(latencies)
+    return {
+        "transport": transport.name,
+        "mode": "latency" if one_at_a_time else "throughput",
+        "sent": count,
+        "received": received,
+        "seconds": elapsed,
+        "messages_per_second": received / elapsed if elapsed > 0 else 0,
+        "latency_mean_ms": sum(latencies) / received * 1000 if received else None,
+        "latency_p50_ms": latencies[received // 2] * 1000 if received else None,
+        "latency_p99_ms": latencies[min(received - 1, int(received * 0.99))] * 1000 if received else None,
+    }
+
+
+'''
+_____________________________________________________________________________________________________________________
+Hazard notifications: time from detecting a burst of hazards until every occupant knows about all of them,
+sending one message per room and occupant one after the other, or one coalesced broadcast
+'''
+
+class _Occupant(TransportAgent):
+    def __init__(self, jid, password, tally, transport=None):
+        super().__init__(jid, password, transport)
+        self.tally = tally
+
+    async def setup(self):
+        self.add_behaviour(self.ListenBehaviour())
+
+    class ListenBehaviour(CyclicBehaviour):
+        async def run(self):
+            msg = await self.receive(timeout=1)
+            if msg:
+                tally = self.agent.tally
+                tally["notices"] += len(messages.message_room_ids(msg))
+                if tally["notices"] == tally["expected"]:
+                    tally["done_at"] = time.perf_counter()
+                    tally["done"].set()
+
+
+class _Notifier(TransportAgent):
+    def __init__(self, jid, password, occupants, rooms, coalesce, transport=None):
+        super().__init__(jid, password, transport)
+        self.occupants = occupants
+        self.rooms = rooms
+        self.coalesce = coalesce
+        self.started_at = None
+
+    async def setup(self):
+        self.add_behaviour(self.NotifyBehaviour())
+
+    class NotifyBehaviour(OneShotBehaviour):
+        async def run(self):
+            self.agent.started_at = time.perf_counter()
+            if self.agent.coalesce:
+                await messages.broadcast(self, self.agent.occupants, messages.AVOID, self.agent.rooms)
+            else:
+                for room in self.agent.rooms:
+                    for occupant in self.agent.occupants:
+                        await self.send(messages.make_message(occupant, messages.AVOID, [room]))
+
+
+async def bench_notifications(num_occupants=1000, num_rooms=5, coalesce=True, timeout=60):
+    transport = InMemoryTransport()
+    building = Building(num_floors=1, rows=10, cols=10)
+    rooms = [building.get_room(0, 0, k) for k in range(num_rooms)]
+    tally = {"notices": 0, "expected": num_occupants * num_rooms, "done": asyncio.Event(), "done_at": None}
+    occupants = [_Occupant(f"bench_occupant{i}@localhost", "password", tally, transport) for i in range(num_occupants)]
+    for occupant in occupants:
+        await occupant.start(auto_register=True)
+    notifier = _Notifier("bench_management@localhost", "password", [o.jid for o in occupants], rooms, coalesce, transport)
+    await notifier.start(auto_register=True)
+    try:
+        await asyncio.wait_for(tally["done"].wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    await notifier.stop()
+    for occupant in occupants:
+        await occupant.stop()
+    return {
+        "mode": "broadcast" if coalesce else "sequential",
+        "occupants": num_occupants,
+        "rooms": num_rooms,
+        "messages": transport.sent,
+        "notified": tally["notices"],
+        "latency_ms": (tally["done_at"] - notifier.started_at) * 1000 if tally["done_at"] else None,
+    }
+
+
+'''
+_____________________________________________________________________________________________________________________
+Suite across building sizes and occupant counts, offline (in-memory transport, virtual clock), results kept as JSON
+to compare two commits: building construction, shafts, next room lookups, hazard scan, fan-out and whole runs
+'''
+
+# (floors, rows, cols, occupants) of the sizes, quick keeps the first two
+SIZES = [(2, 5, 5, 10), (5, 10, 10, 100), (10, 20, 20, 1000)]
+
+
+# Median, best and number of repeats of the wall time of fn(), called until `budget` seconds are spent (at least 3 times)
+def measure(fn, budget=0.5, min_repeats=3, max_repeats=50):
+    times = []
+    start = time.perf_counter()
+    while len(times) < min_repeats or (len(times) < max_repeats and time.perf_counter() - start < budget):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return {"seconds": statistics.median(times), "best": min(times), "repeats": len(times)}
+
+
+def new_building(floors, rows, cols):
+    return Building(VirtualClock(), floors, rows, cols)
+
+
+def bench_construction(floors, rows, cols):
+    return measure(lambda: new_building(floors, rows, cols))
+
+
+def bench_shafts(floors, rows, cols, count=2):
+    def connect():
+        building = new_building(floors, rows, cols)
+        start = time.perf_counter()
+        building.connect_elevators(count)
+        building.connect_staircases(count)
+        return time.perf_counter() - start
+    times = [connect() for _ in range(5)]
+    return {"seconds": statistics.median(times), "best": min(times), "repeats": len(times)}
+
+
+# Time of one get_next_room_towards_exit from random rooms of the exits' floor, routes already computed
+def bench_next_room(floors, rows, cols, queries=1000):
+    random.seed(1)
+    building = create_building(VirtualClock(), floors, rows, cols, precompute_routes=True)
+    agent = OccupantAgent("bench_occupant@localhost", "password", "Agent", building, "able-bodied", InMemoryTransport())
+    behaviour = OccupantAgent.ReceiveInstructionsBehaviour()
+    behaviour.agent = agent
+    exit = building.assembly_points[0]
+    rooms = [building.get_room(0, random.randrange(rows), random.randrange(cols)) for _ in range(queries)]
+
+    def lookups():
+        for room in rooms:
+            agent._location = room
+            behaviour.get_next_room_towards_exit(exit)
+
+    result = measure(lookups)
+    result["per_query"] = result["seconds"] / queries
+    return result
+
+
+# Management agent handling a burst of hazards: noting them, blocking the rooms, notifying the occupants
+# (registered on the bus but not started, so the time is the management's only) and queuing the incidents
+def bench_hazard_scan(floors, rows, cols, occupants, hazards=20):
+    async def burst():
+        random.seed(2)
+        transport = InMemoryTransport()
+        building = create_building(VirtualClock(), floors, rows, cols)
+        for i in range(occupants):
+            building.add_agent(OccupantAgent(f"occupant{i+1}@localhost", "password", f"Agent {i+1}", building, "able-bodied", transport))
+        management = BuildingManagementAgent("management@localhost", "password", building, "Building Management", transport)
+        building.add_management_agent(management)
+        behaviour = BuildingManagementAgent.ManageBuildingBehaviour()
+        behaviour.set_agent(management)
+        await behaviour.on_start()
+        for flat in random.sample(range(building.state.is_on_fire.size), hazards):
+            building.get_room_by_id(flat).start_fire()
+        start = time.perf_counter()
+        await behaviour.run()
+        return time.perf_counter() - start
+
+    times = [asyncio.run(burst()) for _ in range(3)]
+    return {"seconds": statistics.median(times), "best": min(times), "repeats": len(times), "hazards": hazards}
+
+
+# A whole evacuation, one agent per occupant up to agent_limit occupants, a vectorized crowd above.
+# A run still going after max_ticks ticks is stopped and recorded with evacuated False: its time is the cap's,
+# not an evacuation's, and compare does not take it for one
+def bench_run(floors, rows, cols, occupants, seed=3, agent_limit=200, max_ticks=5000):
+    crowd = occupants > agent_limit
+    random.seed(seed)
+    clock = VirtualClock()
+
+    async def run():
+        building = create_building(clock, floors, rows, cols)
+        values = await run_simulation(building, InMemoryTransport(), crowd=crowd, num_occupants=occupants, max_ticks=max_ticks)
+        return building, values is not None
+
+    start = time.perf_counter()
+    building, evacuated = clock.run(run())
+    return {"seconds": time.perf_counter() - start, "repeats": 1, "crowd": crowd, "ticks": building.tick,
+            "evacuated": evacuated, "simulated_seconds": clock.now()}
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes=SIZES, output="benchmark_results.json"):
+    results = []
+
+    def record(name, params, result):
+        results.append({"name": name, "params": params, **result})
+        if result["seconds"] is None:
+            print(f"{name} {params}: did not finish")
+        elif result.get("evacuated") is False:
+            print(f"{name} {params}: {result['seconds'] * 1000:.3f} ms, NOT EVACUATED after {result['ticks']} ticks")
+        else:
+            print(f"{name} {params}: {result['seconds'] * 1000:.3f} ms")
+
+    for floors, rows, cols, occupants in sizes:
+        shape = {"floors": floors, "rows": rows, "cols": cols}
+        record("construction", shape, bench_construction(floors, rows, cols))
+        record("shafts", shape, bench_shafts(floors, rows, cols))
+        record("next_room", shape, bench_next_room(floors, rows, cols))
+        record("hazard_scan", {**shape, "occupants": occupants}, bench_hazard_scan(floors, rows, cols, occupants))
+        fan_out = asyncio.run(bench_notifications(occupants, 5, True))
+        record("fan_out", {"occupants": occupants}, {"seconds": fan_out["latency_ms"] / 1000 if fan_out["latency_ms"] else None,
+                                                     "repeats": 1, "messages": fan_out["messages"]})
+        record("evacuation", {**shape, "occupants": occupants}, bench_run(floors, rows, cols, occupants))
+
+    report = {"commit": _commit(), "python": platform.python_version(), "created": time.time(), "results": results}
+    with open(output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"Benchmark results saved to '{output}'.")
+    return report
+
+
+# Ratio of every benchmark of a new report to the same benchmark of a baseline, slower than threshold is flagged.
+# Evacuations that did not finish are not compared: one that stopped finishing counts as a regression, one that
+# did not finish in the baseline is only flagged
+def compare(baseline, report, threshold=1.2):
+    before = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = before.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if old is None:
+            continue
+        if result.get("evacuated") is False or old.get("evacuated") is False:
+            which = "new run" if result.get("evacuated") is False else "baseline"
+            print(f"{result['name']} {result['params']}: not compared, the {which} did not evacuate  UNFINISHED")
+            if result.get("evacuated") is False and old.get("evacuated") is not False:
+                regressions.append(result)
+            continue
+        if not old["seconds"] or result["seconds"] is None:
+            continue
+        ratio = result["seconds"] / old["seconds"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{result['name']} {result['params']}: {old['seconds'] * 1000:.3f} -> {result['seconds'] * 1000:.3f} ms ({ratio:.2f}x){flag}")
+        if flag:
+            regressions.append(result)
+    print(f"{baseline.get('commit')} -> {report.get('commit')}: {len(regressions)} regressions (over {threshold:.2f}x or no longer evacuating)")
+    return regressions
+
+
+def print_result(result):
+    print(", ".join(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}" for key, value in result.items()))
+
+
+async def run_transport_benchmarks(count=10000):
+    for one_at_a_time in (False, True):
+        print_result(await bench_transport(InMemoryTransport(), count, one_at_a_time))
+        try:
+            print_result(await bench_transport(XMPPTransport(), count, one_at_a_time))
+        except Exception as e:
+            print(f"XMPP benchmark skipped, no XMPP server available ({e!r})")
+
+
+async def run_notification_benchmarks(sizes=(100, 1000, 5000), num_rooms=5):
+    for num_occupants in sizes:
+        for coalesce in (False, True):
+            print_result(await bench_notifications(num_occupants, num_rooms, coalesce))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the evacuation simulation")
+    parser.add_argument("what", nargs="?", default="transport", choices=["transport", "suite"],
+                        help="transport: message bus and notifications (default), suite: everything across building sizes, saved as JSON")
+    parser.add_argument("-n", "--count", type=int, default=10000, help="messages of the transport benchmark")
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument("--quick", action="store_true", help="only the small sizes of the suite")
+    parser.add_argument("--compare", default=None, help="results of another commit to compare the suite against")
+    args = parser.parse_args()
+    logs.configure("off")  # Only the results on stdout
+    if args.what == "suite":
+        report = run_suite(SIZES[:2] if args.quick else SIZES, args.output)
+        if args.compare:
+            with open(args.compare) as file:
+                compare(json.load(file), report)
+    else:
+        asyncio.run(run_transport_benchmarks(args.count))
+        asyncio.run(run_notification_benchmarks())
@@ -0,0 +1,89 @@
+import asyncio
+import selectors
+import time
+
+
+# Wall-clock time, used by the dashboard runs (the original behaviour)
+class RealClock:
+    virtual = False
+
+    def now(self):
+        return time.time()
+
+    async def sleep(self, delay):
+        await asyncio.sleep(delay)
+
+    def run(self, coro):
+        return asyncio.run(coro)
+
+
+# Simulated time: the clock only moves when every task is waiting, and then it jumps
+# straight to the next pending timer (next agent step, next hazard tick, next receive timeout...)
+class VirtualClock:
+    virtual = True
+
+    def __init__(self, start=0.0):
+        self._now = start
+
+    def now(self):
+        return self._now
+
+    def advance(self, delay):
+        self._now += delay
+
+    async def sleep(self, delay):
+        # asyncio.sleep is scheduled on the loop timeline, which is this clock when running on a VirtualEventLoop
+        await asyncio.sleep(delay)
+
+    def new_event_loop(self):
+        return VirtualEventLoop(self)
+
+    def run(self, coro):
+        loop = self.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            try:
+                # Like asyncio.run: cancel what is still pending (e.g. killed behaviours waiting on receive)
+                tasks = asyncio.all_tasks(loop)
+                for task in tasks:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+
+
+# Selector used by the virtual loop: it never blocks while there are timers pending,
+# it just advances the virtual clock by the time the loop would have waited
+class _VirtualSelector:
+    def __init__(self, clock):
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        events = self.selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # Nothing scheduled at all: only real I/O (e.g. another thread waking the loop) can make progress
+            return self.selector.select(None)
+        self.clock.advance(timeout)
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+# Event loop whose time() is the virtual clock, so asyncio.sleep, wait_for timeouts and
+# behaviour receive(timeout=...) all run on simulated time.
+# Meant for runs without network I/O (in-process agents), since socket timeouts would also be skipped.
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock):
+        self.clock = clock
+        super().__init__(selector=_VirtualSelector(clock))
+
+    def time(self):
+        return self.clock.now()
@@ -0,0 +1,375 @@
+import numpy as np
+from spade.behaviour import CyclicBehaviour
+from transport import TransportAgent
+import messages
+import logs
+
+crowd_log = logs.get("crowd")
+INF = float("inf")
+EVACUATED = -1  # Room of an occupant that is out of the building
+
+
+# One occupant of a crowd, a view on its entry of the crowd arrays with the attributes the rest of the
+# simulation reads from an OccupantAgent (dashboard, metrics, trace, management)
+class CrowdOccupant:
+    def __init__(self, crowd, index, jid, agent_name, mobility):
+        self.crowd = crowd
+        self.index = index
+        self.jid = jid
+        self.agent_name = agent_name
+        self.mobility = mobility
+
+    @property
+    def location(self):
+        room = self.crowd.room[self.index]
+        return "Evacuated" if room == EVACUATED else self.crowd.building.get_room_by_id(int(room))
+
+    @property
+    def is_evacuated(self):
+        return bool(self.crowd.room[self.index] == EVACUATED)
+
+    @property
+    def finish_time(self):
+        time = self.crowd.finish_time[self.index]
+        return None if np.isnan(time) else float(time)
+
+    @property
+    def pace(self):
+        return float(self.crowd.pace[self.index])
+
+
+# Occupants of a building kept in arrays instead of one agent each: room, pace, mobility, assembly point and time
+# of the next move of everyone. A step moves every occupant whose move is due at once, with array operations:
+#   - the exit is the assembly point with the shortest route (through the shafts their mobility allows),
+#     chosen again when it gets blocked, as OccupantAgent.choose_exit does
+#   - on another floor than their exit they head to the best shaft first, then take the stairs down (or up) to the
+#     exit's floor, or call an elevator car and wait for it to drop them off (elevator.ElevatorSystem)
+#   - each move is to the neighbour one step closer on the routing engine's distance fields (which avoid the
+#     blocked rooms), the "standard" policy of the agents
+#   - a room takes at most `capacity` occupants: the ones that don't fit wait and try again `wait` seconds later
+#   - with a planner (planner.EvacuationPlanner), the able-bodied occupants it planned wait in their room until
+#     their departure, then take the next room of their route instead, to its assembly point; back on the fields if
+#     they are off it or it is out of date
+# The routes are copied from the routing engine (and the planner) as arrays, and only copied again when they change.
+class Crowd:
+    def __init__(self, building, num_occupants, capacity=10, wait=1.0, shaft_time=4.0, jid="crowd@localhost"):
+        self.building = building
+        self.jid = jid  # Agent the management sends the occupants' messages to
+        self.capacity = capacity  # Occupants a room can hold at most, None for no limit (assembly points have none)
+        self.wait = wait  # Time before trying again to enter a full room
+        self.shaft_time = shaft_time  # Time to change floors once at the elevator or staircase
+        self.room = np.array([building.random_room_id() for _ in range(num_occupants)], dtype=np.int64)  # Room id, EVACUATED once out
+        self.disabled = np.arange(num_occupants) % 2 == 1  # Every other occupant, like the agents
+        self.pace = np.where(self.disabled, 5.0, 4.0)  # Seconds per move
+        self.exit = np.full(num_occupants, -1, dtype=np.int64)  # Room id of the assembly point they head to, -1 to choose
+        self.ready = np.full(num_occupants, INF)  # When they make their next move, never until told to evacuate
+        self.finish_time = np.full(num_occupants, np.nan)
+        self.members = [
+            CrowdOccupant(self, k, f"occupant{k+1}@localhost", f"Agent {k+1}", "disabled" if self.disabled[k] else "able-bodied")
+            for k in range(num_occupants)
+        ]
+
+        # Floor and index on its floor of every room id, and the rooms connected to each room (-1 pads the rows)
+        self.room_floor = np.concatenate([np.full(floor.num_rooms, f) for f, floor in enumerate(building.floors)])
+        self.room_local = np.concatenate([np.arange(floor.num_rooms) for floor in building.floors])
+        self.first_id = np.array([floor.first_id for floor in building.floors])
+        neighbors = [[floor.first_id + k for k in adjacent] for floor in building.floors for adjacent in floor.adjacency()]
+        self.neighbors = np.full((len(neighbors), max(max(map(len, neighbors), default=0), 1)), -1, dtype=np.int64)
+        for room_id, adjacent in enumerate(neighbors):
+            self.neighbors[room_id, :len(adjacent)] = adjacent
+        self.elevator_room = np.zeros(len(self.neighbors), dtype=bool)  # Rooms of the elevator shafts, where they call a car
+        for row, col in building.shafts["elevator"]:
+            for floor in building.floors:
+                self.elevator_room[floor.get_room(row, col).id] = True
+        self.riding = np.zeros(num_occupants, dtype=bool)  # Waiting for or in an elevator car
+        self._plan = None
+        self._plan_key = None
+        self.planner = None  # EvacuationPlanner of the able-bodied occupants, if any
+        self.route = np.full((num_occupants, 1), -1, dtype=np.int64)  # Planned route of every occupant, -1 pads the rows
+        self.route_at = np.full(num_occupants, -1, dtype=np.int64)  # Where they are on it, -1 off it
+        self.route_end = np.full(num_occupants, -1, dtype=np.int64)
+        self.route_leave = np.full(num_occupants, -INF)  # When they may leave the first room of their route
+        self._route_version = None
+        self._by_room = None  # Occupants sorted by room and where each room starts, until someone moves
+
+    def __len__(self):
+        return len(self.room)
+
+    def remaining(self):
+        return int(np.count_nonzero(self.room != EVACUATED))
+
+    # Occupants on each floor, ground floor first
+    def floor_counts(self):
+        return np.bincount(self.room_floor[self.room[self.room != EVACUATED]], minlength=len(self.building.floors)).tolist()
+
+    # Occupants in the room: a slice of the occupants sorted by room, sorted again only after someone moved
+    def occupants_in(self, room):
+        if self._by_room is None:
+            order = np.argsort(self.room, kind="stable")
+            self._by_room = order, np.searchsorted(self.room[order], np.arange(len(self.neighbors) + 1))
+        order, starts = self._by_room
+        return [self.members[k] for k in order[starts[room.id]:starts[room.id + 1]].tolist()]
+
+    # Member index -> room id of the occupants the planner routes: able-bodied, inside and not in an elevator
+    def plannable(self):
+        ready = np.flatnonzero(~self.disabled & (self.room != EVACUATED) & ~self.riding)
+        return dict(zip(ready.tolist(), self.room[ready].tolist()))
+
+    # Everyone starts moving: their first move is one pace from now
+    def evacuate(self, now):
+        waiting = np.isinf(self.ready) & (self.room != EVACUATED) & ~self.riding
+        self.ready[waiting] = now + self.pace[waiting]
+
+    # Occupants heading to an assembly point that can't be used anymore choose another one on their next move
+    def assembly_point_blocked(self, room):
+        redirected = self.exit == room.id
+        self.exit[redirected] = -1
+        return int(np.count_nonzero(redirected))
+
+    # When the next move is due, inf if nobody is moving
+    def next_move(self):
+        ready = self.ready[self.room != EVACUATED]
+        return float(ready.min()) if len(ready) else INF
+
+    # Distance to target from every room of the building (INF on the other floors), from the routing engine
+    def _field(self, target):
+        field = np.full(len(self.neighbors), INF)
+        floor = self.building.get_floor(target.floor)
+        field[floor.first_id:floor.first_id + floor.num_rooms] = self.building.routing.field(target)
+        return field
+
+    # Routes to every assembly point as arrays, rebuilt only when the fields or the assembly points changed:
+    #   exits: room ids of the assembly points
+    #   fields, rows: distance field of every exit and shaft, and the row of each target room id in fields
+    #   cost[disabled], way[disabled]: moves to each exit from every room, and the room to walk to first
+    #     (the exit itself on its floor, else the best shaft), for able-bodied and disabled occupants
+    def plan(self):
+        building = self.building
+        exits = building.assembly_points
+        able_methods = building.floor_change_methods("able-bodied")
+        key = (building.routing.version, tuple(room.id for room in exits), able_methods)
+        if self._plan is not None and self._plan_key == key:
+            return self._plan
+
+        targets = list(exits) + [shaft for floor in building.floors for shaft in floor.elevators + floor.staircases]
+        targets = list({room.id: room for room in targets}.values())
+        fields = np.array([self._field(room) for room in targets]).reshape(len(targets), len(self.neighbors))
+        rows = np.full(len(self.neighbors), -1, dtype=np.int64)
+        rows[[room.id for room in targets]] = np.arange(len(targets))
+
+        cost, way = {}, {}
+        for disabled, methods in ((False, able_methods), (True, building.floor_change_methods("disabled"))):
+            cost[disabled] = np.full((len(exits), len(self.neighbors)), INF)
+            way[disabled] = np.full((len(exits), len(self.neighbors)), -1, dtype=np.int64)
+            for a, exit in enumerate(exits):
+                field = fields[rows[exit.id]]
+                for floor in building.floors:
+                    start, end = floor.first_id, floor.first_id + floor.num_rooms
+                    if floor.floor_number == exit.floor:
+                        cost[disabled][a, start:end] = field[start:end]
+                        way[disabled][a, start:end] = exit.id
+                        continue
+                    # Best shaft of the floor, the first one on ties and when none leads to the exit (like nearest_shaft)
+                    best, best_way = cost[disabled][a, start:end], way[disabled][a, start:end]
+                    for method in methods:
+                        for shaft in (floor.elevators if method == "elevator" else floor.staircases):
+                            arrival = building.get_room(exit.floor - 1, shaft.coordinates[1], shaft.coordinates[2])
+                            d = fields[rows[shaft.id], start:end] + abs(floor.floor_number - exit.floor) + field[arrival.id]
+                            better = (d < best) | (best_way < 0)
+                            best[better] = d[better]
+                            best_way[better] = shaft.id
+
+        self._plan = (np.array([room.id for room in exits], dtype=np.int64), fields, rows, cost, way)
+        self._plan_key = key
+        return self._plan
+
+    # The planner's routes as arrays, copied again when it planned again; False while there are none to follow
+    def routes(self):
+        planner = self.planner
+        if planner is None or planner.start is None or not planner.current():
+            return False
+        if self._route_version != planner.version:
+            self.route = np.full((len(self.room), max(map(len, planner.routes.values()), default=1)), -1, dtype=np.int64)
+            self.route_at[:] = -1
+            self.route_end[:] = -1
+            self.route_leave[:] = -INF
+            for k, way in planner.routes.items():
+                self.route[k, :len(way)] = way
+                self.route_end[k] = way[-1]
+                leave = planner.leave_time(k)
+                if leave is not None:
+                    self.route_leave[k] = leave
+                if self.room[k] in way:
+                    self.route_at[k] = way.index(self.room[k])
+            self._route_version = planner.version
+        return True
+
+    # Move every occupant whose move is due, returns the indexes of the occupants that got out
+    def step(self, now):
+        inside = self.room != EVACUATED
+        due = np.flatnonzero(inside & (self.ready <= now + 1e-9))
+        if len(due) == 0:
+            return due
+        exits, fields, rows, cost, way = self.plan()
+        if len(exits) == 0:
+            self.ready[due] = now + self.pace[due]  # No assembly point left, wait for one
+            return due[:0]
+
+        # Exit of the occupants without one (or whose exit was blocked), and where to walk to on this floor
+        slot = np.argmax(self.exit[due, None] == exits[None, :], axis=1)
+        lost = self.exit[due] != exits[slot]
+        waypoint = np.empty(len(due), dtype=np.int64)
+        for disabled in (False, True):
+            group = self.disabled[due] == disabled
+            choose = group & lost
+            slot[choose] = np.argmin(cost[disabled][:, self.room[due[choose]]], axis=0)
+            waypoint[group] = way[disabled][slot[group], self.room[due[group]]]
+        self.exit[due] = exits[slot]
+        room = self.room[due]
+
+        # Planned occupants still on their route head to its assembly point (off it, they are left to the fields)
+        planned = np.zeros(len(due), dtype=bool)
+        if self.routes():
+            at = self.route_at[due]
+            planned = at >= 0
+            planned[planned] = self.route[due[planned], at[planned]] == room[planned]
+            self.route_at[due[(at >= 0) & ~planned]] = -1
+            self.exit[due[planned]] = self.route_end[due[planned]]
+
+        # At the shaft: change floors, to the room at the same place on the exit's floor
+        exit_floor = self.room_floor[self.exit[due]]
+        shafting = (room == waypoint) & (self.room_floor[room] != exit_floor)
+        destination = np.full(len(due), -1, dtype=np.int64)
+        destination[shafting] = self.first_id[exit_floor[shafting]] + self.room_local[room[shafting]]
+
+        # Planned: the next room of the route, through the staircase when it is on another floor
+        going = np.flatnonzero(planned & (room != self.exit[due]))
+        # Not before their departure: they keep their place in their room until then
+        waiting = going[(self.route_at[due[going]] == 0) & (self.route_leave[due[going]] > now + 1e-9)]
+        going = np.setdiff1d(going, waiting)
+        destination[waiting] = -1
+        shafting[waiting] = False
+        if len(going):
+            k = due[going]
+            destination[going] = self.route[k, self.route_at[k] + 1]
+            shafting[going] = self.room_floor[destination[going]] != self.room_floor[room[going]]
+
+        # At an elevator: call the car and wait for it, the elevators move them (see elevator_arrival)
+        calling = np.flatnonzero(shafting & self.elevator_room[room] & ~planned)
+        for c in calling.tolist():
+            k = int(due[c])
+            self.building.elevators.call(self.members[k], self.building.get_room_by_id(int(room[c])),
+                                         self.building.get_room_by_id(int(destination[c])), self.elevator_arrival)
+        self.riding[due[calling]] = True
+        destination[calling] = -1
+        shafting[calling] = False
+
+        # Already at the exit (they started there): out on this move
+        there = room == self.exit[due]
+        destination[there] = room[there]
+
+        # Else one move closer to the waypoint: the first neighbour with the smallest distance
+        # (no waypoint when no shaft of their floor leads anywhere, they wait)
+        walking = ~shafting & ~there & ~planned & (waypoint >= 0)
+        neighbors = self.neighbors[room[walking]]
+        distances = np.where(neighbors >= 0, fields[rows[waypoint[walking]][:, None], neighbors], INF)
+        best = np.argmin(distances, axis=1)
+        reachable = distances[np.arange(len(best)), best] < INF
+        destination[np.flatnonzero(walking)[reachable]] = neighbors[reachable, best[reachable]]
+
+        # Rooms take occupants up to their capacity, first come first served (in index order); exits take everyone
+        moving = np.flatnonzero(destination >= 0)
+        arriving = destination[moving] == self.exit[due[moving]]
+        allowed = np.ones(len(moving), dtype=bool)
+        if self.capacity is not None:
+            capped = np.flatnonzero(~arriving)
+            target = destination[moving[capped]]
+            occupancy = np.bincount(self.room[inside], minlength=len(self.neighbors))
+            order = np.argsort(target, kind="stable")
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order)) - np.searchsorted(target[order], target[order])
+            allowed[capped] = rank < self.capacity - occupancy[target]
+
+        moved = due[moving[allowed]]
+        self.room[moved] = destination[moving[allowed]]
+        self._by_room = None
+        self.route_at[moved[planned[moving[allowed]]]] += 1
+        self.ready[due] = now + self.pace[due]  # Stuck ones try again one pace later, like the agents
+        self.ready[due[moving[~allowed]]] = now + self.wait
+        self.ready[due[shafting]] = np.where(destination[shafting] == self.room[due[shafting]], now + self.shaft_time, now + self.wait)
+
+        self.ready[due[calling]] = INF
+        self.ready[due[waiting]] = self.route_leave[due[waiting]]
+
+        out = due[moving[allowed & arriving]]
+        self.room[out] = EVACUATED
+        self.ready[out] = INF
+        self.finish_time[out] = now
+        for k in range(len(out)):
+            self.building.occupant_evacuated(now)
+
+        trace = self.building.trace
+        if trace is not None:
+            for k in moved.tolist():
+                trace.move(self.members[k], self.members[k].location)
+        return out
+
+
+    # A car dropped an occupant off: out at once if that's their exit, else they walk on one pace later
+    def elevator_arrival(self, call):
+        k = call.passenger.index
+        now = self.building.clock.now()
+        self.riding[k] = False
+        self._by_room = None
+        if call.destination.id == self.exit[k]:
+            self.room[k] = EVACUATED
+            self.ready[k] = INF
+            self.finish_time[k] = now
+            self.building.occupant_evacuated(now)
+        else:
+            self.room[k] = call.destination.id
+            self.ready[k] = now + self.pace[k]
+        if self.building.trace is not None:
+            self.building.trace.move(call.passenger, call.passenger.location)
+
+
+# Agent that moves a whole crowd: it gets the messages meant for the occupants and steps the crowd when moves are due
+class CrowdAgent(TransportAgent):
+    def __init__(self, jid, password, crowd, transport=None):
+        super().__init__(jid, password, transport)
+        self.crowd = crowd
+        self.environment = crowd.building
+
+    async def setup(self):
+        self.environment.add_update(crowd_log, "Crowd of %s occupants is ready.", len(self.crowd))
+        self.add_behaviour(self.CrowdBehaviour())
+
+    class CrowdBehaviour(CyclicBehaviour):
+        async def on_start(self):
+            # Avoid notices need no handler: the crowd routes on the routing engine's fields, which already avoid those rooms
+            self.handlers = {
+                messages.EVACUATE: self.evacuate,
+                messages.ASSEMBLY_BLOCKED: self.assembly_point_blocked,
+            }
+
+        async def run(self):
+            crowd = self.agent.crowd
+            clock = self.agent.environment.clock
+            # Sleep until the next move is due, unless a message comes first (at most 1s, to notice being killed)
+            msg = await self.receive(timeout=min(max(crowd.next_move() - clock.now(), 0.01), 1))
+            if msg:
+                handler = self.handlers.get(messages.message_kind(msg))
+                if handler:
+                    await handler(msg)
+            out = crowd.step(clock.now())
+            if len(out):
+                self.agent.environment.add_update(crowd_log, "%s occupants arrived at the exits, %s still inside.", len(out), crowd.remaining())
+
+        async def evacuate(self, msg):
+            self.agent.crowd.evacuate(self.agent.environment.clock.now())
+
+        async def assembly_point_blocked(self, msg):
+            for room in messages.message_rooms(msg, self.agent.environment):
+                redirected = self.agent.crowd.assembly_point_blocked(room)
+                if redirected:
+                    self.agent.environment.add_update(crowd_log, "%s occupants will redirect their route due to assembly point blocked", redirected)
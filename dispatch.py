@@ -0,0 +1,123 @@
+import heapq
+import itertools
+import messages
+from stats import StreamStats
+
+# Job of the responders that answer each kind of incident
+JOBS = {
+    messages.FIRE: "firefighter",
+    messages.EARTHQUAKE: "Rescue Worker",
+    messages.ATTACK: "Security Officer",
+    messages.PARAMEDICS: "Paramedic",
+}
+
+# Lower goes first: people hurt, then the hazards that grow or hurt people, then the wreckage
+PRIORITIES = {messages.PARAMEDICS: 0, messages.FIRE: 1, messages.ATTACK: 1, messages.EARTHQUAKE: 2}
+
+
+class Incident:
+    def __init__(self, incident_id, kind, room, opened):
+        self.id = incident_id
+        self.kind = kind
+        self.room = room
+        self.priority = PRIORITIES[kind]
+        self.opened = opened  # When it was reported
+        self.dispatched = None  # When a responder was first sent
+        self.responder = None  # JID of the responder on its way
+        self.arrived = False  # The responder got there, it can't be taken away from it anymore
+        self.closed = None  # When the responder solved it
+
+
+# Open incidents in a priority queue, each one given to the nearest free responder of its job.
+# A more urgent incident with nobody free takes the responder of a less urgent one that is still on its way,
+# and the less urgent one goes back to the queue. The responders check between two moves that they still
+# have their incident (still_assigned), and say when they get there (arrive) and when they are done (close).
+class Dispatcher:
+    def __init__(self, building):
+        self.building = building
+        self.queue = []  # (priority, opened, id) of the incidents waiting for a responder
+        self.incidents = {}  # Id -> incident not closed yet
+        self.open_keys = {}  # (kind, room id) -> id of the open incident, one incident per hazard of a room
+        self.assignments = {}  # Responder JID -> incident it is on
+        self.ids = itertools.count(1)
+        self.waits = StreamStats()  # Time from report to dispatch of every incident
+        self.latencies = StreamStats()  # Time from report to solution of every closed incident
+        self.reassigned = 0
+
+    def responders(self, job):
+        return [agent for agent in self.building.emergency_agents.values() if agent.job == job]
+
+    # Report an incident, returns None if the same hazard of the room is already open
+    def open(self, kind, room):
+        key = (kind, room.id)
+        if key in self.open_keys:
+            return None
+        incident = Incident(next(self.ids), kind, room, self.building.clock.now())
+        self.incidents[incident.id] = incident
+        self.open_keys[key] = incident.id
+        heapq.heappush(self.queue, (incident.priority, incident.opened, incident.id))
+        return incident
+
+    def _distance(self, responder, room):
+        return self.building.routing.distance(responder.location, room, avoid=False)
+
+    # Give the waiting incidents, most urgent first, to the nearest free responders.
+    # Returns the (responder, incident) pairs to notify.
+    def assign(self):
+        assigned = []
+        waiting = []
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            incident = self.incidents.get(entry[2])
+            if incident is None or incident.responder is not None:
+                continue
+            responders = self.responders(JOBS[incident.kind])
+            free = [agent for agent in responders if str(agent.jid) not in self.assignments]
+            if not free:
+                # Take the responder of a less urgent incident it has not reached yet
+                free = [agent for agent in responders
+                        if not self.assignments[str(agent.jid)].arrived and self.assignments[str(agent.jid)].priority > incident.priority]
+                if not free:
+                    waiting.append(entry)
+                    continue
+            responder = min(free, key=lambda agent: self._distance(agent, incident.room))
+            previous = self.assignments.get(str(responder.jid))
+            if previous is not None:
+                previous.responder = None
+                heapq.heappush(self.queue, (previous.priority, previous.opened, previous.id))
+                self.reassigned += 1
+            incident.responder = str(responder.jid)
+            if incident.dispatched is None:
+                incident.dispatched = self.building.clock.now()
+                self.waits.add(incident.dispatched - incident.opened)
+            self.assignments[incident.responder] = incident
+            assigned.append((responder, incident))
+        for entry in waiting:
+            heapq.heappush(self.queue, entry)
+        return assigned
+
+    def still_assigned(self, responder, incident_id):
+        incident = self.assignments.get(str(responder.jid))
+        return incident is not None and incident.id == incident_id
+
+    # The responder got to the room: True if the incident is still its own, and then it stays its own
+    def arrive(self, responder, incident_id):
+        if not self.still_assigned(responder, incident_id):
+            return False
+        self.assignments[str(responder.jid)].arrived = True
+        return True
+
+    def close(self, incident_id):
+        incident = self.incidents.pop(incident_id, None)
+        if incident is None:
+            return None
+        incident.closed = self.building.clock.now()
+        self.latencies.add(incident.closed - incident.opened)
+        self.open_keys.pop((incident.kind, incident.room.id), None)
+        if self.assignments.get(incident.responder) is incident:
+            del self.assignments[incident.responder]
+        return incident
+
+    def pending(self):
+        return len(self.incidents)
+
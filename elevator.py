@@ -0,0 +1,134 @@
+from stats import StreamStats
+
+
+# A passenger waiting for a car, then riding it: passenger is whatever the caller needs to tell it apart (an agent's
+# JID, a crowd occupant), on_arrival is called with the call when the car drops it off (None: the management
+# agent tells the passenger with a message)
+class ElevatorCall:
+    def __init__(self, passenger, origin, destination, called, on_arrival=None):
+        self.passenger = passenger
+        self.origin = origin  # Shaft room it waits in
+        self.destination = destination  # Shaft room on the floor it goes to
+        self.called = called
+        self.boarded = None
+        self.arrived = None
+        self.on_arrival = on_arrival
+
+    @property
+    def direction(self):
+        return 1 if self.destination.floor > self.origin.floor else -1
+
+
+# One car running in one shaft, LOOK scheduling: it keeps going in its direction while there is a call or a
+# passenger's floor ahead, then turns around. At every stop the passengers for that floor get off and everyone
+# waiting there gets on, up to the capacity, so the requests of one floor are served in one stop.
+class ElevatorCar:
+    def __init__(self, system, position):
+        self.system = system
+        self.position = position  # (row, col) of the shaft
+        self.floor = 1  # Cars wait on the ground floor
+        self.direction = 0  # 1 up, -1 down, 0 idle
+        self.waiting = []  # Calls not picked up yet
+        self.passengers = []
+        self.stops = 0
+        self.floors_travelled = 0
+
+    # Floors the car has to stop at: its passengers' floors, and the floors with calls while it has room left
+    def _stops(self):
+        stops = {call.destination.floor for call in self.passengers}
+        if len(self.passengers) < self.system.capacity:
+            stops |= {call.origin.floor for call in self.waiting}
+        return stops
+
+    # Next thing the car does: open its doors here, or move one floor. Returns the calls that got on and off.
+    async def step(self):
+        clock = self.system.building.clock
+        stops = self._stops()
+        if not stops:
+            self.direction = 0
+            await clock.sleep(self.system.idle_time)
+            return [], []
+        if self.floor in stops:
+            return await self.open_doors()
+        if not any((floor - self.floor) * self.direction > 0 for floor in stops):
+            nearest = min(stops, key=lambda floor: abs(floor - self.floor))
+            self.direction = 1 if nearest > self.floor else -1
+        await clock.sleep(self.system.floor_time)
+        self.floor += self.direction
+        self.floors_travelled += 1
+        return [], []
+
+    async def open_doors(self):
+        clock = self.system.building.clock
+        now = clock.now()
+        self.stops += 1
+        off = [call for call in self.passengers if call.destination.floor == self.floor]
+        self.passengers = [call for call in self.passengers if call.destination.floor != self.floor]
+        # Calls going the car's way first, so a full car doesn't take someone back the way it came
+        here = [call for call in self.waiting if call.origin.floor == self.floor]
+        here.sort(key=lambda call: call.direction != self.direction)
+        on = here[:self.system.capacity - len(self.passengers)]
+        for call in on:
+            self.waiting.remove(call)
+            call.boarded = now
+            self.system.waits.add(now - call.called)
+        self.passengers += on
+        if on and (self.direction == 0 or len(self.passengers) == len(on)):
+            self.direction = on[0].direction  # An empty car goes where its first passenger goes
+        await clock.sleep(self.system.door_time)
+        now = clock.now()
+        for call in off:
+            call.arrived = now
+            self.system.rides.add(now - call.boarded)
+            self.system.delivered += 1
+            self.system.calls.pop(call.passenger, None)
+        return on, off
+
+
+# The elevators of a building: a car per elevator shaft, calls queued at the car of the shaft they are made at.
+# Timings in seconds: floor_time to go up or down one floor, door_time for a stop (doors, people getting on and off)
+class ElevatorSystem:
+    def __init__(self, building, capacity=8, floor_time=2.0, door_time=3.0, idle_time=0.5):
+        self.building = building
+        self.capacity = capacity
+        self.floor_time = floor_time
+        self.door_time = door_time
+        self.idle_time = idle_time  # How often an idle car looks for calls
+        self.cars = {}  # Shaft (row, col) -> car
+        self.calls = {}  # Passenger -> its call, until it gets off
+        self.waits = StreamStats()  # Time from call to boarding of every passenger
+        self.rides = StreamStats()  # Time from boarding to arrival
+        self.delivered = 0
+        self.first_call = None
+
+    def car(self, position):
+        car = self.cars.get(position)
+        if car is None:
+            car = self.cars[position] = ElevatorCar(self, position)
+        return car
+
+    # Cars of every elevator shaft of the building
+    def all_cars(self):
+        return [self.car(tuple(position)) for position in self.building.shafts["elevator"]]
+
+    # Ask for a ride from a shaft room to the room of the same shaft on another floor.
+    # A passenger that already has a call keeps it (several management agents may get the same request).
+    def call(self, passenger, origin, destination, on_arrival=None):
+        if passenger in self.calls:
+            return self.calls[passenger]
+        call = self.calls[passenger] = ElevatorCall(passenger, origin, destination, self.building.clock.now(), on_arrival)
+        if self.first_call is None:
+            self.first_call = call.called
+        self.car((origin.coordinates[1], origin.coordinates[2])).waiting.append(call)
+        return call
+
+    # Rides, wait and ride time percentiles (p50, p90, p99) and passengers per minute since the first call
+    def summary(self):
+        elapsed = self.building.clock.now() - self.first_call if self.first_call is not None else 0
+        return {
+            "rides": self.delivered,
+            "wait": self.waits.quantiles(),
+            "ride": self.rides.quantiles(),
+            "per_minute": self.delivered / elapsed * 60 if elapsed > 0 else 0,
+            "stops": sum(car.stops for car in self.cars.values()),
+        }
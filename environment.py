@@ -1,34 +1,126 @@
+import asyncio
+import bisect
+import logging
 import random
-import time
+import numpy as np
+from collections import deque
+from clock import RealClock
+from routing import RoutingEngine
+from fire import FireSpread
+from dispatch import Dispatcher
+from elevator import ElevatorSystem
+from stats import StreamStats
+from layout import FloorLayout
+from spatial import AgentIndex
+import eventtrace
+import logs
 
-# Room class to represent each room in the building
+building_log = logs.get("building")
+metrics_log = logs.get("metrics")
+
+# Names of the values returned by Building.performance_metrics, in order
+PERFORMANCE_FIELDS = [
+    "Fires Extinguished", "Total Fires", "Earthquakes Resolved", "Total Earthquakes",
+    "Attacks Controlled", "Total Attacks", "Agents Evacuated", "Total Agents",
+    "Problems Solved", "Total Evacuation Time", "Average Responder Time",
+    "Responder Time P50", "Responder Time P90", "Responder Time P99",
+]
+
+
+# Hazard and status state of every room of a building, one array per attribute indexed by (floor - 1, row, col)
+class BuildingState:
+    def __init__(self, num_floors, rows, cols):
+        shape = (num_floors, rows, cols)
+        self.light = np.ones(shape, dtype=bool)
+        self.is_on_fire = np.zeros(shape, dtype=bool)
+        self.is_damaged = np.zeros(shape, dtype=bool)
+        self.is_taken = np.zeros(shape, dtype=bool)
+        self.noted_fire = np.zeros(shape, dtype=bool)
+        self.noted_earthquake = np.zeros(shape, dtype=bool)
+        self.noted_attack = np.zeros(shape, dtype=bool)
+        self.begin = np.zeros(shape)  # When a responder was dispatched to the room
+        self.end = np.zeros(shape)  # When the responder solved the problem
+
+
+# Attribute of a Room that reads and writes its cell in the building state arrays.
+# Changes of the attributes with a trace bit are also written to the building's trace, when it has one.
+def _state_attribute(name, cast, trace_bit=None):
+    def get(self):
+        return cast(getattr(self.state, name)[self.index])
+
+    def set(self, value):
+        array = getattr(self.state, name)
+        if trace_bit is not None and self.building is not None and self.building.trace is not None and array[self.index] != value:
+            self.building.trace.hazard(self, trace_bit, value)
+        array[self.index] = value
+
+    return property(get, set)
+
+
+# Name of the room at (row i, col j) of a floor, also used to label rooms without creating them
+def room_name(floor_number, i, j):
+    return f"Room {floor_number}{i}{j}"
+
+
+# Room class to represent each room in the building, a view on its cell of the BuildingState
 class Room:
-    def __init__(self, floor_number, i,j):
-        self.name = f"Room {floor_number}{i}{j}"  # Room ID, e.g., "Room_1"
-        self.connections = []  # Rooms connected to this one
-        self.elevator_connections = []
-        self.staircase_connections = []
+    light = _state_attribute("light", bool, eventtrace.LIGHT)
+    is_on_fire = _state_attribute("is_on_fire", bool, eventtrace.FIRE)
+    is_damaged = _state_attribute("is_damaged", bool, eventtrace.DAMAGED)
+    is_taken = _state_attribute("is_taken", bool, eventtrace.TAKEN)
+    noted_fire = _state_attribute("noted_fire", bool)
+    noted_earthquake = _state_attribute("noted_earthquake", bool)
+    noted_attack = _state_attribute("noted_attack", bool)
+    begin = _state_attribute("begin", float)
+    end = _state_attribute("end", float)
+
+    def __init__(self, floor_number, i,j, state=None):
+        self.name = room_name(floor_number, i, j)  # Room ID, e.g., "Room_1"
+        self.id = None  # Index in Building.rooms
+        self.local = None  # Index on its floor, in the floor layout
+        self.building = None  # Building the room belongs to, receives its hazard events
+        self.parent_floor = None  # Floor the room is on, its layout gives the connections
+        self.extra_connections = []  # Connections added one by one, on top of the layout
+        self.extra_elevator_connections = []
+        self.extra_staircase_connections = []
         self.coordinates=[floor_number,i,j]
-        self.light=True
         self.floor=floor_number
-        self.is_on_fire = False
-        self.is_damaged = False
-        self.is_taken = False
-        self.noted_fire=False
-        self.noted_earthquake = False
-        self.noted_attack = False
-        self.begin=0
-        self.end=0
+        # A room created on its own gets a state of its own
+        if state is None:
+            state = BuildingState(1, 1, 1)
+            self.index = (0, 0, 0)
+        else:
+            self.index = (floor_number - 1, i, j)
+        self.state = state
+
+    # Rooms connected to this one
+    @property
+    def connections(self):
+        if self.parent_floor is None:
+            return self.extra_connections
+        return self.parent_floor.neighbors(self) + self.extra_connections
+
+    @property
+    def elevator_connections(self):
+        if self.building is None:
+            return self.extra_elevator_connections
+        return self.building.shaft_neighbors(self, "elevator") + self.extra_elevator_connections
+
+    @property
+    def staircase_connections(self):
+        if self.building is None:
+            return self.extra_staircase_connections
+        return self.building.shaft_neighbors(self, "staircase") + self.extra_staircase_connections
 
     # Method to add a connection to another room
     def add_connection(self, other_room):
-        self.connections.append(other_room)
+        self.extra_connections.append(other_room)
     
     def add_elevator_connection(self, other_room):
-        self.elevator_connections.append(other_room)
+        self.extra_elevator_connections.append(other_room)
     
     def add_staircase_connection(self, other_room):
-        self.staircase_connections.append(other_room)
+        self.extra_staircase_connections.append(other_room)
     
     def distance_to(self, other_room):
         return abs(self.coordinates[0] - other_room.coordinates[0]) + abs(self.coordinates[1] - other_room.coordinates[1]) + abs(self.coordinates[2] - other_room.coordinates[2])
@@ -36,62 +128,141 @@ class Room:
     def get_neighbors(self):
         return self.connections
 
+    # Let the building know the state of this room changed
+    def publish(self, kind):
+        if self.building is not None:
+            self.building.publish_hazard(kind, self)
+
+    # The fire spreads to the connected rooms on the next tick, see Building.spread_fire
     def start_fire(self):
         self.is_on_fire = True
-        self.spread_fire()
-        
-    def spread_fire(self):
-        if random.random() < 0.1: # There is 10% probability the fire will spread to closer rooms
-            next_room=random.choice(self.connections)
-            next_room.start_fire()
-            print(f"Fire is spreading to {next_room.name}")
+        self.publish("fire")
 
-    def damage_by_earthquake(self):
-        if random.random()<0.5:
+    # light_off: whether the earthquake cuts the light, drawn at random if not given
+    def damage_by_earthquake(self, light_off=None):
+        if light_off is None:
+            light_off = random.random()<0.5
+        if light_off:
             self.light=False
         self.is_damaged = True
+        self.publish("earthquake")
     
     def taken_by_attacker(self):
         self.is_taken = True
+        self.publish("attack")
 
 
-# Floor class to represent each floor with rooms and assembly points
+# Floor class to represent each floor with rooms and assembly points.
+# Rooms are only created when they are first asked for, the connections come from the floor layout.
 class Floor:
-    def __init__(self, floor_number, num_rows, num_cols):
+    def __init__(self, floor_number, num_rows, num_cols, state=None, layout=None, building=None, first_id=0):
         self.floor_number = floor_number
-        self.rooms = [[Room(floor_number,i,j) for j in range(num_cols)] for i in range(num_rows)]
+        if state is None:
+            state = BuildingState(floor_number, num_rows, num_cols)
+        self.state = state
         self.num_rows=num_rows
         self.num_cols=num_cols
+        self.layout = layout
+        self.building = building
+        self.first_id = first_id  # Id of the first room of the floor in the building
+        self._rooms = {}  # Local index -> Room, for the rooms created so far
+        self.elevator = None  # Elevator and staircase rooms of this floor (the first shaft of each kind)
+        self.staircase = None
+        self.elevators = []
+        self.staircases = []
+
+    @property
+    def num_rooms(self):
+        return self.num_rows * self.num_cols
+
+    # Every room of the floor, as rows of rooms
+    @property
+    def rooms(self):
+        return [[self.get_room(i, j) for j in range(self.num_cols)] for i in range(self.num_rows)]
 
     # Get room by its coordinates on the floor
     def get_room(self, row, col):
-        return self.rooms[row][col]
+        return self.room_at(row * self.num_cols + col)
+
+    # Get room by its index on the floor
+    def room_at(self, local):
+        room = self._rooms.get(local)
+        if room is None:
+            row, col = divmod(local, self.num_cols)
+            room = Room(self.floor_number, row, col, self.state)
+            room.local = local
+            room.id = self.first_id + local
+            room.building = self.building
+            room.parent_floor = self
+            self._rooms[local] = room
+        return room
+
+    def neighbors(self, room):
+        if self.layout is None:
+            return []
+        return [self.room_at(k) for k in self.layout.adjacency()[room.local]]
+
+    # Adjacency lists of local indexes (layout plus connections added by hand), for the route searches
+    def adjacency(self):
+        if self.layout is None:
+            self.create_room_connections()
+        adjacency = self.layout.adjacency()
+        extra = [room for room in self._rooms.values() if room.extra_connections]
+        if extra:
+            adjacency = list(adjacency)
+            for room in extra:
+                adjacency[room.local] = adjacency[room.local] + [other.local for other in room.extra_connections if other.floor == self.floor_number]
+        return adjacency
 
     # Method to create connections between adjacent rooms
     def create_room_connections(self):
-        rows, cols = len(self.rooms), len(self.rooms[0])
-        for i in range(rows):
-            for j in range(cols):
-                room = self.get_room(i,j)
-                # Connect with room to the right
-                if j < cols - 1:
-                    right_room = self.rooms[i][j + 1]
-                    room.add_connection(right_room)
-                    right_room.add_connection(room)
-                # Connect with room below
-                if i < rows - 1:
-                    below_room = self.rooms[i + 1][j]
-                    room.add_connection(below_room)
-                    below_room.add_connection(room)
+        if self.layout is None:
+            self.layout = FloorLayout.grid(self.num_rows, self.num_cols)
+
+
+# Lazy list of all the rooms of a building, room.id is the index
+class RoomIndex:
+    def __init__(self, building):
+        self.building = building
+        self.starts = [floor.first_id for floor in building.floors]
+        # When every floor has the same number of rooms the floor of an id is a division, no search needed
+        sizes = {floor.num_rooms for floor in building.floors}
+        self.stride = sizes.pop() if len(sizes) == 1 else None
+
+    def __len__(self):
+        return sum(floor.num_rooms for floor in self.building.floors)
+
+    def __getitem__(self, room_id):
+        if self.stride:
+            index, local = divmod(room_id, self.stride)
+            if not 0 <= index < len(self.building.floors):
+                raise IndexError(room_id)
+            return self.building.floors[index].room_at(local)
+        floor = self.building.floors[bisect.bisect_right(self.starts, room_id) - 1]
+        if not 0 <= room_id - floor.first_id < floor.num_rooms:
+            raise IndexError(room_id)
+        return floor.room_at(room_id - floor.first_id)
+
+    def __iter__(self):
+        for floor in self.building.floors:
+            for local in range(floor.num_rooms):
+                yield floor.room_at(local)
 
 
 class Building:
-    def __init__(self):
+    # Every argument left to None is drawn at random, like the buildings of the original simulation
+    # plan: floorplan.FloorPlan of a real site, which gives the floors, their rooms and the assembly points instead
+    def __init__(self, clock=None, num_floors=None, rows=None, cols=None, num_assembly_points=2, plan=None):
+        if plan is not None:
+            num_floors, rows, cols = plan.num_floors, plan.num_rows, plan.num_cols
         # Randomly determine the number of floors, rows (height), and columns (width)
-        num_floors = random.randint(1, 6)  # Number of floors between 2 and 6
+        if num_floors is None:
+            num_floors = random.randint(1, 6)  # Number of floors between 2 and 6
         self.floors = []
+        self.clock = clock if clock is not None else RealClock()  # Real time by default, VirtualClock for simulated time
         self.elevator = "Elevator"  # Simplified elevator as a connection between floors
-        self.updates=[]
+        self.updates = deque(maxlen=5)  # (message, arguments) of the recent updates, formatted when shown
+        self.hazard_events = asyncio.Queue()  # (kind, room) published by the rooms, consumed by the management agent
         self.agents = {}
         self.emergency_agents = {}
         self.management_agents = {}
@@ -99,156 +270,369 @@ class Building:
         self.num_fires = [0, 0]
         self.num_earthquakes = [0, 0]
         self.num_attacks = [0, 0]
-        self.times=[]
-        self.agent_times=[]
+        self.response_stats = StreamStats()  # Times responders took to solve a problem
+        self.evacuation_stats = StreamStats()  # Time from the start of the run to every occupant getting out
+        self.tick = 0  # Number of simulation steps so far
+        self.trace = None  # TraceWriter recording every change of the run, if any
+        self.schedule = None  # HazardSchedule the random events come from instead of the random module, if any
+        self.crowd = None  # Crowd the occupants belong to when they are moved in arrays instead of one agent each
+        self.planner = None  # EvacuationPlanner of the occupants with the "planned" policy, if any
+        self.remaining = 0  # Occupants still inside
+        self.evacuation_done = asyncio.Event()  # Set when the last occupant gets out
         self.responses = 0
         self.num_floors=num_floors
-        self.rows = random.randint(2, 6)  # Random height between 2 and 6
-        self.cols = random.randint(2, 6)   # Random width between 2 and 6
-        # Create random floors
+        self.rows = rows if rows is not None else random.randint(2, 6)  # Random height between 2 and 6
+        self.cols = cols if cols is not None else random.randint(2, 6)   # Random width between 2 and 6
+        self.shafts = {"elevator": [], "staircase": []}  # (row, col) of every elevator and staircase shaft
+        self.state = BuildingState(num_floors, self.rows, self.cols)
+        self.floor_occupants = [0] * num_floors  # Occupant agents on each floor (a crowd counts its own, see floor_progress)
+        self.occupant_index = AgentIndex()  # Where the occupant agents are (a crowd keeps its own, see occupants_in)
+        self.responder_index = AgentIndex()  # Where the emergency responders are
+        self.plan = plan
+        # Which cells are rooms and their ids, None when every cell is one (the grids of the random buildings)
+        self.room_mask = plan.room_mask() if plan is not None else None
+        self.room_ids = np.flatnonzero(self.room_mask) if self.room_mask is not None else None
+        # Create the floors, all of them share the same plan unless the site's plan says otherwise
+        layout = FloorLayout.grid(self.rows, self.cols)
         for floor_num in range(1, num_floors + 1):
-            self.floors.append(Floor(floor_num, self.rows, self.cols))
+            if plan is not None:
+                layout = plan.layout(floor_num - 1)
+            self.floors.append(Floor(floor_num, self.rows, self.cols, self.state, layout, self, (floor_num - 1) * self.rows * self.cols))
+        self.rooms = RoomIndex(self)
             
-        print(f"Building created! {num_floors+1} floors and {self.rows}x{self.cols} structure!")
-        
-        time.sleep(1)
-        self.create_floor_connections()
-
-        # Randomly choose two assembly points on the ground floor (first floor)
-        self.assembly_points = [
-            self.floors[0].get_room(0, 0),  # Top-left corner of first floor
-            self.floors[0].get_room(self.floors[0].num_rows - 1, 0)  # Bottom-left corner of first floor
-        ]
+        building_log.info("Building created! %s floors and %sx%s structure!", num_floors+1, self.rows, self.cols)
+
+        if plan is not None and plan.assembly_points:
+            self.assembly_points = [self.get_room(*point) for point in plan.assembly_points]
+        else:
+            self.assembly_points = self.place_assembly_points(num_assembly_points)
         
-        self.begin = time.time()
+        self.routing = RoutingEngine(self)
+        self.fire = FireSpread(self)
+        self.dispatcher = Dispatcher(self)
+        self.elevators = ElevatorSystem(self)
+        self.begin = self.clock.now()
         
     # Create room connections within each floor
     def create_floor_connections(self):
         for floor in self.floors:
             floor.create_room_connections()
 
+    # Assembly points on the ground floor: the top-left and bottom-left corners (the original two),
+    # then evenly spread along the outer wall
+    def place_assembly_points(self, count):
+        ground = self.floors[0]
+        rows, cols = ground.num_rows, ground.num_cols
+        corners = [(0, 0), (rows - 1, 0)]
+        border = [(0, j) for j in range(cols)] + [(i, cols - 1) for i in range(1, rows)] + \
+                 [(rows - 1, j) for j in range(cols - 2, -1, -1)] + [(i, 0) for i in range(rows - 2, 0, -1)]
+        border = [cell for cell in border if cell not in corners]
+        if self.room_mask is not None:
+            # Only the rooms of the border, or any room of the floor when none is on the border
+            corners = [cell for cell in corners if self.room_mask[0][cell]]
+            border = [cell for cell in border if self.room_mask[0][cell]]
+            if not corners and not border:
+                border = list(zip(*(index.tolist() for index in np.nonzero(self.room_mask[0]))))
+        cells = corners[:count]
+        extra = count - len(cells)
+        if extra > 0 and border:
+            step = len(border) / extra
+            cells += [border[int(k * step)] for k in range(min(extra, len(border)))]
+        return [ground.get_room(row, col) for row, col in cells]
+
     def get_room(self, floor, row, col):
         return self.floors[floor].get_room(row, col)
 
+    # Room by its id, as carried in the agents' messages
+    def get_room_by_id(self, room_id):
+        return self.rooms[room_id]
+
     def get_floor(self, floor_number):
         return self.floors[floor_number - 1]
         
-    def add_update(self, update_message):
-        # If the updates list already contains 5 updates, remove the oldest one
-        if len(self.updates) >= 5:
-            self.updates.pop(0)  # Remove the oldest update (first element)
-        update_message+="\n"
-        # Add the new update message
-        self.updates.append(update_message)
+    # Time a responder took to solve a problem in the room
+    def add_response_time(self, room, duration):
+        self.response_stats.add(duration)
+        if self.trace is not None:
+            self.trace.response(room, duration)
+
+    def add_evacuation_time(self, finish_time):
+        self.evacuation_stats.add(finish_time - self.begin)
+
+    # An occupant got out at finish_time: the last one sets evacuation_done
+    def occupant_evacuated(self, finish_time):
+        self.add_evacuation_time(finish_time)
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.evacuation_done.set()
+
+    # An agent went from one room to another (or out, "Evacuated"): keeps the per floor counts and the indexes of
+    # where the agents are, once the agent is one of the building's occupants or responders
+    def agent_moved(self, agent, previous, room):
+        if self.agents.get(agent.jid) is agent:
+            index = self.occupant_index
+            if isinstance(previous, Room):
+                self.floor_occupants[previous.floor - 1] -= 1
+            if isinstance(room, Room):
+                self.floor_occupants[room.floor - 1] += 1
+        elif self.emergency_agents.get(agent.jid) is agent:
+            index = self.responder_index
+        else:
+            return
+        if isinstance(previous, Room):
+            index.remove(agent, previous)
+        if isinstance(room, Room):
+            index.add(agent, room)
+
+    # Occupants the planner routes, key -> room id: the able-bodied ones still inside (in a crowd, those not riding
+    # an elevator), by member index in a crowd and by jid for the agents with the "planned" policy
+    def plannable_occupants(self):
+        if self.crowd is not None:
+            return self.crowd.plannable()
+        return {str(agent.jid): agent.location.id for agent in self.agents.values()
+                if agent.policy == "planned" and agent.mobility == "able-bodied" and not agent.is_evacuated}
+
+    # Occupants on each floor, ground floor first
+    def floor_progress(self):
+        if self.crowd is not None:
+            return self.crowd.floor_counts()
+        return list(self.floor_occupants)
+
+    # Wait until everyone is out, at most timeout seconds of the building's clock: returns whether everyone is out
+    async def wait_evacuated(self, timeout=None):
+        if not self.evacuation_done.is_set():
+            try:
+                await asyncio.wait_for(self.evacuation_done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.evacuation_done.is_set()
+
+    # Record every change of the run in a binary trace file, until stop_trace
+    def start_trace(self, path):
+        self.trace = eventtrace.TraceWriter(path, self)
+
+    def stop_trace(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    # Keep an update for the dashboard and log it: the message is only formatted if it is shown or logged
+    def add_update(self, logger, message, *args, level=logging.INFO):
+        self.updates.append((message, args))
+        logger.log(level, message, *args)
+
+    # The recent updates, oldest first
+    def recent_updates(self):
+        return tuple(message % args + "\n" for message, args in self.updates)
 
     # Connect a room on one floor to a room on another floor via the elevator
     def connect_elevator(self, floor1_room, floor2_room):
         floor1_room.add_elevator_connection(floor2_room)
         floor2_room.add_elevator_connection(floor1_room)
-        self.floors[floor2_room.coordinates[0] - 1].elevator = floor2_room
-        self.floors[floor1_room.coordinates[0] - 1].elevator = floor1_room
+        for room in (floor1_room, floor2_room):
+            self.add_shaft_room(room, "elevator")
 
     # Connect a room on one floor to a room on another floor via the staircase
     def connect_staircase(self, floor1_room, floor2_room):
         floor1_room.add_staircase_connection(floor2_room)
         floor2_room.add_staircase_connection(floor1_room)
-        self.floors[floor2_room.coordinates[0] - 1].staircase = floor2_room
-        self.floors[floor1_room.coordinates[0] - 1].staircase = floor1_room
+        for room in (floor1_room, floor2_room):
+            self.add_shaft_room(room, "staircase")
+
+    def add_shaft_room(self, room, kind):
+        floor = self.get_floor(room.floor)
+        shaft_rooms = floor.elevators if kind == "elevator" else floor.staircases
+        if room not in shaft_rooms:
+            shaft_rooms.append(room)
+        if getattr(floor, kind) is None:
+            setattr(floor, kind, room)
+
+    # A shaft goes through every floor at the same (row, col): positions are given, or picked at random
+    def connect_shafts(self, kind, count=1, positions=None):
+        if positions is None:
+            positions = []
+            taken = set(self.shafts[kind])
+            while len(positions) < min(count, self.rows * self.cols - len(taken)):
+                col = random.randint(0, self.cols - 1)  # Random column
+                row = random.randint(0, self.rows - 1)  # Random row
+                if (row, col) not in taken:
+                    taken.add((row, col))
+                    positions.append((row, col))
+        for row, col in positions:
+            self.shafts[kind].append((row, col))
+            for floor in self.floors:
+                self.add_shaft_room(floor.get_room(row, col), kind)
+
+    # Rooms right above and below a room that is part of a shaft
+    def shaft_neighbors(self, room, kind):
+        if (room.coordinates[1], room.coordinates[2]) not in self.shafts[kind]:
+            return []
+        f = room.floor - 1
+        return [self.get_room(g, room.coordinates[1], room.coordinates[2]) for g in (f - 1, f + 1) if 0 <= g < self.num_floors]
+
+    def publish_hazard(self, kind, room):
+        self.hazard_events.put_nowait((kind, room))
+
+    # A hazard was resolved: the room can be walked through again once it has none left
+    def room_cleared(self, room):
+        if not (room.is_on_fire or room.is_damaged or room.is_taken):
+            self.routing.unblock(room)
 
     def add_agent(self, agent):
         self.agent = agent
         self.agents[self.agent.jid] = self.agent
+        if not agent.is_evacuated:
+            self.remaining += 1
+            self.evacuation_done.clear()
+            if self.crowd is None:
+                self.agent_moved(agent, None, agent.location)
+
+    # Ways occupants with that mobility may change floors: disabled occupants only take the elevators, the others
+    # take the stairs too, or only the stairs while the management keeps the elevators locked for general use
+    def floor_change_methods(self, mobility):
+        if mobility == "disabled":
+            return ("elevator",)
+        if any(getattr(agent, "elevator_locked", False) for agent in self.management_agents.values()):
+            return ("staircase",)
+        return ("elevator", "staircase")
+
+    # Occupants currently in the room
+    def occupants_in(self, room):
+        if self.crowd is not None:
+            return self.crowd.occupants_in(room)
+        return self.occupant_index.in_room(room)
+
+    # (distance, responder) of the emergency responder closest to room by Room.distance_to, (inf, None) without any
+    def nearest_responder(self, room):
+        return self.responder_index.nearest(room)
+
+    # Who the messages for the occupants go to: each occupant agent, or the agent that moves the crowd
+    def occupant_jids(self):
+        if self.crowd is not None:
+            return [self.crowd.jid]
+        return self.agents.keys()
 
     def add_emergency_agent(self, emergency_agent):
         self.emergency_agent = emergency_agent
         self.emergency_agents[self.emergency_agent.jid] = self.emergency_agent
+        self.agent_moved(emergency_agent, None, emergency_agent.location)
 
     def add_management_agent(self, management_agent):
         self.management_agent = management_agent
         self.management_agents[self.management_agent.jid] = self.management_agent
 
     def trigger_random_event(self):
+        if self.schedule is not None:
+            # Events drawn in advance for this tick
+            for kind, flat, light_off in self.schedule.events(self.tick):
+                room = self.get_room(*np.unravel_index(flat, self.state.is_on_fire.shape))
+                if kind == "fire":
+                    room.start_fire()
+                elif kind == "earthquake":
+                    room.damage_by_earthquake(light_off)
+                else:
+                    room.taken_by_attacker()
+            return
         # Randomly trigger a fire or earthquake
         if random.random() < 0.07:  # 7% chance for fire
-            floor = random.choice(self.floors)
-            room = random.choice(random.choice(floor.rooms))
-            room.start_fire()
+            self.get_random_room().start_fire()
 
         if random.random() < 0.05:  # 5% chance for earthquake
-            floor = random.choice(self.floors)
-            room = random.choice(random.choice(floor.rooms))
-            room.damage_by_earthquake()  
+            self.get_random_room().damage_by_earthquake()
 
         if random.random() < 0.05:  # 5% chance for attack
-            floor = random.choice(self.floors)
-            room = random.choice(random.choice(floor.rooms))
-            room.taken_by_attacker()
+            self.get_random_room().taken_by_attacker()
+
+    # Rooms with an active hazard as (hazard, room), in (floor, row, col) order, found with one pass over the state arrays
+    def active_situations(self):
+        state = self.state
+        situations = []
+        hazards = np.flatnonzero(state.is_on_fire | state.is_damaged | state.is_taken)
+        for f, i, j in zip(*np.unravel_index(hazards, state.is_on_fire.shape)):
+            room = self.get_room(f, i, j)
+            if state.is_on_fire[f, i, j]:
+                situations.append(("Fire", room))
+            if state.is_damaged[f, i, j]:
+                situations.append(("Earthquake", room))
+            if state.is_taken[f, i, j]:
+                situations.append(("Attack", room))
+        return situations
+
+    # Rooms whose hazards were not noted by the management yet
+    def unnoted_rooms(self):
+        state = self.state
+        pending = (state.is_on_fire & ~state.noted_fire) | (state.is_damaged & ~state.noted_earthquake) | (state.is_taken & ~state.noted_attack)
+        return [self.get_room(f, i, j) for f, i, j in zip(*np.unravel_index(np.flatnonzero(pending), pending.shape))]
+
+    # Number of rooms currently on fire, damaged and taken by attackers
+    def hazard_counts(self):
+        state = self.state
+        return int(np.count_nonzero(state.is_on_fire)), int(np.count_nonzero(state.is_damaged)), int(np.count_nonzero(state.is_taken))
+
+    def spread_fire(self):
+        for f, i, j in self.fire.step():
+            room = self.get_room(f, i, j)
+            room.start_fire()
+            building_log.info("Fire is spreading to %s", room.name)
 
     def simulate_step(self):
+        if self.trace is not None:
+            self.trace.record_counters()  # As they were at the end of the last tick
+        self.tick += 1
+        if self.trace is not None:
+            self.trace.tick(self.tick)
+        self.spread_fire()
         self.trigger_random_event()
 
     def is_building_evacuated(self):
-        for i in self.agents.values():
-            if i.is_evacuated == False:
-                return False
-        return True
+        return self.remaining == 0
 
     def get_random_room(self):
-        floor = random.choice(self.floors)
-        return random.choice(random.choice(floor.rooms))
+        return self.get_room_by_id(self.random_room_id())
 
-    def connect_elevators(self):
-        # Connect elevators on the same room position (row, col) for each floor
-        col = random.randint(0, min(self.floors[0].num_cols, 5) - 1)  # Random column
-        row = random.randint(0, min(self.floors[0].num_rows, 5) - 1)  # Random row
-        
-        # Go through each pair of consecutive floors and connect the rooms in the same position
-        for i in range(len(self.floors) - 1):  # Iterate through floors
-            floor1 = self.floors[i]
-            floor2 = self.floors[i + 1]
-
-            # Get the room in the same (row, col) for both floors
-            room1 = floor1.get_room(row, col)
-            room2 = floor2.get_room(row, col)
-            
-            self.connect_elevator(room1, room2)
+    # Id of a room drawn at random, every room has the same chance (a cell of the state arrays when all are rooms)
+    def random_room_id(self):
+        if self.room_ids is None:
+            return random.randrange(self.state.is_on_fire.size)
+        return int(self.room_ids[random.randrange(len(self.room_ids))])
 
-    def connect_staircases(self):
-        # Connect staircases on the same room position (row, col) for each floor
-        col = random.randint(0, min(self.floors[0].num_cols, 5) - 1)  # Random column
-        row = random.randint(0, min(self.floors[0].num_rows, 5) - 1)  # Random row
-        
-        # Go through each pair of consecutive floors and connect the rooms in the same position
-        for i in range(len(self.floors) - 1):  # Iterate through floors
-            floor1 = self.floors[i]
-            floor2 = self.floors[i + 1]
-
-            # Get the room in the same (row, col) for both floors
-            room1 = floor1.get_room(row, col)
-            room2 = floor2.get_room(row, col)
-            
-            self.connect_staircase(room1, room2)
+    # Whether the cell of the state arrays with this flat index is a room
+    def is_room(self, room_id):
+        return self.room_mask is None or bool(self.room_mask.flat[room_id])
+
+    def connect_elevators(self, count=1, positions=None):
+        self.connect_shafts("elevator", count, positions)
+
+    def connect_staircases(self, count=1, positions=None):
+        self.connect_shafts("staircase", count, positions)
 
     def performance_metrics(self):
-        values=[self.num_fires[0],self.num_fires[1],self.num_earthquakes[0],self.num_earthquakes[1],self.num_attacks[0],self.num_attacks[1],len(self.agents.keys()),len(self.agents.keys()),len(self.times)]
-        print(f"Number of Fires Extinguished / Total Fires: {self.num_fires[0]}/{self.num_fires[1]}")
-        print(f"Number of Earthquakes: {self.num_earthquakes[0]}/{self.num_earthquakes[1]}")
-        print(f"Number of Attacks Controlled / Total Attacks: {self.num_attacks[0]}/{self.num_attacks[1]}")
-        print(f"Number of Occupant Agents Evacuated / Total Occupant Agents: {len(self.agents.keys())}/{len(self.agents.keys())}")
+        responses = self.response_stats
+        values=[self.num_fires[0],self.num_fires[1],self.num_earthquakes[0],self.num_earthquakes[1],self.num_attacks[0],self.num_attacks[1],len(self.agents.keys()),len(self.agents.keys()),responses.count]
+        metrics_log.info("Number of Fires Extinguished / Total Fires: %s/%s", self.num_fires[0], self.num_fires[1])
+        metrics_log.info("Number of Earthquakes: %s/%s", self.num_earthquakes[0], self.num_earthquakes[1])
+        metrics_log.info("Number of Attacks Controlled / Total Attacks: %s/%s", self.num_attacks[0], self.num_attacks[1])
+        metrics_log.info("Number of Occupant Agents Evacuated / Total Occupant Agents: %s/%s", len(self.agents.keys()), len(self.agents.keys()))
         
-        time_spent_list = []
-        for i in self.agents.values():
-            time_spent = i.finish_time - self.begin
-            time_spent_list.append(time_spent)
-            print(f"Agent {i.agent_name} took {time_spent:.2f} to evacuate")
+        if metrics_log.isEnabledFor(logging.DEBUG):
+            for i in self.agents.values():
+                metrics_log.debug("Agent %s took %.2f to evacuate", i.agent_name, i.finish_time - self.begin)
         
-        total_time = max(time_spent_list)
+        total_time = self.evacuation_stats.max if self.evacuation_stats.count else 0
         values.append(total_time)
-        print(f"Total Evacuation Time: {total_time:.2f}")
-        print(f"Number of problems solved by Emergency Responders: {len(self.times)}")
-        print(f"Average Response Time of Emergency Responders: {sum(self.times)/len(self.times) if len(self.times) !=0 else 0:.2f}")
-        avg_response=sum(self.times)/len(self.times) if len(self.times) !=0 else 0
-        values.append(avg_response)
+        metrics_log.info("Total Evacuation Time: %.2f", total_time)
+        metrics_log.info("Number of problems solved by Emergency Responders: %s", responses.count)
+        metrics_log.info("Average Response Time of Emergency Responders: %.2f", responses.mean)
+        values.append(responses.mean)
+        p50, p90, p99 = responses.quantiles()
+        metrics_log.info("Response Time Percentiles of Emergency Responders: p50 %.2f, p90 %.2f, p99 %.2f", p50, p90, p99)
+        values += [p50, p90, p99]
+        latencies = self.dispatcher.latencies
+        d50, d90, d99 = latencies.quantiles()
+        metrics_log.info("Incident Latency from report to solution: p50 %.2f, p90 %.2f, p99 %.2f (%s incidents, %s reassigned)", d50, d90, d99, latencies.count, self.dispatcher.reassigned)
+        elevators = self.elevators.summary()
+        metrics_log.info("Elevators: %s rides in %s stops, %.2f passengers per minute, wait p50 %.2f, p90 %.2f, ride p50 %.2f",
+                         elevators['rides'], elevators['stops'], elevators['per_minute'], elevators['wait'][0], elevators['wait'][1], elevators['ride'][0])
         return values
         
     def update_perf_metrics():
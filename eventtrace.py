@@ -0,0 +1,141 @@
+import json
+import struct
+import numpy as np
+from spade.trace import TraceStore
+import messages
+
+# Binary trace of a run: a header (magic, version, length of a JSON description of the building and its agents,
+# the JSON itself, padding) followed by fixed-size records, so the records can be memory-mapped as one array.
+MAGIC = b"EVTR"
+VERSION = 1
+HEADER = struct.Struct("<4sII")
+RECORD = np.dtype([
+    ("time", "<f8"),  # Clock time of the change
+    ("tick", "<u4"),  # Simulation step it happened in
+    ("kind", "u1"),
+    ("sub", "u1"),
+    ("pad", "<u2"),
+    ("a", "<i4"),
+    ("b", "<i4"),
+    ("c", "<i4"),
+])
+
+# Kinds of records and what their fields hold
+TICK = 0  # a: tick number
+HAZARD = 1  # sub: hazard bit, a: room id, b: new value (0 or 1)
+MOVE = 2  # a: agent index, b: room id, -1 once out of the building
+MESSAGE = 3  # sub: message kind code, a: sender index, b: recipient index (-1 for a broadcast), c: first room id or -1
+COUNTER = 4  # sub: counter index (fires solved, fires, earthquakes solved, earthquakes, attacks solved, attacks), a: value
+RESPONSE = 5  # a: room id, b: response time in milliseconds
+
+# Hazard bits, and the state array each of them is kept in
+FIRE, DAMAGED, TAKEN, LIGHT = 1, 2, 4, 8
+HAZARD_FLAGS = {FIRE: "is_on_fire", DAMAGED: "is_damaged", TAKEN: "is_taken", LIGHT: "light"}
+
+KIND_CODES = {kind: code for code, kind in enumerate(messages.KINDS)}
+
+
+def counters(building):
+    return (building.num_fires[0], building.num_fires[1], building.num_earthquakes[0], building.num_earthquakes[1], building.num_attacks[0], building.num_attacks[1])
+
+
+def agent_name(agent):
+    for attribute in ("agent_name", "responder_name", "management_name"):
+        if hasattr(agent, attribute):
+            return str(getattr(agent, attribute))
+    return str(agent.jid)
+
+
+# Appends every change of a running building to a trace file. Records are buffered in an array and written in blocks.
+class TraceWriter:
+    def __init__(self, path, building, buffer_records=4096):
+        self.building = building
+        self.file = open(path, "wb")
+        self.buffer = np.zeros(buffer_records, dtype=RECORD)
+        self.count = 0
+        self.agent_index = {}  # JID -> index of the agent in the trace
+        self.counters = None
+
+        agents = []
+        for role, group in (("occupant", building.agents), ("responder", building.emergency_agents), ("management", building.management_agents)):
+            for jid, agent in group.items():
+                self.agent_index[str(jid)] = len(agents)
+                agents.append({"jid": str(jid), "name": agent_name(agent), "role": role, "mobility": getattr(agent, "mobility", None), "job": getattr(agent, "job", None)})
+        description = json.dumps({
+            "shape": list(building.state.is_on_fire.shape),
+            "plan": building.plan.path if building.plan is not None else None,  # Floor plan file the building was read from
+            "shafts": {kind: [list(position) for position in positions] for kind, positions in building.shafts.items()},
+            "assembly_points": [room.id for room in building.assembly_points],
+            "begin": building.begin,
+            "agents": agents,
+        }).encode()
+        padding = -(HEADER.size + len(description)) % RECORD.itemsize
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(description)) + description + b"\0" * padding)
+
+        # Where everyone starts, and every message they send from now on
+        for group in (building.agents, building.emergency_agents):
+            for agent in group.values():
+                if hasattr(agent, "location"):
+                    self.move(agent, agent.location)
+        for group in (building.agents, building.emergency_agents, building.management_agents):
+            for agent in group.values():
+                if hasattr(agent, "traces"):  # Occupants of a crowd send nothing
+                    agent.traces = _RecordingTraceStore(agent.traces.size, self, agent)
+        self.record_counters()
+
+    def record(self, kind, sub=0, a=0, b=0, c=0):
+        if self.file.closed:
+            return
+        self.buffer[self.count] = (self.building.clock.now(), self.building.tick, kind, sub, 0, a, b, c)
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer[:self.count].tobytes())
+        self.count = 0
+
+    def tick(self, tick):
+        self.record(TICK, a=tick)
+
+    # The counters are only written when they changed, checked once per tick
+    def record_counters(self):
+        values = counters(self.building)
+        for index, value in enumerate(values):
+            if self.counters is None or self.counters[index] != value:
+                self.record(COUNTER, index, value)
+        self.counters = values
+
+    def hazard(self, room, bit, value):
+        self.record(HAZARD, bit, room.id, int(bool(value)))
+
+    def move(self, agent, room):
+        self.record(MOVE, a=self.agent_index.get(str(agent.jid), -1), b=room.id if hasattr(room, "id") else -1)
+
+    def message(self, msg):
+        rooms = messages.message_room_ids(msg)
+        self.record(MESSAGE, KIND_CODES.get(messages.message_kind(msg), 255),
+                    self.agent_index.get(str(msg.sender.bare()) if msg.sender else "", -1),
+                    self.agent_index.get(str(msg.to.bare()) if msg.to else "", -1),
+                    rooms[0] if rooms else -1)
+
+    def response(self, room, duration):
+        self.record(RESPONSE, a=room.id, b=int(round(duration * 1000)))
+
+    def close(self):
+        self.record_counters()
+        self.flush()
+        self.file.close()
+
+
+# SPADE keeps the messages an agent sends in its trace store, this one also writes them to the trace file
+class _RecordingTraceStore(TraceStore):
+    def __init__(self, size, writer, agent):
+        super().__init__(size)
+        self.writer = writer
+        self.jid = agent.jid.bare()
+
+    def append(self, event, category=None):
+        super().append(event, category)
+        if event.sender is not None and event.sender.bare() == self.jid:
+            self.writer.message(event)
@@ -0,0 +1,174 @@
+import argparse
+import csv
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from clock import VirtualClock
+from transport import InMemoryTransport
+from schedule import HazardSchedule
+from simulation import create_building, run_simulation
+import logs
+
+'''
+_____________________________________________________________________________________________________________________
+A/B experiment between two occupant routing policies with common random numbers: every replicate runs both policies
+on the same building, with the same occupants and the same pre-sampled hazards, and the policies are compared on the
+differences within each pair, which cancel most of the run to run noise.
+'''
+
+OUTCOMES = ["Agents Evacuated", "Total Evacuation Time", "Mean Evacuation Time", "Problems Solved", "Average Responder Time", "Ticks"]
+
+
+# Outcome of a finished (or stopped) run, occupants still inside count with the time the run was stopped
+def outcome(building):
+    now = building.clock.now()
+    times = [(agent.finish_time if agent.is_evacuated else now) - building.begin for agent in building.agents.values()]
+    return [
+        sum(agent.is_evacuated for agent in building.agents.values()),
+        max(times),
+        sum(times) / len(times),
+        building.response_stats.count,
+        building.response_stats.mean,
+        building.tick,
+    ]
+
+
+# One run of a policy: the seed fixes the building and the occupants, the hazard schedule comes from the seed too
+def run_arm(seed, policy, max_ticks=2000):
+    random.seed(seed)
+    clock = VirtualClock()
+
+    async def run():
+        building = create_building(clock)
+        building.schedule = HazardSchedule(seed, building.state.is_on_fire.size, max_ticks, building.room_ids)
+        await run_simulation(building, InMemoryTransport(), policy=policy, max_ticks=max_ticks)
+        return outcome(building)
+
+    return clock.run(run())
+
+
+# Runs in a worker process: both policies on the same replicate
+def run_pair(test, seed, policies, max_ticks=2000, quiet=True):
+    start = time.perf_counter()
+    results = {}
+    logs.configure("off" if quiet else "info")
+    for policy in policies:
+        results[policy] = run_arm(seed, policy, max_ticks)
+    return test, seed, results, time.perf_counter() - start
+
+
+# Probability that |T| < t for a Student T with df degrees of freedom, a whole number: the exact finite series
+# in cos(atan(t / sqrt(df))) (Abramowitz & Stegun 26.7.3 and 26.7.4)
+def _t_central(t, df):
+    theta = math.atan(t / math.sqrt(df))
+    c2 = math.cos(theta) ** 2
+    term, total = 1.0, 1.0
+    for k in range(1 + df % 2, df - 1, 2):
+        term *= c2 * k / (k + 1)
+        total += term
+    if df % 2 == 0:
+        return math.sin(theta) * total
+    return 2 / math.pi * (theta + (math.sin(theta) * math.cos(theta) * total if df > 1 else 0))
+
+
+# Student t quantile of p > 0.5 for the two-sided intervals, by bisection on the exact distribution (no scipy needed)
+def t_quantile(p, df):
+    low, high = 0.0, 1.0
+    while _t_central(high, df) < 2 * p - 1:
+        high *= 2
+    for _ in range(100):
+        middle = (low + high) / 2
+        if _t_central(middle, df) < 2 * p - 1:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def _variance(values):
+    n = len(values)
+    mean = sum(values) / n
+    return sum((x - mean) ** 2 for x in values) / (n - 1) if n > 1 else 0
+
+
+# Mean paired difference (b - a) of every outcome with its confidence interval, and how much pairing helped:
+# the variance of an unpaired comparison over the variance of the paired one, i.e. how many times more
+# independent runs would be needed for an interval as narrow
+def paired_summary(pairs, a, b, confidence=0.95):
+    summary = {}
+    n = len(pairs)
+    for k, field in enumerate(OUTCOMES):
+        xa = [pair[a][k] for pair in pairs]
+        xb = [pair[b][k] for pair in pairs]
+        diffs = [y - x for x, y in zip(xa, xb)]
+        mean = sum(diffs) / n if n else 0
+        var = _variance(diffs) if n > 1 else 0
+        half = t_quantile(0.5 + confidence / 2, n - 1) * math.sqrt(var / n) if n > 1 else math.inf
+        unpaired = _variance(xa) + _variance(xb) if n > 1 else 0
+        summary[field] = {
+            "Mean A": sum(xa) / n if n else 0,
+            "Mean B": sum(xb) / n if n else 0,
+            "Mean Diff": mean,
+            "CI Low": mean - half,
+            "CI High": mean + half,
+            "Variance Reduction": unpaired / var if var > 0 else (math.inf if unpaired > 0 else 1),
+        }
+    return summary
+
+
+def verdict(stats):
+    if stats["CI Low"] > 0:
+        return "B higher"
+    if stats["CI High"] < 0:
+        return "B lower"
+    if stats["CI Low"] == stats["CI High"] == 0:
+        return "identical"
+    return "no significant difference"
+
+
+def run_experiment(n=30, a="standard", b="optimal", output="ab_results.csv", workers=None, base_seed=None, max_ticks=2000, confidence=0.95, quiet=True):
+    if base_seed is None:
+        base_seed = random.SystemRandom().randrange(2**31)
+    workers = workers or os.cpu_count()
+    pairs = []
+    with open(output, "w", newline="") as file, ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = csv.writer(file)
+        writer.writerow(["Test", "Seed"] + [f"{field} {arm}" for field in OUTCOMES for arm in ("A", "B", "Diff")] + ["Wall Time"])
+        file.flush()
+        futures = [pool.submit(run_pair, i + 1, base_seed + i, (a, b), max_ticks, quiet) for i in range(n)]
+        for future in as_completed(futures):
+            test, seed, results, wall = future.result()
+            writer.writerow([test, seed] + [value for k in range(len(OUTCOMES)) for value in (results[a][k], results[b][k], results[b][k] - results[a][k])] + [f"{wall:.3f}"])
+            file.flush()
+            pairs.append(results)
+            print(f"Pair {test} (seed {seed}) finished in {wall:.2f}s ({len(pairs)}/{n})")
+
+        summary = paired_summary(pairs, a, b, confidence)
+        writer.writerow([])
+        writer.writerow(["Outcome", "Mean A", "Mean B", "Mean Diff", "CI Low", "CI High", "Variance Reduction", "Verdict"])
+        for field, stats in summary.items():
+            writer.writerow([field] + [stats[key] for key in ("Mean A", "Mean B", "Mean Diff", "CI Low", "CI High", "Variance Reduction")] + [verdict(stats)])
+
+    print(f"A = {a}, B = {b}, {n} paired runs, {confidence:.0%} confidence intervals of B - A:")
+    for field, stats in summary.items():
+        reduction = stats["Variance Reduction"]
+        worth = f"pairing worth {reduction:.1f}x the runs" if math.isfinite(reduction) else "no difference within pairs"
+        print(f"  {field}: {stats['Mean Diff']:+.3f} [{stats['CI Low']:+.3f}, {stats['CI High']:+.3f}], {verdict(stats)} ({worth})")
+    print(f"Results saved to '{output}'.")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paired comparison of two routing policies with common random numbers")
+    parser.add_argument("-n", "--runs", type=int, default=30, help="number of replicates, each runs both policies")
+    parser.add_argument("-a", default="standard", help="policy A")
+    parser.add_argument("-b", default="optimal", help="policy B")
+    parser.add_argument("-o", "--output", default="ab_results.csv")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-s", "--seed", type=int, default=None, help="seed of the first replicate, replicate i uses seed+i")
+    parser.add_argument("--max-ticks", type=int, default=2000, help="stop a run that has not finished after that many ticks")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    args = parser.parse_args()
+    run_experiment(args.runs, args.a, args.b, args.output, args.workers, args.seed, args.max_ticks, args.confidence)
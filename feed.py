@@ -0,0 +1,208 @@
+from collections import namedtuple
+import numpy as np
+from environment import room_name
+
+# Bits of a room's hazard code, and the line the dashboard shows for each of them
+FIRE, DAMAGED, TAKEN = 1, 2, 4
+SITUATIONS = ((FIRE, "Fire in {}.\n"), (DAMAGED, "Earthquake damage in {}.\n"), (TAKEN, "Attack in {}.\n"))
+
+# The building as the dashboard sees it at one tick, only plain values that are never changed afterwards:
+#   metrics: the six incident counters
+#   agents: (agent name, location label, (floor index, row, col) or None once out) for each occupant
+#   hazards, codes: read-only arrays with the flat index and the hazard code of every room with a hazard
+#   updates: the recent updates
+#   finish_times, responses: when each occupant got out and the summary of the responders' times, once everyone is out (else None)
+Snapshot = namedtuple("Snapshot", "tick metrics agents hazards codes updates begin finish_times responses")
+
+
+# Publishes a snapshot of the building every simulation tick into a ring of slots, for the dashboard thread.
+# Publishing is a couple of reference assignments, so there is no lock: a reader takes `latest` (or the slot of
+# a tick and checks its tick number) and gets a whole snapshot, never a half-updated one. All the formatting
+# happens on the reader's side.
+class DashboardFeed:
+    def __init__(self, building, history=64):
+        self.shape = building.state.is_on_fire.shape
+        self.room_mask = building.room_mask  # Cells that are rooms, None when all are
+        self.slots = [None] * history
+        self.latest = None
+        self._locations = []  # Location of each agent in the latest snapshot, to reuse its entry when it didn't move
+
+    def publish(self, building):
+        tick = self.latest.tick + 1 if self.latest else 0
+        snapshot = self.capture(building, tick)
+        self.slots[tick % len(self.slots)] = snapshot
+        self.latest = snapshot
+
+    def capture(self, building, tick):
+        previous = self.latest
+        agents = []
+        for index, agent in enumerate(building.agents.values()):
+            location = agent.location
+            if index < len(self._locations) and self._locations[index] is location:
+                agents.append(previous.agents[index])
+                continue
+            if hasattr(location, "coordinates"):
+                agents.append((agent.agent_name, location.name, (location.floor - 1, location.coordinates[1], location.coordinates[2])))
+            else:
+                agents.append((agent.agent_name, str(location), None))
+            if index < len(self._locations):
+                self._locations[index] = location
+            else:
+                self._locations.append(location)
+
+        state = building.state
+        hazards = np.flatnonzero(state.is_on_fire | state.is_damaged | state.is_taken)
+        codes = (state.is_on_fire.flat[hazards].astype(np.int8)
+                 | (state.is_damaged.flat[hazards].astype(np.int8) << 1)
+                 | (state.is_taken.flat[hazards].astype(np.int8) << 2))
+        hazards.flags.writeable = False
+        codes.flags.writeable = False
+
+        evacuated = building.is_building_evacuated()
+        return Snapshot(
+            tick,
+            (building.num_fires[0], building.num_fires[1], building.num_earthquakes[0], building.num_earthquakes[1], building.num_attacks[0], building.num_attacks[1]),
+            tuple(agents),
+            hazards,
+            codes,
+            building.recent_updates(),
+            building.begin,
+            tuple(agent.finish_time for agent in building.agents.values()) if evacuated else None,
+            building.response_stats.summary() if evacuated else None,
+        )
+
+    # Snapshot of a past tick, None if it was already overwritten
+    def get(self, tick):
+        if tick is None or tick < 0:
+            return None
+        snapshot = self.slots[tick % len(self.slots)]
+        return snapshot if snapshot is not None and snapshot.tick == tick else None
+
+    def situation_lines(self, hazards, codes):
+        lines = []
+        for flat, code in zip(hazards.tolist(), codes.tolist()):
+            f, i, j = np.unravel_index(flat, self.shape)
+            for bit, text in SITUATIONS:
+                if code & bit:
+                    lines.append(text.format(room_name(f + 1, i, j)))
+        return lines
+
+    # Hazard code of every room of one floor (0 = no hazard)
+    def floor_codes(self, snapshot, floor_index):
+        num_floors, rows, cols = self.shape
+        on_floor = snapshot.hazards // (rows * cols) == floor_index
+        grid = np.zeros(rows * cols, dtype=np.int8)
+        grid[snapshot.hazards[on_floor] - floor_index * rows * cols] = snapshot.codes[on_floor]
+        return grid.reshape(rows, cols)
+
+    # Columns and rows of the agents on a floor
+    def floor_positions(self, snapshot, floor_index):
+        on_floor = [entry[2] for entry in snapshot.agents if entry[2] is not None and entry[2][0] == floor_index]
+        return [p[2] for p in on_floor], [p[1] for p in on_floor]
+
+    # Everything the dashboard shows, as text, to draw it from scratch
+    def render(self, snapshot):
+        return {
+            "metrics": metric_lines(snapshot.metrics),
+            "locations": [location_line(entry) for entry in snapshot.agents],
+            "situations": [header_line(snapshot.codes)] + self.situation_lines(snapshot.hazards, snapshot.codes),
+            "updates": "\n".join(snapshot.updates),
+            "final": final_metrics(snapshot),
+        }
+
+    # What the dashboard has to change to go from the old snapshot to the new one
+    def changes(self, old, new):
+        changes = {}
+        if new.metrics != old.metrics:
+            changes["metrics"] = metric_lines(new.metrics)
+
+        locations, moved_floors = {}, set()
+        for index, (before, after) in enumerate(zip(old.agents, new.agents)):
+            if before is not after:
+                locations[index] = location_line(after)
+                for position in (before[2], after[2]):
+                    if position is not None:
+                        moved_floors.add(position[0])
+        changes["locations"] = locations
+        changes["moved_floors"] = moved_floors
+
+        old_codes = dict(zip(old.hazards.tolist(), old.codes.tolist()))
+        new_codes = dict(zip(new.hazards.tolist(), new.codes.tolist()))
+        cells, added, removed = {}, [], []
+        for flat in old_codes.keys() | new_codes.keys():
+            before, after = old_codes.get(flat, 0), new_codes.get(flat, 0)
+            if before == after:
+                continue
+            f, i, j = (int(k) for k in np.unravel_index(flat, self.shape))
+            cells[(f, i, j)] = after
+            for bit, text in SITUATIONS:
+                if after & bit and not before & bit:
+                    added.append(text.format(room_name(f + 1, i, j)))
+                elif before & bit and not after & bit:
+                    removed.append(text.format(room_name(f + 1, i, j)))
+        changes["cells"] = cells
+        changes["added"] = added
+        changes["removed"] = removed
+        if header_line(new.codes) != header_line(old.codes):
+            changes["header"] = header_line(new.codes)
+
+        if new.updates != old.updates:
+            changes["updates"] = "\n".join(new.updates)
+        if (new.finish_times is None) != (old.finish_times is None):
+            changes["final"] = final_metrics(new)
+        return changes
+
+
+# Feed of a finished run read from its trace: the dashboard seeks to any tick and sees the building as it was then
+class ReplayFeed(DashboardFeed):
+    def __init__(self, replay, history=64):
+        self.replay = replay
+        super().__init__(replay.building_at(0), history)
+        self.seek(replay.last_tick)
+
+    def seek(self, tick):
+        self.latest = self.get(tick)
+
+    # Snapshots of the ticks asked for are rebuilt from the trace, and kept in the slots for the next diffs
+    def get(self, tick):
+        if tick is None or not 0 <= tick <= self.replay.last_tick:
+            return None
+        snapshot = self.slots[tick % len(self.slots)]
+        if snapshot is None or snapshot.tick != tick:
+            self._locations = []  # Rooms of different rebuilt buildings are different objects, nothing to reuse
+            snapshot = self.slots[tick % len(self.slots)] = self.capture(self.replay.building_at(tick), tick)
+        return snapshot
+
+
+def metric_lines(metrics):
+    fires_extinguished, total_fires, earthquakes, total_earthquakes, attacks_controlled, total_attacks = metrics
+    return (
+        f"Fires Extinguished / Total Fires: {fires_extinguished}/{total_fires} ({fires_extinguished/total_fires*100 if total_fires != 0 else 0:.1f}%)",
+        f"Earthquakes Cleaned / Total Earthquakes: {earthquakes}/{total_earthquakes} ({earthquakes/total_earthquakes*100 if total_earthquakes!=0 else 0:.1f}%)",
+        f"Attacks Controlled / Total Attacks: {attacks_controlled}/{total_attacks} ({attacks_controlled/total_attacks*100 if total_attacks!=0 else 0:.1f}%)",
+    )
+
+
+def location_line(entry):
+    return f"{entry[0]} Location: {entry[1]}\n"
+
+
+def header_line(codes):
+    return f"{int(np.count_nonzero(codes & FIRE))} rooms on fire, {int(np.count_nonzero(codes & DAMAGED))} damaged, {int(np.count_nonzero(codes & TAKEN))} taken.\n"
+
+
+# Text of the final metrics once everyone is out
+def final_metrics(snapshot):
+    if snapshot.finish_times is None:
+        return ""
+    text = ""
+    time_spent_list = [finish_time - snapshot.begin for finish_time in snapshot.finish_times]
+    for i in range(len(time_spent_list)):
+        text += f"Agent {i+1} took {time_spent_list[i]:.2f} to evacuate!\n"
+    total_time = max(time_spent_list)
+    text += f"Total Evacuation Time: {total_time:.2f}\n"
+    responses = snapshot.responses
+    text += f"Number of problems solved by Emergency Responders: {responses['count']}\n"
+    text += f"Average Response Time of Emergency Responders: {responses['mean']:.2f}\n"
+    text += f"Response Time Percentiles: p50 {responses['p50']:.2f}, p90 {responses['p90']:.2f}, p99 {responses['p99']:.2f}\n"
+    return text
@@ -0,0 +1,110 @@
+import random
+import numpy as np
+
+
+# Fire propagation, run once per simulation tick over the whole building.
+# Like the chain it replaces (a 10% chance to ignite one of the room's connections each time a room caught fire),
+# a room spreads the fire once, on the first tick it burns: it ignites each room it is connected to with the
+# probability of that kind of connection, about 10% over its four connections, so a fire grows by 0.11 rooms on
+# average (0.1 / 0.9) instead of growing for as long as it burns. It works on the indexes of the rooms that caught
+# fire since the last tick (the frontier), so a tick costs one vectorized pass whatever the size of the fire, and
+# there is no recursion.
+class FireSpread:
+    def __init__(self, building, horizontal=0.025, staircase=0.025, elevator=0.025, seed=None):
+        self.building = building
+        # Chance that the fire crosses one connection of each kind, from a room that just caught fire
+        self.probabilities = {"horizontal": horizontal, "staircase": staircase, "elevator": elevator}
+        # Seeded from the random module unless told otherwise, so seeded runs stay reproducible
+        self.rng = np.random.default_rng(seed if seed is not None else random.getrandbits(64))
+        self.shafts = None
+        self.seen = None  # Rooms on fire at the last tick, they already had their chance to spread
+
+    # Same floor connections of the burning rooms, from the layouts of their floors:
+    # index in burning of the room each connection starts from, and the local index of the room it leads to
+    def _connections(self, f, local):
+        owners, targets = [], []
+        for floor_index in np.unique(f).tolist():
+            layout = self.building.floors[floor_index].layout
+            on_floor = np.flatnonzero(f == floor_index)
+            starts = layout.indptr[local[on_floor]]
+            degrees = layout.indptr[local[on_floor] + 1] - starts
+            offsets = np.arange(degrees.sum()) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+            owners.append(np.repeat(on_floor, degrees))
+            targets.append(layout.indices[np.repeat(starts, degrees) + offsets].astype(np.int64))
+        return np.concatenate(owners), np.concatenate(targets)
+
+    # Rooms that are part of the elevator and staircase shafts, as boolean arrays like the building state
+    def _shaft_masks(self):
+        if self.shafts is None:
+            shape = self.building.state.is_on_fire.shape
+            self.shafts = {}
+            for kind, positions in self.building.shafts.items():
+                mask = self.shafts[kind] = np.zeros(shape, dtype=bool)
+                for row, col in positions:
+                    mask[:, row, col] = True
+        return self.shafts
+
+    # Chance draws for the burning rooms in one direction (channel, or one channel per room): from the building's
+    # hazard schedule when it has one, so every run of the schedule gets the same draws for the same room, else from
+    # the generator
+    def _draws(self, burning, channel):
+        schedule = self.building.schedule
+        if schedule is not None:
+            return schedule.uniforms(self.building.tick, burning, channel)
+        return self.rng.random(len(burning))
+
+    # Advance the fire by one tick, returns the (floor, row, col) indexes of the rooms that caught fire
+    def step(self):
+        on_fire = self.building.state.is_on_fire
+        seen = self.seen if self.seen is not None else np.zeros_like(on_fire)
+        self.seen = on_fire.copy()  # Put out rooms drop out, a room that catches fire again spreads it again
+        burning = np.flatnonzero(on_fire & ~seen)  # Much faster than a 3-D nonzero on big buildings
+        if len(burning) == 0:
+            return []
+        f, i, j = np.unravel_index(burning, on_fire.shape)
+        num_floors, rows, cols = on_fire.shape
+        targets = []
+
+        # Same floor: the rooms connected in the floor's layout (walls and doors included), one draw channel per
+        # direction for the rooms around, so a full grid gets the draws it always had
+        p = self.probabilities["horizontal"]
+        draws = np.array([self._draws(burning, channel) for channel in range(4)]).reshape(4, len(burning))
+        owner, target = self._connections(f, burning % (rows * cols))
+        ni, nj = np.divmod(target, cols)
+        di, dj = ni - i[owner], nj - j[owner]
+        direction = np.full(len(owner), -1)
+        for channel, (row_step, col_step) in enumerate(((0, 1), (0, -1), (1, 0), (-1, 0))):
+            direction[(di == row_step) & (dj == col_step)] = channel
+        around = direction >= 0
+        hit = around.copy()
+        hit[around] = draws[direction[around], owner[around]] < p
+        targets.append((f[owner[hit]], ni[hit], nj[hit]))
+
+        # Other floors: up and down the shafts
+        channel = 4
+        for kind, shaft in self._shaft_masks().items():
+            p = self.probabilities[kind]
+            in_shaft = shaft[f, i, j]
+            for df in (1, -1):
+                nf = f + df
+                inside = (nf >= 0) & (nf < num_floors)
+                hit = in_shaft & inside & (self._draws(burning, channel) < p)
+                channel += 1
+                hit[hit] = shaft[nf[hit], i[hit], j[hit]]
+                targets.append((nf[hit], i[hit], j[hit]))
+
+        # Doors of a floor plan, to rooms that are not around: channels after the shafts', one per door of a room
+        doors = np.flatnonzero(~around)
+        if len(doors):
+            rank = doors - np.searchsorted(owner, owner[doors])  # Place of the connection among its room's
+            hit = self._draws(burning[owner[doors]], channel + np.minimum(rank, 63 - channel)) < self.probabilities["horizontal"]
+            doors = doors[hit]
+            targets.append((f[owner[doors]], ni[doors], nj[doors]))
+
+        nf = np.concatenate([t[0] for t in targets])
+        ni = np.concatenate([t[1] for t in targets])
+        nj = np.concatenate([t[2] for t in targets])
+        flat = np.unique(np.ravel_multi_index((nf, ni, nj), on_fire.shape))
+        flat = flat[~on_fire.flat[flat]]
+        return list(zip(*np.unravel_index(flat, on_fire.shape)))
+
@@ -0,0 +1,173 @@
+import json
+import os
+import numpy as np
+from layout import FloorLayout
+
+'''
+_____________________________________________________________________________________________________________________
+Floor plans of real sites, read from a JSON file instead of the full rectangular grids of the random buildings:
+
+    {
+      "name": "Main site",
+      "floors": [
+        {"plan": ["A....##",
+                  ".S..E..",
+                  "...#..."],
+         "walls": [[[0, 1], [1, 1]]],
+         "doors": [[[0, 0], [2, 6]]]},
+        {"plan": ["#....##",
+                  ".S..E..",
+                  "......."], "repeat": 9}
+      ]
+    }
+
+Floors are listed from the ground floor up, "repeat" gives the same plan to that many floors in a row (they share
+one layout). Each character of a plan is a cell of the floor: "." a room, "#" or " " no room (outside, or a wall
+thick enough to be one), "E" and "S" the room of an elevator or staircase shaft, "A" an assembly point. Rooms are
+connected to the rooms above, left, right and below them, except across the walls (pairs of [row, col] cells), and
+to the other end of the doors (pairs of any two rooms, for corridors). Rows can have different lengths and floors
+different sizes, every floor is laid out on the widest and highest of them.
+A shaft goes through every floor, so its cell has to be a room on all of them. Without any "A", the assembly points
+are placed on the ground floor as in a random building.
+
+The parsed plan can be cached in a binary file next to the JSON one (its name plus ".npz"), read back as arrays
+without parsing, and parsed again when the JSON file changes.
+'''
+
+CELLS = {".": "room", "#": None, " ": None, "E": "elevator", "S": "staircase", "A": "assembly"}
+
+
+# A parsed floor plan: the layout of every floor (floors with the same plan share one), the (row, col) of every
+# shaft, and the (floor index, row, col) of the assembly points
+class FloorPlan:
+    def __init__(self, num_rows, num_cols, layouts, floor_layouts, shafts, assembly_points, name=None, path=None):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.layouts = layouts
+        self.floor_layouts = floor_layouts  # Index in layouts of the layout of each floor, ground floor first
+        self.shafts = shafts  # {"elevator": [(row, col)], "staircase": [(row, col)]}
+        self.assembly_points = assembly_points
+        self.name = name
+        self.path = path  # File it was read from, if any
+
+    @property
+    def num_floors(self):
+        return len(self.floor_layouts)
+
+    def layout(self, floor_index):
+        return self.layouts[self.floor_layouts[floor_index]]
+
+    # Which cells of the building are rooms, shaped like the building state; None when all of them are
+    def room_mask(self):
+        if all(layout.rooms is None for layout in self.layouts):
+            return None
+        full = np.ones(self.num_rows * self.num_cols, dtype=bool)
+        return np.stack([(layout.rooms if layout.rooms is not None else full) for layout in map(self.layout, range(self.num_floors))]).reshape(
+            self.num_floors, self.num_rows, self.num_cols)
+
+    # Plan from the JSON description (already decoded)
+    @classmethod
+    def parse(cls, data, path=None):
+        templates = data["floors"]
+        if not templates:
+            raise ValueError("a floor plan needs at least one floor")
+        num_rows = max(len(template["plan"]) for template in templates)
+        num_cols = max((len(row) for template in templates for row in template["plan"]), default=0)
+        if num_rows == 0 or num_cols == 0:
+            raise ValueError("a floor plan needs at least one room")
+
+        layouts, floor_layouts = [], []
+        marks = {"elevator": set(), "staircase": set()}
+        assembly_points = []
+        for template in templates:
+            grid = np.full((num_rows, num_cols), " ", dtype="<U1")
+            for row, text in enumerate(template["plan"]):
+                grid[row, :len(text)] = list(text)
+            unknown = set(np.unique(grid).tolist()) - set(CELLS)
+            if unknown:
+                raise ValueError(f"unknown cells in a floor plan: {''.join(sorted(unknown))}")
+            cells = np.isin(grid, [cell for cell, kind in CELLS.items() if kind is not None])
+            layout = FloorLayout.from_cells(cells, _pairs(template.get("walls", ()), num_cols), _pairs(template.get("doors", ()), num_cols))
+            for kind, letter in (("elevator", "E"), ("staircase", "S")):
+                marks[kind].update(_cells(grid == letter))
+            points = _cells(grid == "A")
+            layouts.append(layout)
+            for repeat in range(template.get("repeat", 1)):
+                assembly_points += [(len(floor_layouts), row, col) for row, col in points]
+                floor_layouts.append(len(layouts) - 1)
+
+        shafts = {kind: sorted(positions) for kind, positions in marks.items()}
+        plan = cls(num_rows, num_cols, layouts, floor_layouts, shafts, assembly_points, data.get("name"), path)
+        for kind, positions in shafts.items():
+            for row, col in positions:
+                if not all(layout.is_room(row * num_cols + col) for layout in map(plan.layout, range(plan.num_floors))):
+                    raise ValueError(f"the {kind} shaft at row {row}, column {col} is not a room on every floor")
+        return plan
+
+    # Plan of a JSON file, from its cache when it is up to date (cache=False: always parse, and write no cache)
+    @classmethod
+    def load(cls, path, cache=True):
+        stat = os.stat(path)
+        source = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+        cache_path = f"{path}.npz"
+        if cache and os.path.exists(cache_path):
+            try:
+                plan = cls._read_cache(cache_path, source, path)
+            except (OSError, ValueError, KeyError):
+                plan = None  # Unreadable: parsed and written again
+            if plan is not None:
+                return plan
+        with open(path) as file:
+            plan = cls.parse(json.load(file), path)
+        if cache:
+            plan._write_cache(cache_path, source)
+        return plan
+
+    # Every array of the plan in one .npz file, written under another name first so a reader never sees half of it
+    def _write_cache(self, cache_path, source):
+        arrays = {
+            "source": source,
+            "shape": np.array([self.num_rows, self.num_cols], dtype=np.int64),
+            "floor_layouts": np.array(self.floor_layouts, dtype=np.int64),
+            "elevator": np.array(self.shafts["elevator"], dtype=np.int64).reshape(-1, 2),
+            "staircase": np.array(self.shafts["staircase"], dtype=np.int64).reshape(-1, 2),
+            "assembly_points": np.array(self.assembly_points, dtype=np.int64).reshape(-1, 3),
+            "name": np.array(self.name or ""),
+        }
+        for k, layout in enumerate(self.layouts):
+            arrays[f"indptr{k}"] = layout.indptr
+            arrays[f"indices{k}"] = layout.indices
+            if layout.rooms is not None:
+                arrays[f"rooms{k}"] = layout.rooms
+        partial = f"{cache_path}.{os.getpid()}.tmp"
+        with open(partial, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(partial, cache_path)
+
+    # Plan of the cache file, None if it was written for another version of the JSON file
+    @classmethod
+    def _read_cache(cls, cache_path, source, path):
+        with np.load(cache_path, allow_pickle=False) as arrays:
+            if not np.array_equal(arrays["source"], source):
+                return None
+            num_rows, num_cols = arrays["shape"].tolist()
+            floor_layouts = arrays["floor_layouts"].tolist()
+            layouts = [
+                FloorLayout(arrays[f"indptr{k}"], arrays[f"indices{k}"], num_rows, num_cols, arrays[f"rooms{k}"] if f"rooms{k}" in arrays else None)
+                for k in range(max(floor_layouts) + 1)
+            ]
+            shafts = {kind: [tuple(position) for position in arrays[kind].tolist()] for kind in ("elevator", "staircase")}
+            assembly_points = [tuple(point) for point in arrays["assembly_points"].tolist()]
+            name = str(arrays["name"]) or None
+        return cls(num_rows, num_cols, layouts, floor_layouts, shafts, assembly_points, name, path)
+
+
+# (row, col) of the cells set in a boolean grid
+def _cells(mask):
+    rows, cols = np.nonzero(mask)
+    return list(zip(rows.tolist(), cols.tolist()))
+
+
+# [[row, col], [row, col]] pairs of a plan as pairs of local indexes
+def _pairs(pairs, num_cols):
+    return [(a[0] * num_cols + a[1], b[0] * num_cols + b[1]) for a, b in pairs]
@@ -0,0 +1,239 @@
+import asyncio
+import functools
+import json
+import time
+from spade.behaviour import CyclicBehaviour
+import messages
+from transport import InMemoryTransport
+
+'''
+_____________________________________________________________________________________________________________________
+Counters and timers on the hot paths of a run: behaviour run() durations, mailbox depths, messages sent and received
+per kind, event loop lag, and the time spent in the navigation, scan and step methods.
+Off by default: enable() wraps the measured methods and disable() puts the originals back, so when it is off the
+code runs exactly as written and costs nothing.
+'''
+
+PREFIX = "evac_"
+
+# Every metric: kind, name of its label, help text
+METRICS = {
+    "behaviour_run_seconds": ("summary", "behaviour", "Wall time of one run() of a behaviour, awaits included"),
+    "call_seconds": ("summary", "function", "Wall time of one call of a measured method"),
+    "loop_lag_seconds": ("summary", "clock", "Delay between a task yielding and being resumed by the event loop"),
+    "messages_sent": ("counter", "kind", "Messages sent, by kind"),
+    "messages_received": ("counter", "kind", "Messages received by a behaviour, by kind"),
+    "mailbox_depth": ("gauge", "behaviour", "Messages waiting in a behaviour's mailbox when its run() starts"),
+}
+
+
+# Values of the metrics, one series per label value:
+#   counters: value; timers: [count, total, max]; gauges: [last, max]
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+
+    def count(self, name, label, value=1):
+        series = self.counters.setdefault(name, {})
+        series[label] = series.get(label, 0) + value
+
+    def observe(self, name, label, seconds):
+        series = self.timers.setdefault(name, {})
+        entry = series.get(label)
+        if entry is None:
+            series[label] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+    def gauge(self, name, label, value):
+        series = self.gauges.setdefault(name, {})
+        entry = series.get(label)
+        if entry is None:
+            series[label] = [value, value]
+        else:
+            entry[0] = value
+            if value > entry[1]:
+                entry[1] = value
+
+    # Everything as plain JSON values (read from other threads too: the series are copied first)
+    def summary(self):
+        return {
+            "enabled": self.enabled,
+            "seconds": time.perf_counter() - self.started,
+            "counters": {name: dict(list(series.items())) for name, series in list(self.counters.items())},
+            "timers": {
+                name: {label: {"count": count, "total": total, "mean": total / count, "max": top} for label, (count, total, top) in list(series.items())}
+                for name, series in list(self.timers.items())
+            },
+            "gauges": {name: {label: {"last": last, "max": top} for label, (last, top) in list(series.items())} for name, series in list(self.gauges.items())},
+        }
+
+    # OpenMetrics text exposition of the summary
+    def openmetrics(self):
+        summary = self.summary()
+        lines = []
+        for name, (kind, label, text) in METRICS.items():
+            metric = PREFIX + name
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"# HELP {metric} {text}")
+            if kind == "counter":
+                for value, count in summary["counters"].get(name, {}).items():
+                    lines.append(f'{metric}_total{{{label}="{_escape(value)}"}} {count}')
+            elif kind == "summary":
+                for value, entry in summary["timers"].get(name, {}).items():
+                    lines.append(f'{metric}_count{{{label}="{_escape(value)}"}} {entry["count"]}')
+                    lines.append(f'{metric}_sum{{{label}="{_escape(value)}"}} {entry["total"]:.9f}')
+            else:
+                for value, entry in summary["gauges"].get(name, {}).items():
+                    lines.append(f'{metric}{{{label}="{_escape(value)}"}} {entry["last"]}')
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+_patched = []  # (owner, attribute, original) of every wrapped method
+
+
+def _replace(owner, name, wrapper, original):
+    functools.update_wrapper(wrapper, original)
+    setattr(owner, name, wrapper)
+    _patched.append((owner, name, original))
+
+
+# Time every call of owner.name in call_seconds{function="Owner.name"}
+def _time_calls(owner, name):
+    original = owner.__dict__[name]
+    label = f"{owner.__qualname__}.{name}"
+    if asyncio.iscoroutinefunction(original):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                registry.observe("call_seconds", label, time.perf_counter() - start)
+    else:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                registry.observe("call_seconds", label, time.perf_counter() - start)
+    _replace(owner, name, wrapper, original)
+
+
+# Every behaviour of every agent: run() duration, mailbox depth, messages in and out
+def _instrument_behaviours():
+    run = CyclicBehaviour.__dict__["_run"]
+    send = CyclicBehaviour.__dict__["send"]
+    receive = CyclicBehaviour.__dict__["receive"]
+    deliver_all = InMemoryTransport.__dict__["deliver_all"]
+
+    async def timed_run(self):
+        label = type(self).__qualname__
+        if self.queue is not None:
+            registry.gauge("mailbox_depth", label, self.queue.qsize())
+        start = time.perf_counter()
+        try:
+            await run(self)
+        finally:
+            registry.observe("behaviour_run_seconds", label, time.perf_counter() - start)
+
+    async def counted_send(self, msg):
+        registry.count("messages_sent", messages.message_kind(msg) or "other")
+        await send(self, msg)
+
+    async def counted_receive(self, timeout=None):
+        msg = await receive(self, timeout)
+        if msg is not None:
+            registry.count("messages_received", messages.message_kind(msg) or "other")
+        return msg
+
+    # Broadcasts on the in-memory bus skip send, one message per recipient
+    def counted_deliver_all(self, msg, recipients):
+        sent = deliver_all(self, msg, recipients)
+        registry.count("messages_sent", messages.message_kind(msg) or "other", sent)
+        return sent
+
+    _replace(CyclicBehaviour, "_run", timed_run, run)
+    _replace(CyclicBehaviour, "send", counted_send, send)
+    _replace(CyclicBehaviour, "receive", counted_receive, receive)
+    _replace(InMemoryTransport, "deliver_all", counted_deliver_all, deliver_all)
+
+
+def enable():
+    if registry.enabled:
+        return
+    # Imported here: the measured modules don't depend on this one
+    from agents import OccupantAgent, EmergencyResponderAgent, BuildingManagementAgent
+    from environment import Building
+    from crowd import Crowd
+    from dispatch import Dispatcher
+    from routing import RoutingEngine
+    from fire import FireSpread
+    from planner import EvacuationPlanner
+
+    _instrument_behaviours()
+    for owner, name in (
+        (Building, "simulate_step"),
+        (Building, "unnoted_rooms"),
+        (OccupantAgent.ReceiveInstructionsBehaviour, "navigate_to_exit"),
+        (OccupantAgent.ReceiveInstructionsBehaviour, "walk_to"),
+        (EmergencyResponderAgent, "navigate_to_room"),
+        (BuildingManagementAgent.ManageBuildingBehaviour, "handle_room"),
+        (BuildingManagementAgent.ManageBuildingBehaviour, "flush_avoid_notices"),
+        (Crowd, "step"),
+        (Dispatcher, "assign"),
+        (RoutingEngine, "block"),
+        (RoutingEngine, "unblock"),
+        (FireSpread, "step"),
+        (EvacuationPlanner, "plan"),
+        (EvacuationPlanner, "replan"),
+    ):
+        _time_calls(owner, name)
+    registry.enabled = True
+
+
+def disable():
+    while _patched:
+        owner, name, original = _patched.pop()
+        setattr(owner, name, original)
+    registry.enabled = False
+
+
+# Measures the event loop lag every interval (of the run's clock) until cancelled: how long a task that yields
+# waits before the loop gets back to it, i.e. how much work is queued in front of it
+async def watch_loop(clock, interval=1.0):
+    label = "virtual" if clock.virtual else "real"
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(0)
+        registry.observe("loop_lag_seconds", label, time.perf_counter() - start)
+        await clock.sleep(interval)
+
+
+# /metrics (OpenMetrics text) and /metrics.json on a Flask server, e.g. the Dash app's
+def register_endpoints(server):
+    from flask import Response
+
+    def openmetrics():
+        return Response(registry.openmetrics(), mimetype="application/openmetrics-text; version=1.0.0; charset=utf-8")
+
+    def summary():
+        return Response(json.dumps(registry.summary()), mimetype="application/json")
+
+    server.add_url_rule("/metrics", "metrics", openmetrics)
+    server.add_url_rule("/metrics.json", "metrics_json", summary)
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# Room graph of a floor in compressed sparse row form: the neighbours of room k (local index on the floor)
+# are indices[indptr[k]:indptr[k + 1]]. Floors with the same plan share one layout.
+# rooms: which cells of the rows x cols grid are rooms (None when all of them are), the others have no neighbours
+class FloorLayout:
+    def __init__(self, indptr, indices, num_rows, num_cols, rooms=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_rooms = len(indptr) - 1
+        self.rooms = rooms
+        self._adjacency = None
+
+    # Full rows x cols grid where every room is connected to the rooms above, left, right and below it
+    # (the order the rooms used to be connected in), built with array operations
+    @classmethod
+    def grid(cls, num_rows, num_cols):
+        local = np.arange(num_rows * num_cols, dtype=np.int32).reshape(num_rows, num_cols)
+        candidates = np.full((num_rows, num_cols, 4), -1, dtype=np.int32)
+        candidates[1:, :, 0] = local[:-1, :]  # Up
+        candidates[:, 1:, 1] = local[:, :-1]  # Left
+        candidates[:, :-1, 2] = local[:, 1:]  # Right
+        candidates[:-1, :, 3] = local[1:, :]  # Down
+        candidates = candidates.reshape(-1, 4)
+        valid = candidates >= 0
+        indptr = np.zeros(num_rows * num_cols + 1, dtype=np.int64)
+        np.cumsum(valid.sum(axis=1), out=indptr[1:])
+        return cls(indptr, candidates[valid], num_rows, num_cols)
+
+    # Grid of rows x cols cells where only the cells set in `cells` (boolean array) are rooms, each connected to the
+    # rooms above, left, right and below it like grid, except across the walls, plus the doors.
+    # walls, doors: pairs of local indexes, walls split neighbouring rooms, doors connect any two rooms (corridors)
+    @classmethod
+    def from_cells(cls, cells, walls=(), doors=()):
+        cells = np.asarray(cells, dtype=bool)
+        num_rows, num_cols = cells.shape
+        size = num_rows * num_cols
+        layout = cls.grid(num_rows, num_cols)
+        source = np.repeat(np.arange(size, dtype=np.int64), np.diff(layout.indptr))
+        target = layout.indices.astype(np.int64)
+        flat = cells.ravel()
+        keep = flat[source] & flat[target]
+        walls = np.asarray(walls, dtype=np.int64).reshape(-1, 2)
+        if len(walls):
+            # Both ways of every wall, as source * size + target
+            cut = np.concatenate([walls[:, 0] * size + walls[:, 1], walls[:, 1] * size + walls[:, 0]])
+            keep &= ~np.isin(source * size + target, cut)
+        source, target = source[keep], target[keep]
+        doors = np.asarray(doors, dtype=np.int64).reshape(-1, 2)
+        if len(doors):
+            if not (flat[doors[:, 0]] & flat[doors[:, 1]]).all():
+                raise ValueError("a door connects a cell that is not a room")
+            source = np.concatenate([source, doors[:, 0], doors[:, 1]])
+            target = np.concatenate([target, doors[:, 1], doors[:, 0]])
+        order = np.argsort(source, kind="stable")  # The grid's order first, then the doors
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=size), out=indptr[1:])
+        return cls(indptr, target[order].astype(np.int32), num_rows, num_cols, None if flat.all() else flat)
+
+    def is_room(self, local):
+        return self.rooms is None or bool(self.rooms[local])
+
+    def neighbors(self, local):
+        return self.indices[self.indptr[local]:self.indptr[local + 1]]
+
+    # The same graph as Python lists, for the searches that walk it one room at a time
+    def adjacency(self):
+        if self._adjacency is None:
+            indices = self.indices.tolist()
+            indptr = self.indptr.tolist()
+            self._adjacency = [indices[indptr[k]:indptr[k + 1]] for k in range(self.num_rooms)]
+        return self._adjacency
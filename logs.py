@@ -0,0 +1,84 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+'''
+_____________________________________________________________________________________________________________________
+Logging of the simulation: a logger per subsystem under "evac" (occupant, responder, management, crowd, building,
+run). Messages are %-style with their arguments and only formatted by a handler, so a message of a level that is off
+costs a level check. By default INFO and above go to stdout as plain lines, like the prints they replace, and every
+move is DEBUG. Batch runs can write the logs to a file from a background thread (JSON lines) or turn them off.
+'''
+
+ROOT = "evac"
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR, "off": logging.CRITICAL + 1}
+
+_listener = None  # Thread writing the log file, if there is one
+
+
+def get(subsystem):
+    return logging.getLogger(f"{ROOT}.{subsystem}")
+
+
+# Plain lines on whatever sys.stdout is when a record comes, so contextlib.redirect_stdout still silences a run
+class _Stdout(logging.StreamHandler):
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+# Records go to the writer thread as they are: their arguments are names and numbers, formatted over there
+class _Enqueue(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# One JSON object per line: time, level, subsystem, message
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({"time": record.created, "level": record.levelname, "subsystem": record.name.partition(".")[2], "message": record.getMessage()})
+
+
+# level: name in LEVELS ("off" drops everything) or a logging level
+# path: file to also write the logs to, as JSON lines, from a background thread; console: plain lines on stdout
+def configure(level="info", path=None, console=True):
+    global _listener
+    stop()
+    root = logging.getLogger(ROOT)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(LEVELS[level] if isinstance(level, str) else level)
+    root.propagate = False
+    if console:
+        handler = _Stdout()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(handler)
+    if path is not None:
+        file = logging.FileHandler(path, mode="w")
+        file.setFormatter(JsonFormatter())
+        records = queue.SimpleQueue()
+        root.addHandler(_Enqueue(records))
+        _listener = logging.handlers.QueueListener(records, file)
+        _listener.start()
+    if not root.handlers:
+        root.addHandler(logging.NullHandler())  # Not even Python's last resort handler on stderr
+
+
+# Write what is left in the queue and close the log file
+def stop():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+configure()
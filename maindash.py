@@ -1,25 +1,35 @@
-import spade
-import random
 import asyncio
-from environment import Building
-from agents import OccupantAgent, EmergencyResponderAgent, BuildingManagementAgent
+from simulation import create_building, run_simulation
+from batch import run_batch
+from feed import DashboardFeed, ReplayFeed
+from replay import Replay
+import instrumentation
+import logs
+import argparse
 import dash
-from dash import dcc, html
+from dash import dcc, html, Patch, no_update, ctx
+from dash.exceptions import PreventUpdate
 from threading import Thread
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.graph_objs as go
-import csv
 
 # Initialize Dash app
 app = dash.Dash(__name__)
+instrumentation.register_endpoints(app.server)  # /metrics and /metrics.json, filled in when the run is instrumented
 
 # Initialize global variables
-performance_metrics = [0] * 6
-agent_locations = ""
-measures = [None, None, None]
-active_situations = ""  # To store active situations of rooms
-recent_updates=""
-final_metrics=""
+feed = None  # Snapshots of the running simulation, published every tick
+
+# Colour of each hazard code of the floor map: nothing, fire, damage, both, attack...
+HAZARD_COLORS = ["#E8F8F5", "#E74C3C", "#A04000", "#922B21", "#8E44AD", "#C0392B", "#6C3483", "#000000"]
+HAZARD_COLORSCALE = [[k / 8 + d, color] for k, color in enumerate(HAZARD_COLORS) for d in (0, 1 / 8)]
+
+# Seek bar through a recorded run, only shown when the dashboard replays a trace
+replay_slider = dcc.Slider(id="replay-tick", min=0, max=0, step=1, value=0, marks=None, tooltip={"placement": "bottom"})
+replay_controls = html.Div(
+    children=[html.H3("Replay: simulation tick", style={"color": "#2874A6", "font-size": "24px"}), replay_slider],
+    style={"display": "none"},
+)
 
 # Define the Dash layout
 app.layout = html.Div(
@@ -37,6 +47,8 @@ app.layout = html.Div(
             },
         ),
 
+        replay_controls,
+
         # Main container for left and right side sections
         html.Div(
             children=[
@@ -79,13 +91,23 @@ app.layout = html.Div(
                                 html.H3("Agent Locations", style={"color": "#2874A6", "font-size": "24px"}),
                                 html.Div(
                                     children=[
-                                        html.Pre(id="agentlocations", style={"font-size": "18px", "color": "#1F618D"}),
+                                        html.Pre(id="agentlocations", children=[], style={"font-size": "18px", "color": "#1F618D"}),
                                     ],
                                     style={"padding": "20px", "borderRadius": "10px", "backgroundColor": "#E8F8F5", "boxShadow": "0 4px 8px rgba(0, 0, 0, 0.1)"},
                                 ),
                             ],
                             style={"marginBottom": "30px", "padding": "20px", "borderRadius": "15px", "backgroundColor": "#D5DBDB"},
                         ),
+
+                        # Floor Map Section: hazards of one floor and the agents on it
+                        html.Div(
+                            children=[
+                                html.H3("Floor Map", style={"color": "#2874A6", "font-size": "24px"}),
+                                dcc.Dropdown(id="floor-select", options=[], value=0, clearable=False),
+                                dcc.Graph(id="floor-map"),
+                            ],
+                            style={"marginBottom": "30px", "padding": "20px", "borderRadius": "15px", "backgroundColor": "#D5DBDB"},
+                        ),
                     ],
                     style={"flex": "1", "display": "flex", "flexDirection": "column"},  # Flex container for the left side
                 ),
@@ -96,7 +118,7 @@ app.layout = html.Div(
                         html.H3("Active Situations in Rooms", style={"color": "#2874A6", "font-size": "24px"}),
                         html.Div(
                             children=[
-                                html.Pre(id="activesituations", style={"font-size": "18px", "color": "#1F618D"}),
+                                html.Pre(id="activesituations", children=[], style={"font-size": "18px", "color": "#1F618D"}),
                             ],
                             style={"padding": "20px", "borderRadius": "10px", "backgroundColor": "#E8F8F5", "boxShadow": "0 4px 8px rgba(0, 0, 0, 0.1)"},
                         ),
@@ -135,12 +157,38 @@ app.layout = html.Div(
             id="interval-component",
             interval=500,  # Update every 0.5 seconds
             n_intervals=0
-        )
+        ),
+        # Last simulation tick the page has drawn, the next update only brings what changed after it
+        dcc.Store(id="dashboard-tick", data=-1),
     ],
     style={"fontFamily": "Arial, sans-serif", "backgroundColor": "#F4F6F6", "padding": "20px"}
 )
 
-# Update performance metrics and active room situations every interval (i.e., 0.5 seconds)
+# Hazard codes of a floor for the heatmap, None (a gap) where a floor plan has no room
+def floor_cells(snapshot, floor_index):
+    codes = feed.floor_codes(snapshot, floor_index).tolist()
+    if feed.room_mask is None:
+        return codes
+    rooms = feed.room_mask[floor_index].tolist()
+    return [[code if room else None for code, room in zip(row, room_row)] for row, room_row in zip(codes, rooms)]
+
+
+# Heatmap of the hazards of a floor, with the agents on it as markers
+def floor_figure(snapshot, floor_index):
+    xs, ys = feed.floor_positions(snapshot, floor_index)
+    figure = go.Figure(
+        data=[
+            go.Heatmap(z=floor_cells(snapshot, floor_index), zmin=-0.5, zmax=7.5, colorscale=HAZARD_COLORSCALE, showscale=False, xgap=1, ygap=1),
+            go.Scatter(x=xs, y=ys, mode="markers", marker={"size": 12, "color": "#2E86C1"}, name="Agents"),
+        ],
+    )
+    figure.update_layout(yaxis={"autorange": "reversed"}, margin={"l": 20, "r": 20, "t": 20, "b": 20}, showlegend=False)
+    return figure
+
+
+# Every interval, send the page only what changed since the tick it has drawn (nothing at all when nothing changed).
+# A full redraw only happens on the first load, when the floor shown changes or when the page fell too far behind.
+# Everything is formatted here, in the dashboard thread, from the snapshots the simulation published.
 @app.callback(
     [
         Output("fires-metrics", "children"),
@@ -151,176 +199,127 @@ app.layout = html.Div(
         Output("activesituations", "children"),  # Add active situations output
         Output("recentupdates", "children"),
         Output("finalmetrics", "children"),
+        Output("floor-map", "figure"),
+        Output("floor-select", "options"),
+        Output("dashboard-tick", "data"),
     ],
-    [Input("interval-component", "n_intervals")]
+    [Input("interval-component", "n_intervals"), Input("floor-select", "value"), Input("replay-tick", "value")],
+    [State("dashboard-tick", "data")],
 )
-def update_metrics(n):
-    # Access global performance metrics
-    fires_extinguished = performance_metrics[0]
-    total_fires = performance_metrics[1]
-    earthquakes = performance_metrics[2]
-    total_earthquakes = performance_metrics[3]
-    attacks_controlled = performance_metrics[4]
-    total_attacks = performance_metrics[5]
-    agentlocations=agent_locations
-    activesituations = active_situations
-    recentupdates = recent_updates
-    finalmetrics=final_metrics
+def update_metrics(n, floor_index, replay_tick, seen_tick):
+    if isinstance(feed, ReplayFeed) and ctx.triggered_id == "replay-tick":
+        feed.seek(replay_tick)
+    latest = feed.latest if feed is not None else None
+    if latest is None:
+        raise PreventUpdate
+    floor_index = floor_index or 0
+    seen = feed.get(seen_tick)
+    if seen is None or ctx.triggered_id == "floor-select":
+        full = feed.render(latest)
+        num_floors, rows, cols = feed.shape
+        return (
+            *full["metrics"],
+            full["locations"],
+            f"This building has {num_floors} floors and {rows}x{cols} structure!",
+            full["situations"],
+            full["updates"],
+            full["final"],
+            floor_figure(latest, floor_index),
+            [{"label": f"Floor {f + 1}", "value": f} for f in range(num_floors)],
+            latest.tick,
+        )
+    if latest.tick == seen.tick:
+        raise PreventUpdate
+    changes = feed.changes(seen, latest)
+
+    metrics = changes.get("metrics", (no_update,) * 3)
+
+    locations = no_update
+    if changes["locations"]:
+        locations = Patch()
+        for index, line in changes["locations"].items():
+            locations[index] = line
+
+    situations = no_update
+    if changes["added"] or changes["removed"] or "header" in changes:
+        situations = Patch()
+        if "header" in changes:
+            situations[0] = changes["header"]
+        for line in changes["removed"]:
+            situations.remove(line)
+        for line in changes["added"]:
+            situations.append(line)
+
+    figure = no_update
+    cells = [(i, j, code) for (f, i, j), code in changes["cells"].items() if f == floor_index]
+    if cells or floor_index in changes["moved_floors"]:
+        figure = Patch()
+        for i, j, code in cells:
+            figure["data"][0]["z"][i][j] = code
+        if floor_index in changes["moved_floors"]:
+            xs, ys = feed.floor_positions(latest, floor_index)
+            figure["data"][1]["x"] = xs
+            figure["data"][1]["y"] = ys
 
-    # Return the active situations that were set in the main function
     return (
-        f"Fires Extinguished / Total Fires: {fires_extinguished}/{total_fires} ({fires_extinguished/total_fires*100 if total_fires != 0 else 0:.1f}%)",
-        f"Earthquakes Cleaned / Total Earthquakes: {earthquakes}/{total_earthquakes} ({earthquakes/total_earthquakes*100 if total_earthquakes!=0 else 0:.1f}%)",
-        f"Attacks Controlled / Total Attacks: {attacks_controlled}/{total_attacks} ({attacks_controlled/total_attacks*100 if total_attacks!=0 else 0:.1f}%)",
-        agentlocations,
-        f"This building has {measures[0]} floors and {measures[1]}x{measures[2]} structure!",
-        activesituations,  # Show the active situations for rooms
-        recentupdates,
-        finalmetrics,
+        *metrics,
+        locations,
+        no_update,
+        situations,
+        changes.get("updates", no_update),
+        changes.get("final", no_update),
+        figure,
+        no_update,
+        latest.tick,
     )
 
 
 def run_dash(app):
     app.run_server(debug=True, use_reloader=False)
 
-async def main():
+async def main(clock=None, transport=None, trace=None, crowd=None, responders_per_role=1, plan=None):
     dash_thread = Thread(target=run_dash, args=(app,))
     dash_thread.start()
-    building = Building()
-    global measures
-    measures = [building.num_floors, building.rows, building.cols]
-    building.connect_elevators()
-    building.connect_staircases()
-    num_agents=random.randint(4,8)
-    agents_dict = {}
-    for i in range(num_agents):
-        agent_name = f"occupant_agent_{i+1}"
-        jid = f"occupant{i+1}@localhost"
-        password = "password"
-        name = f"Agent {i+1}"
-        status = "able-bodied" if i % 2 == 0 else "disabled"
-        agents_dict[agent_name] = OccupantAgent(jid, password, name, building, status)
-    emergency_responder_agent_1 = EmergencyResponderAgent("responder1@localhost", "password", "Fire-fighter", building, "firefighter")
-    emergency_responder_agent_2 = EmergencyResponderAgent("responder2@localhost", "password", "Rescue Worker", building, "Rescue Worker")
-    emergency_responder_agent_3 = EmergencyResponderAgent("responder3@localhost", "password", "Paramedic", building, "Paramedic")
-    emergency_responder_agent_4 = EmergencyResponderAgent("responder4@localhost", "password", "Security Officer", building, "Security Officer")
-    building_management_agent = BuildingManagementAgent("management@localhost", "password", building, "Building Management")
-    for agent in agents_dict.values():
-    	building.add_agent(agent)
-    building.add_emergency_agent(emergency_responder_agent_1)
-    building.add_emergency_agent(emergency_responder_agent_2)
-    building.add_emergency_agent(emergency_responder_agent_3)
-    building.add_emergency_agent(emergency_responder_agent_4)
-    building.add_management_agent(building_management_agent)
-    
-    for agent in agents_dict.values():
-    	await agent.start(auto_register=True)
-    await emergency_responder_agent_1.start(auto_register=True)
-    await emergency_responder_agent_2.start(auto_register=True)
-    await emergency_responder_agent_3.start(auto_register=True)
-    await emergency_responder_agent_4.start(auto_register=True)
-    await building_management_agent.start(auto_register=True)
-    
-    # Start simulation
-    while not building.is_building_evacuated():
-        building.simulate_step()
-        await asyncio.sleep(1)
-
-        # Update global performance metrics
-        global performance_metrics
-        performance_metrics = [building.num_fires[0], building.num_fires[1], building.num_earthquakes[0], building.num_earthquakes[1], building.num_attacks[0], building.num_attacks[1]]
-
-        # Update agent locations dynamically
-        global agent_locations
-        agent_locations=""
-        for i in building.agents.values():
-            agent_locations+=f"{i.agent_name} Location: {i.location.name if hasattr(i.location, 'name') else i.location}\n"
-        
-        # Update active situations
-        global active_situations
-        active_situations = ""
-        for floor in building.floors:
-            for i in range(floor.num_cols):
-                for j in range(floor.num_rows):
-                    room=floor.get_room(j,i)
-                    if room.is_on_fire:
-                        active_situations += f"Fire in {room.name}.\n"
-                    if room.is_damaged:
-                        active_situations += f"Earthquake damage in {room.name}.\n"
-                    if room.is_taken:
-                        active_situations += f"Attack in {room.name}.\n"
-                        
-        global recent_updates
-        recent_updates=building.updates
-        
-        global final_metrics
-        final_metrics=""
-        time_spent_list=[]
-        if building.is_building_evacuated():
-            for i in building.agents.values():
-                time_spent = i.finish_time - building.begin
-                time_spent_list.append(time_spent)
-            for i in range (len(time_spent_list)):
-                final_metrics+=f"Agent {i+1} took {time_spent_list[i]:.2f} to evacuate!\n"
-            total_time = max(time_spent_list)
-            final_metrics+=f"Total Evacuation Time: {total_time:.2f}\n"
-            final_metrics+=f"Number of problems solved by Emergency Responders: {len(building.times)}\n"
-            final_metrics+=f"Average Response Time of Emergency Responders: {sum(building.times)/len(building.times) if len(building.times) != 0 else 0:.2f}\n"
-        
-    print("Every Occupant evacuated! Success!")
-    values = building.performance_metrics()
-    
-    for agent in agents_dict.values():
-    	await agent.stop()
-    await emergency_responder_agent_1.stop()
-    await emergency_responder_agent_2.stop()
-    await emergency_responder_agent_3.stop()
-    await emergency_responder_agent_4.stop()
-    await building_management_agent.stop()
-    return values
-
-async def run_tests():
-    values_total = [0] * 11
-    n = 50
-    results = []  # Store results for each test
-
-    for i in range(n):
-        print(f"Running test {i + 1}...")
-        values = await main()
-        values_total = [x + y for x, y in zip(values_total, values)]
-        results.append(values)  # Add individual test results to the list
+    building = create_building(clock, plan=plan)
+    return await run_simulation(building, transport, on_step=update_dashboard, trace=trace, crowd=crowd is not None, num_occupants=crowd,
+                                responders_per_role=responders_per_role)
 
-    # Calculate averages and summaries
-    avg_evacuation_time = values_total[9] / n if n > 0 else 0
-    avg_response_time = values_total[10] / n if n > 0 else 0
-    summary = {
-        "Fires Extinguished": f"{values_total[0]}/{values_total[1]}",
-        "Earthquakes Resolved": f"{values_total[2]}/{values_total[3]}",
-        "Attacks Controlled": f"{values_total[4]}/{values_total[5]}",
-        "Agents Evacuated": f"{values_total[6]}/{values_total[7]}",
-        "Average Evacuation Time": avg_evacuation_time,
-        "Problems Solved by Responders": values_total[8],
-        "Average Responder Time": avg_response_time
-    }
+# Dashboard of a finished run, read from the trace it was recorded in
+def replay_main(path):
+    global feed
+    feed = ReplayFeed(Replay(path))
+    replay_slider.max = feed.replay.last_tick
+    replay_slider.value = feed.replay.last_tick
+    replay_controls.style = {"marginBottom": "30px", "padding": "20px", "borderRadius": "15px", "backgroundColor": "#D5DBDB"}
+    run_dash(app)
 
-    # Save results to a CSV file
-    with open("original_results.csv", "w", newline="") as file:
-        writer = csv.writer(file)
-        # Write the header
-        writer.writerow([
-            "Test", "Fires Extinguished", "Earthquakes Resolved", "Attacks Controlled",
-            "Agents Evacuated", "Average Evacuation Time", "Problems Solved",
-            "Average Responder Time"
-        ])
-        # Write individual test results
-        for i, result in enumerate(results):
-            writer.writerow([i + 1] + result)
-        # Write summary row
-        writer.writerow([])
-        writer.writerow(["Summary"] + list(summary.values()))
+def update_dashboard(building):
+    # Publish this tick's snapshot, the dashboard picks it up on its next refresh
+    global feed
+    if feed is None:
+        feed = DashboardFeed(building)
+    feed.publish(building)
 
-    print("Results saved to 'original_results.csv'.")
+# Batch of 50 runs without dashboard, executed in parallel by batch.py
+def run_tests(n=50):
+    return run_batch(n, "original_results.csv")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Evacuation simulation dashboard")
+    parser.add_argument("--replay", default=None, help="trace file of a finished run to seek through instead of running a new one")
+    parser.add_argument("--trace", default=None, help="record the run in this trace file")
+    parser.add_argument("--crowd", type=int, default=None, help="move this many occupants as one vectorized crowd instead of one agent each")
+    parser.add_argument("--plan", default=None, help="JSON floor plan of a real site to evacuate instead of a random building")
+    parser.add_argument("--responders", type=int, default=1, help="number of emergency responders of each job")
+    parser.add_argument("--metrics", action="store_true", help="instrument the run, counters and timers are served at /metrics and /metrics.json")
+    parser.add_argument("--log-level", default="info", choices=list(logs.LEVELS), help="debug also logs every move, off logs nothing")
+    parser.add_argument("--log-file", default=None, help="also write the logs to this file as JSON lines, from a background thread")
+    args = parser.parse_args()
+    logs.configure(args.log_level, args.log_file)
+    if args.metrics:
+        instrumentation.enable()
+    if args.replay:
+        replay_main(args.replay)
+    else:
+        asyncio.run(main(trace=args.trace, crowd=args.crowd, responders_per_role=args.responders, plan=args.plan))
 
@@ -0,0 +1,78 @@
+import asyncio
+from spade.message import Message
+from spade.template import Template
+
+# Kinds of messages exchanged by the agents, carried in the "kind" metadata field
+EVACUATE = "evacuate"  # Management -> occupants: leave the building
+AVOID = "avoid"  # Management -> occupants: rooms to stay out of
+ASSEMBLY_BLOCKED = "assembly_blocked"  # Management -> occupants: an assembly point can't be used anymore
+FIRE = "fire"  # Management -> responders: incident to solve
+EARTHQUAKE = "earthquake"
+ATTACK = "attack"
+PARAMEDICS = "paramedics"  # Management -> responders: someone is hurt in a room
+ELEVATOR_REQUEST = "elevator_request"  # Occupant -> management: rooms are the shaft room it waits in and where it goes
+ELEVATOR_GRANTED = "elevator_granted"  # Management -> occupant: you got on the car
+ELEVATOR_ARRIVED = "elevator_arrived"  # Management -> occupant: the car dropped you off
+INCIDENT_DONE = "incident_done"  # Responder -> management: the incident it was sent to is solved
+
+# Every kind, its position is the code of the kind in the binary trace
+KINDS = (EVACUATE, AVOID, ASSEMBLY_BLOCKED, FIRE, EARTHQUAKE, ATTACK, PARAMEDICS, ELEVATOR_REQUEST, ELEVATOR_GRANTED, INCIDENT_DONE, ELEVATOR_ARRIVED)
+
+# Incident message kind for each hazard name used by the management agent
+HAZARD_KINDS = {"Fire": FIRE, "Earthquake": EARTHQUAKE, "Attack": ATTACK}
+
+
+# Build a message: the kind, the room ids (as a comma separated list) and the dispatcher's incident id go in
+# the metadata, the body keeps a human readable version for the logs
+def make_message(to, kind, rooms=(), body=None, incident=None):
+    msg = Message(to=str(to) if to is not None else None)
+    msg.set_metadata("kind", kind)
+    if rooms:
+        msg.set_metadata("rooms", ",".join(str(room.id) for room in rooms))
+    if incident is not None:
+        msg.set_metadata("incident", str(incident))
+    msg.body = body if body is not None else kind
+    return msg
+
+
+def message_kind(msg):
+    return msg.get_metadata("kind")
+
+
+def message_room_ids(msg):
+    rooms = msg.get_metadata("rooms")
+    return [int(room_id) for room_id in rooms.split(",")] if rooms else []
+
+
+# Incident a responder is sent to or reports on, None if the message is not about one
+def message_incident(msg):
+    incident = msg.get_metadata("incident")
+    return int(incident) if incident else None
+
+
+# Rooms named by a message, looked up by id in the building
+def message_rooms(msg, building):
+    return [building.get_room_by_id(room_id) for room_id in message_room_ids(msg)]
+
+
+# Template matching the messages of one kind, to route them to a single behaviour
+def kind_template(kind):
+    return Template(metadata={"kind": kind})
+
+
+# Send the same message to many agents at once. On an in-process bus the message is built once, without a
+# recipient, and put as it is in the mailbox of every recipient (InMemoryTransport.deliver_all): no address to
+# parse nor SPADE send per recipient, and one entry in the sender's trace. Over XMPP every recipient gets its own
+# message, the sends run concurrently. Returns the number of messages sent.
+async def broadcast(behaviour, recipients, kind, rooms=(), body=None):
+    transport = getattr(behaviour.agent, "transport", None)
+    if transport is not None and transport.in_process:
+        msg = make_message(None, kind, rooms, body)
+        msg.sender = str(behaviour.agent.jid)
+        sent = transport.deliver_all(msg, recipients)
+        msg.sent = True
+        behaviour.agent.traces.append(msg, category=str(behaviour))
+        return sent
+    sends = [behaviour.send(make_message(jid, kind, rooms, body)) for jid in recipients]
+    await asyncio.gather(*sends)
+    return len(sends)
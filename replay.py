@@ -0,0 +1,117 @@
+import json
+import mmap
+import random
+import numpy as np
+from clock import VirtualClock
+from environment import Building
+from floorplan import FloorPlan
+import eventtrace
+
+
+# An agent as found in a trace: where it is, and when it got out
+class ReplayAgent:
+    def __init__(self, jid, name, role, mobility=None, job=None):
+        self.jid = jid
+        self.agent_name = name
+        self.responder_name = name
+        self.role = role
+        self.mobility = mobility
+        self.job = job
+        self.location = None
+        self.is_evacuated = False
+        self.finish_time = None
+
+
+# Last value of every key, for records in order
+def _last(keys, values):
+    keys, index = np.unique(keys[::-1], return_index=True)
+    return keys, values[::-1][index]
+
+
+# Reads a trace file written by eventtrace.TraceWriter, and rebuilds the building at any tick without running the agents
+class Replay:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, length = eventtrace.HEADER.unpack_from(self.map, 0)
+        if magic != eventtrace.MAGIC or version != eventtrace.VERSION:
+            raise ValueError(f"{path} is not a version {eventtrace.VERSION} evacuation trace")
+        self.description = json.loads(self.map[eventtrace.HEADER.size:eventtrace.HEADER.size + length])
+        offset = eventtrace.HEADER.size + length
+        offset += -offset % eventtrace.RECORD.itemsize
+        count = (len(self.map) - offset) // eventtrace.RECORD.itemsize
+        self.records = np.frombuffer(self.map, dtype=eventtrace.RECORD, count=count, offset=offset)
+        self.last_tick = int(self.records["tick"][-1]) if count else 0
+
+    # Records of everything that happened up to the end of the tick
+    def until(self, tick):
+        return self.records[:np.searchsorted(self.records["tick"], tick, side="right")]
+
+    # Messages sent during the ticks from start to end (included)
+    def messages(self, start, end):
+        records = self.records[np.searchsorted(self.records["tick"], start, side="left"):np.searchsorted(self.records["tick"], end, side="right")]
+        return records[records["kind"] == eventtrace.MESSAGE]
+
+    def building_at(self, tick):
+        num_floors, rows, cols = self.description["shape"]
+        # Building the structure must not use up the random numbers of whoever is replaying
+        random_state = random.getstate()
+        try:
+            plan = FloorPlan.load(self.description["plan"]) if self.description.get("plan") else None
+            building = Building(VirtualClock(self.description["begin"]), num_floors, rows, cols, len(self.description["assembly_points"]), plan)
+        finally:
+            random.setstate(random_state)
+        for kind, positions in self.description["shafts"].items():
+            if positions:
+                building.connect_shafts(kind, len(positions), [tuple(position) for position in positions])
+        building.assembly_points = [building.get_room_by_id(room_id) for room_id in self.description["assembly_points"]]
+        building.begin = self.description["begin"]
+        building.tick = tick
+
+        records = self.until(tick)
+        kinds = records["kind"]
+
+        # Room ids are the flat indexes of the state arrays
+        hazards = records[kinds == eventtrace.HAZARD]
+        for bit, name in eventtrace.HAZARD_FLAGS.items():
+            changes = hazards[hazards["sub"] == bit]
+            rooms, values = _last(changes["a"], changes["b"])
+            getattr(building.state, name).flat[rooms] = values.astype(bool)
+
+        counters = records[kinds == eventtrace.COUNTER]
+        indexes, values = _last(counters["sub"], counters["a"])
+        for index, value in zip(indexes.tolist(), values.tolist()):
+            [building.num_fires, building.num_earthquakes, building.num_attacks][index // 2][index % 2] = value
+
+        responses = records[kinds == eventtrace.RESPONSE]
+        for duration in (responses["b"] / 1000).tolist():
+            building.response_stats.add(duration)
+        building.responses = building.response_stats.count
+
+        agents = [ReplayAgent(a["jid"], a["name"], a["role"], a["mobility"], a["job"]) for a in self.description["agents"]]
+        moves = records[kinds == eventtrace.MOVE]
+        indexes, last = _last(moves["a"], np.arange(len(moves)))
+        for index, k in zip(indexes.tolist(), last.tolist()):
+            if index < 0:
+                continue
+            agent = agents[index]
+            if moves["b"][k] >= 0:
+                agent.location = building.get_room_by_id(int(moves["b"][k]))
+            else:
+                agent.location = "Evacuated"
+                agent.is_evacuated = True
+                agent.finish_time = float(moves["time"][k])
+                building.add_evacuation_time(agent.finish_time)
+        for agent in agents:
+            if agent.role == "occupant":
+                building.add_agent(agent)
+            elif agent.role == "responder":
+                building.add_emergency_agent(agent)
+            else:
+                building.management_agents[agent.jid] = agent
+        return building
+
+    def close(self):
+        self.records = None
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,202 @@
+import heapq
+from collections import OrderedDict, deque
+
+INF = float("inf")
+
+
+# Shortest-path routing over the room graph.
+# For every target room (assembly points, elevators, staircases and, on demand, any other room) it keeps a
+# distance field: the number of moves from each room of the target's floor to the target, walking through
+# `connections` and never entering a blocked room. Changing floors goes through `elevator_connections` and
+# `staircase_connections`. Agents then pick their next room by looking up the field of their few neighbours.
+# Blocking or unblocking a room only repairs the part of each field whose shortest paths went through it.
+class RoutingEngine:
+    def __init__(self, building, max_free_fields=256):
+        self.building = building
+        self.blocked = set()  # Ids of the rooms agents must avoid
+        self.blocked_by_floor = {}  # Floor number -> local indexes of its blocked rooms
+        self.fields = {}  # Target room id -> distance field avoiding blocked rooms (kept up to date)
+        self.free_fields = OrderedDict()  # Target room id -> distance field ignoring blocks (responders), LRU
+        self.max_free_fields = max_free_fields
+        self.neighbors = {}  # Floor number -> adjacency list of local room indexes
+        self.version = 0  # Bumped whenever the fields avoiding blocked rooms change, for whoever keeps copies of them
+
+    # Eagerly compute the fields of the rooms occupants head to
+    def precompute(self):
+        for room in self.building.assembly_points:
+            self.field(room)
+        for floor in self.building.floors:
+            for shaft in floor.elevators + floor.staircases:
+                self.field(shaft)
+
+    def _floor(self, room):
+        return self.building.get_floor(room.floor)
+
+    def _local(self, room):
+        return room.local
+
+    def _neighbors(self, floor):
+        adjacency = self.neighbors.get(floor.floor_number)
+        if adjacency is None:
+            adjacency = self.neighbors[floor.floor_number] = floor.adjacency()
+        return adjacency
+
+    def _blocked_local(self, floor):
+        return self.blocked_by_floor.setdefault(floor.floor_number, set())
+
+    # Breadth-first search from the target
+    def _compute(self, target, avoid):
+        floor = self._floor(target)
+        adjacency = self._neighbors(floor)
+        blocked = self._blocked_local(floor) if avoid else set()
+        field = [INF] * len(adjacency)
+        start = self._local(target)
+        if start in blocked:
+            return field
+        field[start] = 0
+        queue = deque([start])
+        while queue:
+            u = queue.popleft()
+            d = field[u] + 1
+            for v in adjacency[u]:
+                if field[v] == INF and v not in blocked:
+                    field[v] = d
+                    queue.append(v)
+        return field
+
+    def field(self, target, avoid=True):
+        if avoid:
+            field = self.fields.get(target.id)
+            if field is None:
+                field = self.fields[target.id] = self._compute(target, True)
+            return field
+        field = self.free_fields.get(target.id)
+        if field is None:
+            field = self.free_fields[target.id] = self._compute(target, False)
+            if len(self.free_fields) > self.max_free_fields:
+                self.free_fields.popitem(last=False)
+        else:
+            self.free_fields.move_to_end(target.id)
+        return field
+
+    def remove_target(self, target):
+        self.fields.pop(target.id, None)
+        self.version += 1
+
+    # Number of moves from room to target on the same floor, INF if there is no path
+    def floor_distance(self, room, target, avoid=True):
+        if room.floor != target.floor:
+            return INF
+        return self.field(target, avoid)[self._local(room)]
+
+    # Moves from room to target, changing floors through an elevator or staircase of room's floor
+    def distance(self, room, target, avoid=True, methods=("elevator", "staircase")):
+        if room.floor == target.floor:
+            return self.floor_distance(room, target, avoid)
+        return self.nearest_shaft(room, target, avoid, methods)[0]
+
+    # (moves, shaft room) of the best elevator or staircase to take from room to reach target on another floor
+    def nearest_shaft(self, room, target, avoid=True, methods=("elevator", "staircase")):
+        floor = self._floor(room)
+        best, best_shaft = INF, None
+        for method in methods:
+            for shaft in (floor.elevators if method == "elevator" else floor.staircases):
+                arrival = self.building.get_room(target.floor - 1, shaft.coordinates[1], shaft.coordinates[2])
+                d = self.floor_distance(room, shaft, avoid) + abs(room.floor - target.floor) + self.floor_distance(arrival, target, avoid)
+                if d < best or best_shaft is None:
+                    best, best_shaft = d, shaft
+        return best, best_shaft
+
+    # Neighbour of room that is one move closer to target, None if target can't be reached
+    def next_room(self, room, target, avoid=True):
+        if room.floor != target.floor:
+            return None
+        field = self.field(target, avoid)
+        best = None
+        best_distance = INF
+        for neighbor in room.connections:
+            d = field[neighbor.local]
+            if d < best_distance:
+                best, best_distance = neighbor, d
+        return best
+
+    def block(self, room):
+        if room.id in self.blocked:
+            return
+        self.blocked.add(room.id)
+        self.version += 1
+        floor = self._floor(room)
+        self._blocked_local(floor).add(self._local(room))
+        for target_id, field in self.fields.items():
+            if self.building.rooms[target_id].floor == room.floor:
+                self._repair_block(floor, field, self._local(room))
+
+    def unblock(self, room):
+        if room.id not in self.blocked:
+            return
+        self.blocked.discard(room.id)
+        self.version += 1
+        floor = self._floor(room)
+        self._blocked_local(floor).discard(self._local(room))
+        for target_id, field in self.fields.items():
+            target = self.building.rooms[target_id]
+            if target.floor != room.floor:
+                continue
+            if target_id == room.id:
+                self.fields[target_id] = self._compute(target, True)
+            else:
+                self._repair_unblock(floor, field, self._local(room))
+
+    # Invalidate the rooms whose every shortest path went through the blocked room, then settle them again
+    def _repair_block(self, floor, field, local):
+        if field[local] == INF:
+            return
+        adjacency = self._neighbors(floor)
+        blocked = self._blocked_local(floor)
+        invalid = {local: field[local]}
+        field[local] = INF
+        queue = deque([local])
+        while queue:
+            u = queue.popleft()
+            du = invalid[u]
+            for v in adjacency[u]:
+                if v in invalid or field[v] != du + 1:
+                    continue
+                # v keeps its distance if another parent one move closer is still valid
+                if any(field[w] == du for w in adjacency[v]):
+                    continue
+                invalid[v] = field[v]
+                field[v] = INF
+                queue.append(v)
+
+        heap = []
+        for v in invalid:
+            if v in blocked:
+                continue
+            d = min((field[w] + 1 for w in adjacency[v]), default=INF)
+            if d < INF:
+                heapq.heappush(heap, (d, v))
+        while heap:
+            d, v = heapq.heappop(heap)
+            if d >= field[v]:
+                continue
+            field[v] = d
+            for w in adjacency[v]:
+                if w in invalid and w not in blocked and d + 1 < field[w]:
+                    heapq.heappush(heap, (d + 1, w))
+
+    # The room is walkable again: lower the distances it can now shorten
+    def _repair_unblock(self, floor, field, local):
+        adjacency = self._neighbors(floor)
+        blocked = self._blocked_local(floor)
+        d = min((field[w] + 1 for w in adjacency[local]), default=INF)
+        if d >= field[local]:
+            return
+        field[local] = d
+        queue = deque([local])
+        while queue:
+            u = queue.popleft()
+            for v in adjacency[u]:
+                if v not in blocked and field[u] + 1 < field[v]:
+                    field[v] = field[u] + 1
+                    queue.append(v)
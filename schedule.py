@@ -0,0 +1,53 @@
+import random
+import numpy as np
+
+# Chance per tick of each random event, as in Building.trigger_random_event
+EVENT_CHANCES = (("fire", 0.07), ("earthquake", 0.05), ("attack", 0.05))
+
+_MASK = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+# SplitMix64 finalizer, turns counters into well mixed 64-bit values
+def _mix(x):
+    x = (x + np.uint64(0x9E3779B97F4A7C15)) & _MASK
+    x = ((x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)) & _MASK
+    x = ((x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)) & _MASK
+    return x ^ (x >> np.uint64(31))
+
+
+# The hazards of a run drawn in advance from their own seed, so that runs of the same building with different agent
+# policies face exactly the same events (common random numbers).
+#   events(tick): the (kind, flat room index, light goes off) random events of a tick, drawn tick by tick from one
+#     stream and kept, so a tick always gets the same events whatever happened before
+#   uniforms(tick, rooms, channel): the fire spread draws, a pure function of (seed, tick, room, direction), so a
+#     burning room gets the same draws whichever other rooms are burning
+# rooms: flat indexes of the cells that are rooms (Building.room_ids), None when all num_rooms cells are
+class HazardSchedule:
+    def __init__(self, seed, num_rooms, ticks=0, rooms=None):
+        self.seed = seed
+        self.num_rooms = num_rooms
+        self.rooms = rooms
+        self.random = random.Random(f"hazard schedule {seed}")  # Not the same stream as random.seed(seed)
+        self.ticks = []
+        self.key = np.uint64(seed & 0xFFFFFFFFFFFFFFFF)
+        self.sample(ticks)
+
+    # Draw the events of the ticks up to `ticks` (the first tick is 1)
+    def sample(self, ticks):
+        while len(self.ticks) < ticks:
+            events = []
+            for kind, chance in EVENT_CHANCES:
+                if self.random.random() < chance:
+                    room = self.random.randrange(self.num_rooms) if self.rooms is None else int(self.rooms[self.random.randrange(len(self.rooms))])
+                    light_off = kind == "earthquake" and self.random.random() < 0.5
+                    events.append((kind, room, light_off))
+            self.ticks.append(events)
+
+    def events(self, tick):
+        self.sample(tick)
+        return self.ticks[tick - 1]
+
+    def uniforms(self, tick, rooms, channel):
+        counter = (np.asarray(rooms, dtype=np.uint64) * np.uint64(64) + np.uint64(channel)) ^ (np.uint64(tick) << np.uint64(40))
+        bits = _mix(_mix(counter ^ self.key))
+        return (bits >> np.uint64(11)).astype(np.float64) * (1.0 / 9007199254740992.0)
@@ -0,0 +1,140 @@
+import asyncio
+import random
+from environment import Building
+from agents import OccupantAgent, EmergencyResponderAgent, BuildingManagementAgent
+from clock import RealClock, VirtualClock
+from transport import InMemoryTransport
+from crowd import Crowd, CrowdAgent
+from elevator import ElevatorSystem
+from planner import EvacuationPlanner
+from floorplan import FloorPlan
+import instrumentation
+import logs
+
+run_log = logs.get("run")
+
+# (jid, name, job) of the emergency responders
+RESPONDERS = [
+    ("responder1@localhost", "Fire-fighter", "firefighter"),
+    ("responder2@localhost", "Rescue Worker", "Rescue Worker"),
+    ("responder3@localhost", "Paramedic", "Paramedic"),
+    ("responder4@localhost", "Security Officer", "Security Officer"),
+]
+
+
+# Building of a run: floors, grid size, shafts and assembly points left to None are picked at random.
+# elevator_capacity, elevator_floor_time: people per car and seconds per floor of the elevator cars
+# plan: JSON floor plan file (see floorplan) or FloorPlan of a real site, which gives the floors, shafts and
+# assembly points instead
+# precompute_routes: compute the routing fields of every assembly point and shaft now, instead of on their first
+# use (RoutingEngine.field); seconds on a 200-floor 200x200 building
+def create_building(clock=None, num_floors=None, rows=None, cols=None, elevators=1, staircases=1, num_assembly_points=2, precompute_routes=False,
+                    elevator_capacity=8, elevator_floor_time=2.0, plan=None):
+    if isinstance(plan, str):
+        plan = FloorPlan.load(plan)
+    building = Building(clock, num_floors, rows, cols, num_assembly_points, plan)
+    building.elevators = ElevatorSystem(building, elevator_capacity, elevator_floor_time)
+    if plan is not None:
+        building.connect_elevators(len(plan.shafts["elevator"]), plan.shafts["elevator"])
+        building.connect_staircases(len(plan.shafts["staircase"]), plan.shafts["staircase"])
+    else:
+        building.connect_elevators(elevators)
+        building.connect_staircases(staircases)
+    if precompute_routes:
+        building.routing.precompute()
+    return building
+
+
+# Create every agent of a run and add it to the building, in the order they are started
+# crowd: move the occupants in arrays (crowd.Crowd) with one agent for all of them, instead of one agent each;
+# num_occupants: number of occupants, 4 to 8 at random if not given; responders_per_role: responders of each job
+# policy "planned": the able-bodied occupants follow the routes of a planner.EvacuationPlanner, in a crowd too
+def create_agents(building, transport=None, policy="standard", crowd=False, num_occupants=None, responders_per_role=1):
+    num_agents = num_occupants if num_occupants is not None else random.randint(4,8)
+    agents = []
+    if policy == "planned":
+        building.planner = EvacuationPlanner(building)
+    if crowd:
+        building.crowd = Crowd(building, num_agents)
+        if building.planner is not None:
+            building.planner.capacity = building.crowd.capacity or building.planner.capacity
+            building.crowd.planner = building.planner
+        for member in building.crowd.members:
+            building.add_agent(member)
+        agents.append(CrowdAgent(building.crowd.jid, "password", building.crowd, transport))
+    else:
+        for i in range(num_agents):
+            jid = f"occupant{i+1}@localhost"
+            name = f"Agent {i+1}"
+            status = "able-bodied" if i % 2 == 0 else "disabled"
+            agent = OccupantAgent(jid, "password", name, building, status, transport, policy)
+            building.add_agent(agent)
+            agents.append(agent)
+    for team in range(responders_per_role):
+        for k, (jid, name, job) in enumerate(RESPONDERS):
+            if team > 0:
+                jid = f"responder{team * len(RESPONDERS) + k + 1}@localhost"
+                name = f"{name} {team + 1}"
+            agent = EmergencyResponderAgent(jid, "password", name, building, job, transport)
+            building.add_emergency_agent(agent)
+            agents.append(agent)
+    agent = BuildingManagementAgent("management@localhost", "password", building, "Building Management", transport)
+    building.add_management_agent(agent)
+    agents.append(agent)
+    return agents
+
+
+# Run one evacuation until every occupant is out, on_step is called after every simulation tick
+# trace: path of a binary trace file to record the run in, for replay.Replay
+# policy: routing policy of the occupants; max_ticks: give up after that many ticks and return None
+# crowd, num_occupants, responders_per_role: see create_agents
+async def run_simulation(building, transport=None, on_step=None, trace=None, policy="standard", max_ticks=None, crowd=False, num_occupants=None,
+                         responders_per_role=1):
+    agents = create_agents(building, transport, policy, crowd, num_occupants, responders_per_role)
+    if trace is not None:
+        building.start_trace(trace)
+    for agent in agents:
+        await agent.start(auto_register=True)
+    watcher = asyncio.ensure_future(instrumentation.watch_loop(building.clock)) if instrumentation.registry.enabled else None
+
+    # Agents are stopped even if a step fails: SPADE behaviours keep running through task cancellation
+    try:
+        while not building.is_building_evacuated():
+            if max_ticks is not None and building.tick >= max_ticks:
+                break
+            building.simulate_step()
+            await building.wait_evacuated(1)  # One tick, cut short by the last occupant getting out
+            if on_step is not None:
+                on_step(building)
+
+        if building.is_building_evacuated():
+            run_log.info("Every Occupant evacuated! Success!")
+            values = building.performance_metrics()
+        else:
+            run_log.warning("Stopped after %s ticks, not every occupant got out.", building.tick)
+            values = None
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        for agent in agents:
+            await agent.stop()
+        building.stop_trace()
+    return values
+
+
+# Run one evacuation without dashboard nor XMPP server: in-process message bus and, by default, simulated time
+def run_headless(seed=None, virtual=True, trace=None, policy="standard", max_ticks=None, crowd=False, num_occupants=None, responders_per_role=1, plan=None):
+    if seed is not None:
+        random.seed(seed)
+    clock = VirtualClock() if virtual else RealClock()
+
+    async def run():
+        building = create_building(clock, plan=plan)
+        return await run_simulation(building, InMemoryTransport(), trace=trace, policy=policy, max_ticks=max_ticks,
+                                    crowd=crowd, num_occupants=num_occupants, responders_per_role=responders_per_role)
+
+    return clock.run(run())
+
+
+if __name__ == "__main__":
+    run_headless()
@@ -0,0 +1,89 @@
+import math
+
+'''
+_____________________________________________________________________________________________________________________
+Where the agents are, kept up to date on every move (see Building.agent_moved) instead of looking at every agent
+for each question: the agents in each room, and the agents of each floor in square buckets of rooms, to find the
+one closest to a room without measuring the distance to all of them.
+'''
+
+
+# Agents by room and by bucket of `cell` x `cell` rooms of each floor.
+#   in_room: the agents in a room, in the order they came in, O(1)
+#   nearest: the agent closest to a room by Room.distance_to (floors, rows and columns apart). The buckets are
+#     looked at ring by ring around the room, the closest floors first, and the search stops as soon as no bucket
+#     left can hold anyone closer, so it only measures the agents around the room.
+class AgentIndex:
+    def __init__(self, cell=4):
+        self.cell = cell
+        self.rooms = {}  # Room id -> {agent: None} of the agents in it
+        self.floors = {}  # Floor number -> {(row bucket, col bucket): {agent: room}}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _bucket(self, room):
+        return room.coordinates[1] // self.cell, room.coordinates[2] // self.cell
+
+    def add(self, agent, room):
+        self.rooms.setdefault(room.id, {})[agent] = None
+        self.floors.setdefault(room.floor, {}).setdefault(self._bucket(room), {})[agent] = room
+        self.count += 1
+
+    def remove(self, agent, room):
+        agents = self.rooms.get(room.id)
+        if agents is None or agents.pop(agent, False) is False:
+            return  # Not indexed there
+        if not agents:
+            del self.rooms[room.id]
+        buckets = self.floors[room.floor]
+        key = self._bucket(room)
+        del buckets[key][agent]
+        if not buckets[key]:
+            del buckets[key]
+            if not buckets:
+                del self.floors[room.floor]
+        self.count -= 1
+
+    def in_room(self, room):
+        return list(self.rooms.get(room.id, ()))
+
+    # (distance, agent) of the agent closest to room, any of them on ties; (inf, None) without agents
+    def nearest(self, room):
+        best, closest = math.inf, None
+        row, col = self._bucket(room)
+        for floor in sorted(self.floors, key=lambda number: abs(number - room.floor)):
+            apart = abs(floor - room.floor)
+            if apart >= best:
+                break  # Every other floor is even farther
+            buckets = self.floors[floor]
+            seen = 0
+            ring = 0
+            while seen < len(buckets):
+                # Rooms of the buckets of the ring are at least (ring - 1) * cell + 1 rows or columns away
+                if ring > 0 and apart + (ring - 1) * self.cell + 1 >= best:
+                    break
+                if 8 * ring >= len(buckets) - seen:
+                    # Fewer buckets left than in the ring: the ones not seen yet, and the floor is done
+                    keys = [key for key in buckets if max(abs(key[0] - row), abs(key[1] - col)) >= ring]
+                else:
+                    keys = [key for key in self._ring(row, col, ring) if key in buckets]
+                for key in keys:
+                    for agent, where in buckets[key].items():
+                        distance = room.distance_to(where)
+                        if distance < best:
+                            best, closest = distance, agent
+                seen += len(keys)
+                ring += 1
+        return best, closest
+
+    # Buckets at exactly `ring` buckets from (row, col), rows and columns alike
+    @staticmethod
+    def _ring(row, col, ring):
+        if ring == 0:
+            return [(row, col)]
+        top = [(row - ring, c) for c in range(col - ring, col + ring + 1)]
+        bottom = [(row + ring, c) for c in range(col - ring, col + ring + 1)]
+        sides = [(r, c) for r in range(row - ring + 1, row + ring) for c in (col - ring, col + ring)]
+        return top + bottom + sides
@@ -0,0 +1,130 @@
+import bisect
+import math
+
+'''
+_____________________________________________________________________________________________________________________
+Statistics of a stream of values kept in constant memory, updated in O(1) per value and readable at any time:
+count, mean and variance (Welford), min, max, total, and quantiles with the P² algorithm (Jain and Chlamtac), which
+follows a quantile with five markers instead of keeping the values.
+'''
+
+
+# One quantile (p between 0 and 1) of a stream, P² estimate: five markers at the min, p/2, p, (1+p)/2 and the max,
+# moved towards their ideal positions with a parabolic (else linear) interpolation of their neighbours' heights
+class P2Quantile:
+    def __init__(self, p):
+        self.p = p
+        self.heights = []  # The first five values, sorted, then the markers' heights
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                                                            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self):
+        q = self.heights
+        if len(q) == 5:
+            return q[2]
+        return _interpolate(q, self.p) if q else 0.0
+
+
+# Quantile of sorted values with linear interpolation between the closest ranks, like numpy.percentile
+def _interpolate(values, p):
+    rank = p * (len(values) - 1)
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+# Count, total, mean, variance, min, max and the quantiles qs (in percent) of a stream of values.
+# The first `exact` values are also kept, sorted, so the quantiles of a short stream are exact; past that they are
+# the P² estimates, and the memory stays the same however long the stream is.
+class StreamStats:
+    def __init__(self, qs=(50, 90, 99), exact=128):
+        self.qs = qs
+        self.exact = exact
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of the squared differences to the mean
+        self.min = math.inf
+        self.max = -math.inf
+        self.sorted = []
+        self.sketches = [P2Quantile(q / 100) for q in qs]
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        if self.count <= self.exact:
+            bisect.insort(self.sorted, x)
+        else:
+            self.sorted = None
+        for sketch in self.sketches:
+            sketch.add(x)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    # The quantiles qs, 0 for each while the stream is empty
+    def quantiles(self):
+        if self.count == 0:
+            return [0.0 for q in self.qs]
+        if self.sorted is not None:
+            return [_interpolate(self.sorted, q / 100) for q in self.qs]
+        return [sketch.value() for sketch in self.sketches]
+
+    # Everything as plain values, 0 for the mean, min and max of an empty stream
+    def summary(self):
+        empty = self.count == 0
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.mean,
+            "std": self.std,
+            "min": 0.0 if empty else self.min,
+            "max": 0.0 if empty else self.max,
+            **{f"p{q}": value for q, value in zip(self.qs, self.quantiles())},
+        }
+
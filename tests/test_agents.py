@@ -0,0 +1,53 @@
+import asyncio
+import messages
+from clock import VirtualClock
+from transport import InMemoryTransport
+from agents import OccupantAgent
+from simulation import create_building
+
+
+def occupant_behaviour():
+    building = create_building(VirtualClock(), 2, 3, 3)
+    agent = OccupantAgent("occupant1@localhost", "password", "Agent 1", building, "able-bodied", InMemoryTransport())
+    behaviour = OccupantAgent.ReceiveInstructionsBehaviour()
+    behaviour.agent = agent
+    return building, agent, behaviour
+
+
+# Messages other than the elevator's and the notices to avoid rooms are not lost during a ride: they are handled
+# in order once it is over
+def test_messages_during_elevator_ride_are_kept():
+    building, agent, behaviour = occupant_behaviour()
+    arrival = building.get_room(1, 0, 0)
+    inbox = [
+        messages.make_message(agent.jid, messages.EVACUATE),
+        messages.make_message(agent.jid, messages.AVOID, [building.get_room(0, 1, 1)]),
+        messages.make_message(agent.jid, messages.ASSEMBLY_BLOCKED, [building.get_room(0, 2, 2)]),
+        messages.make_message(agent.jid, messages.ELEVATOR_ARRIVED, [arrival]),
+    ]
+    handled = []
+
+    async def receive(timeout=None):
+        return inbox.pop(0) if inbox else None
+
+    async def record(msg):
+        handled.append(messages.message_kind(msg))
+
+    async def request(arrival):
+        pass
+
+    async def ride():
+        await behaviour.on_start()
+        behaviour.receive = receive
+        behaviour.elevator_request = request
+        behaviour.handlers[messages.EVACUATE] = record
+        behaviour.handlers[messages.ASSEMBLY_BLOCKED] = record
+        await behaviour.ride_elevator(arrival)
+        assert agent.location is arrival
+        assert building.get_room(0, 1, 1).name in agent.avoid_rooms
+        await behaviour.run()
+        await behaviour.run()
+        await behaviour.run()
+
+    asyncio.run(ride())
+    assert handled == [messages.EVACUATE, messages.ASSEMBLY_BLOCKED]
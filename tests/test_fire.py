@@ -0,0 +1,60 @@
+import numpy as np
+from environment import Building
+from floorplan import FloorPlan
+
+
+def plan_building(data):
+    return Building(num_assembly_points=1, plan=FloorPlan.parse(data))
+
+
+# Two rows of four rooms, a wall between (0, 1) and (0, 2), a door between (1, 0) and (1, 3): with every connection
+# burning, nothing crosses the wall and the fire goes through the door
+def test_spread_follows_walls_and_doors():
+    building = plan_building({"floors": [{"plan": ["....", "...."], "walls": [[[0, 1], [0, 2]]], "doors": [[[1, 0], [1, 3]]]}]})
+    building.fire.probabilities["horizontal"] = 1.0
+    building.state.is_on_fire[0, 0, 1] = True
+    building.state.is_on_fire[0, 1, 0] = True
+    spread = sorted((int(i), int(j)) for f, i, j in building.fire.step())
+    assert spread == [(0, 0), (1, 1), (1, 3)]
+
+
+def test_spread_skips_cells_that_are_not_rooms():
+    building = plan_building({"floors": [{"plan": [".#.", "..."]}]})
+    building.fire.probabilities["horizontal"] = 1.0
+    building.state.is_on_fire[0, 0, 0] = True
+    spread = sorted((int(i), int(j)) for f, i, j in building.fire.step())
+    assert spread == [(1, 0)]
+
+
+def test_no_spread_without_chance():
+    building = plan_building({"floors": [{"plan": ["...", "..."]}]})
+    for kind in building.fire.probabilities:
+        building.fire.probabilities[kind] = 0.0
+    building.state.is_on_fire[0, 0, 0] = True
+    assert building.fire.step() == []
+    assert np.count_nonzero(building.state.is_on_fire) == 1
+
+
+
+# A room spreads the fire on the first tick it burns only, the rooms it lit spread it on the next one
+def test_rooms_spread_once():
+    building = plan_building({"floors": [{"plan": ["....."]}]})
+    building.fire.probabilities["horizontal"] = 1.0
+    building.state.is_on_fire[0, 0, 0] = True
+    for col in range(1, 5):
+        assert [(int(i), int(j)) for f, i, j in building.fire.step()] == [(0, col)]
+        building.state.is_on_fire[0, 0, col] = True
+    assert building.fire.step() == []
+
+
+# A room put out and lit again spreads the fire again
+def test_relit_room_spreads_again():
+    building = plan_building({"floors": [{"plan": ["..."]}]})
+    building.fire.probabilities["horizontal"] = 1.0
+    building.state.is_on_fire[0, 0, 1] = True
+    assert len(building.fire.step()) == 2
+    assert building.fire.step() == []
+    building.state.is_on_fire[0, 0, 1] = False
+    building.fire.step()
+    building.state.is_on_fire[0, 0, 1] = True
+    assert len(building.fire.step()) == 2
@@ -0,0 +1,97 @@
+import json
+import os
+import numpy as np
+import pytest
+from floorplan import FloorPlan
+
+
+PLAN = {
+    "name": "Site",
+    "floors": [
+        {"plan": ["A...", ".S.#"], "walls": [[[0, 1], [0, 2]]], "doors": [[[0, 0], [1, 2]]]},
+        {"plan": ["....", ".S.."], "repeat": 2},
+    ],
+}
+
+
+def neighbors(layout, row, col):
+    return sorted(layout.neighbors(row * layout.num_cols + col).tolist())
+
+
+def test_parse_walls_doors_and_rooms():
+    plan = FloorPlan.parse(PLAN)
+    ground = plan.layout(0)
+    assert (plan.num_rows, plan.num_cols, plan.num_floors) == (2, 4, 3)
+    assert neighbors(ground, 0, 1) == [0, 5]  # Not across the wall to (0, 2)
+    assert neighbors(ground, 0, 0) == [1, 4, 6]  # Door to (1, 2)
+    assert neighbors(ground, 1, 2) == [0, 2, 5]  # Door back, nothing to the cell that is not a room
+    assert not ground.is_room(7) and neighbors(ground, 1, 3) == []
+    assert plan.shafts == {"elevator": [], "staircase": [(1, 1)]}
+    assert plan.assembly_points == [(0, 0, 0)]
+    assert plan.name == "Site"
+
+
+def test_repeat_shares_the_layout():
+    plan = FloorPlan.parse(PLAN)
+    assert plan.floor_layouts == [0, 1, 1]
+    assert plan.layout(1) is plan.layout(2)
+    assert plan.layout(1).rooms is None
+    assert plan.room_mask().shape == (3, 2, 4)
+
+
+def test_shaft_has_to_be_a_room_on_every_floor():
+    data = {"floors": [{"plan": ["E.."]}, {"plan": ["#.."]}]}
+    with pytest.raises(ValueError, match="elevator shaft"):
+        FloorPlan.parse(data)
+
+
+def test_unknown_cells():
+    with pytest.raises(ValueError, match="unknown cells"):
+        FloorPlan.parse({"floors": [{"plan": [".x."]}]})
+
+
+def same_plan(a, b):
+    assert (a.num_rows, a.num_cols, a.floor_layouts) == (b.num_rows, b.num_cols, b.floor_layouts)
+    assert a.shafts == b.shafts and a.assembly_points == b.assembly_points and a.name == b.name
+    for x, y in zip(a.layouts, b.layouts):
+        assert np.array_equal(x.indptr, y.indptr) and np.array_equal(x.indices, y.indices)
+        assert (x.rooms is None and y.rooms is None) or np.array_equal(x.rooms, y.rooms)
+
+
+def test_cache_is_read_back_and_invalidated(tmp_path, monkeypatch):
+    path = tmp_path / "site.json"
+    path.write_text(json.dumps(PLAN))
+    parsed = FloorPlan.load(str(path))
+    assert os.path.exists(f"{path}.npz")
+
+    # Up to date: read from the cache without parsing
+    with monkeypatch.context() as patch:
+        patch.setattr(FloorPlan, "parse", classmethod(lambda cls, data, path=None: pytest.fail("parsed again")))
+        same_plan(FloorPlan.load(str(path)), parsed)
+
+    # The JSON file changes: parsed again, and the cache rewritten for the new version
+    changed = {"floors": [{"plan": ["..S", "..."]}]}
+    path.write_text(json.dumps(changed))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    plan = FloorPlan.load(str(path))
+    same_plan(plan, FloorPlan.parse(changed))
+    assert plan.num_cols == 3
+    with monkeypatch.context() as patch:
+        patch.setattr(FloorPlan, "parse", classmethod(lambda cls, data, path=None: pytest.fail("parsed again")))
+        same_plan(FloorPlan.load(str(path)), plan)
+
+
+def test_unreadable_cache_is_rewritten(tmp_path):
+    path = tmp_path / "site.json"
+    path.write_text(json.dumps(PLAN))
+    (tmp_path / "site.json.npz").write_bytes(b"not a cache")
+    same_plan(FloorPlan.load(str(path)), FloorPlan.parse(PLAN))
+    same_plan(FloorPlan.load(str(path)), FloorPlan.parse(PLAN))
+
+
+def test_load_without_cache(tmp_path):
+    path = tmp_path / "site.json"
+    path.write_text(json.dumps(PLAN))
+    FloorPlan.load(str(path), cache=False)
+    assert not os.path.exists(f"{path}.npz")
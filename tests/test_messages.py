@@ -0,0 +1,16 @@
+import asyncio
+from benchmark import bench_notifications
+
+
+# One coalesced broadcast per occupant carries every room of the burst, on the in-memory bus the same message
+# goes to all of them
+def test_broadcast_reaches_every_occupant():
+    result = asyncio.run(bench_notifications(50, 5, coalesce=True, timeout=10))
+    assert result["messages"] == 50
+    assert result["notified"] == 250
+
+
+def test_sequential_notices():
+    result = asyncio.run(bench_notifications(20, 3, coalesce=False, timeout=10))
+    assert result["messages"] == 60
+    assert result["notified"] == 60
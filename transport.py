@@ -0,0 +1,101 @@
+import asyncio
+import spade
+
+
+# Transport used by the dashboard runs: agents connect (and register) to the XMPP server on localhost
+# and SPADE sends the messages, as it always did
+class XMPPTransport:
+    name = "xmpp"
+    in_process = False
+
+    def register(self, agent):
+        pass
+
+    async def start(self, agent, auto_register):
+        await spade.agent.Agent._async_start(agent, auto_register=auto_register)
+
+    async def stop(self, agent):
+        await spade.agent.Agent._async_stop(agent)
+
+
+# In-process message bus: no XMPP server, every message is put straight into the mailbox
+# (asyncio queue) of the behaviours of the agent with that JID.
+# Behaviours keep using self.send(msg) and self.receive(timeout=...) unchanged.
+class InMemoryTransport:
+    name = "memory"
+    in_process = True
+
+    def __init__(self):
+        self.agents = {}  # JID -> agent
+        self.sent = 0
+        self.dropped = 0
+
+    def register(self, agent):
+        self.agents[str(agent.jid)] = agent
+        # SPADE behaviours send through agent.container, so the bus takes the container's place
+        agent.set_container(self)
+        agent.set_loop(asyncio.get_event_loop())
+
+    def unregister(self, jid):
+        self.agents.pop(str(jid), None)
+
+    async def start(self, agent, auto_register):
+        # Same startup sequence as a SPADE agent, minus the server connection
+        await agent.setup()
+        agent._alive.set()
+        for behaviour in agent.behaviours:
+            if not behaviour.is_running:
+                behaviour.set_agent(agent)
+                behaviour.start()
+
+    async def stop(self, agent):
+        for behaviour in agent.behaviours:
+            behaviour.kill()
+        agent._alive.clear()
+        self.unregister(agent.jid)
+
+    # Called by CyclicBehaviour.send (same signature as spade.container.Container.send)
+    async def send(self, msg, behaviour):
+        self.deliver(msg)
+
+    def deliver(self, msg):
+        agent = self.agents.get(str(msg.to))
+        if agent is None:
+            self.dropped += 1
+            return
+        self.sent += 1
+        self._put(agent, msg)
+
+    # The same message into the mailbox of each recipient (messages.broadcast): nothing is built or parsed per
+    # recipient. Returns the number of recipients on the bus
+    def deliver_all(self, msg, recipients):
+        delivered = 0
+        for jid in recipients:
+            agent = self.agents.get(str(jid))
+            if agent is None:
+                self.dropped += 1
+                continue
+            delivered += 1
+            self._put(agent, msg)
+        self.sent += delivered
+        return delivered
+
+    @staticmethod
+    def _put(agent, msg):
+        for receiver in agent.behaviours:
+            if receiver.queue is not None and receiver.match(msg):
+                receiver.queue.put_nowait(msg)
+
+
+# Base class of every agent of the simulation, it picks how the agent is started and how its messages travel
+class TransportAgent(spade.agent.Agent):
+    def __init__(self, jid, password, transport=None):
+        super().__init__(jid, password)
+        self.transport = transport if transport is not None else XMPPTransport()
+        self.transport.register(self)
+
+    async def _async_start(self, auto_register=True):
+        await self.transport.start(self, auto_register)
+
+    async def _async_stop(self):
+        await self.transport.stop(self)